@@ -10,6 +10,8 @@ from .compilation import (
     compile_link_import_py_ext, compile_link_import_strings
 )
 
+from .pgo import compile_link_import_py_ext_pgo
+
 from .util import (
     missing_or_other_newer, md5_of_file,
     import_module_from_file, CompilationError, FileNotFoundError
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""
+Command line interface, e.g.::
+
+    $ python -m pycompilation cache stats
+    $ python -m pycompilation serve-cache --port 8765
+
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import argparse
+import sys
+
+from . import cache
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pycompilation')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    cache.add_arguments(commands.add_parser(
+        'cache', help='manage the on-disk cache'))
+    serve_parser = commands.add_parser(
+        'serve-cache', help='run a remote cache server (see '
+        'pycompilation.remote_cache)')
+    serve_parser.add_argument('--directory', default=None,
+                              help='storage (default: temporary directory)')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args(argv)
+    if args.command == 'cache':
+        return cache.main(args)
+    elif args.command == 'serve-cache':
+        from .remote_cache import RemoteCacheServer
+        server = RemoteCacheServer(args.directory, args.host, args.port)
+        print('Serving {} at {}'.format(server.directory, server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+Batching of many small generated C kernels into one extension module.
+
+Each kernel is written to its own C file (compiled in parallel, and only
+when its source changed) while a single Cython wrapper exposing one entry
+point per kernel is generated. The result is one shared object (one link,
+one ``dlopen``) regardless of the number of kernels.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+
+from .compilation import (
+    build_key, compile_link_import_py_ext, write_code_string
+)
+from .prototypes import cimport_lines, parse_prototype, format_prototype
+from .util import md5_of_string
+
+
+def _wrapper_function(proto):
+    """ Returns Cython code for a def function calling proto. """
+    lines = ['def {}({}):'.format(proto.name, ', '.join(
+        '{}{}[::1] {}'.format('const ' if a.const else '', a.ctype, a.name)
+        if a.pointer else '{} {}'.format(a.ctype, a.name)
+        for a in proto.args))]
+    call_args = []
+    for a in proto.args:
+        if a.pointer:
+            lines.append('    cdef {}{} *_{} = NULL'.format(
+                'const ' if a.const else '', a.ctype, a.name))
+            lines.append('    if {0}.shape[0] > 0:'.format(a.name))
+            lines.append('        _{0} = &{0}[0]'.format(a.name))
+            call_args.append('_' + a.name)
+        else:
+            call_args.append(a.name)
+    call = '_k_{}({})'.format(proto.name, ', '.join(call_args))
+    lines.append('    ' + (call if proto.restype == 'void' else
+                           'return ' + call))
+    return '\n'.join(lines)
+
+
+def batch_wrapper_code(prototypes, header):
+    """
+    Generates the Cython source of a wrapper module for prototypes.
+
+    Parameters
+    ----------
+    prototypes: iterable of Prototype instances
+    header: string
+        name of C header declaring the kernels
+    """
+    prototypes = list(prototypes)
+    used = set(a.ctype for p in prototypes for a in p.args) | set(
+        p.restype for p in prototypes)
+    lines = ['# -*- coding: utf-8 -*-',
+             '# Generated by pycompilation.batch, do not edit.', '']
+    lines += cimport_lines(used)
+    lines += ['', 'cdef extern from "{}":'.format(header)]
+    for p in prototypes:
+        lines.append('    {} nogil'.format(format_prototype(
+            p, name='_k_{0} "{0}" '.format(p.name))))
+    lines.append('')
+    lines.append('__kernels__ = ({})'.format(''.join(
+        repr(p.name) + ', ' for p in prototypes)))
+    for p in prototypes:
+        lines += ['', '', _wrapper_function(p)]
+    return '\n'.join(lines) + '\n'
+
+
+def compile_link_import_batch(kernels, modname='kernels', build_dir=None,
+                              nproc=None, **kwargs):
+    """
+    Compiles many C kernels into a single extension module.
+
+    Parameters
+    ----------
+    kernels: iterable of (name, c_source, signature) tuples
+        signature is a C prototype understood by
+        `pycompilation.prototypes.parse_prototype`, e.g.
+        'double (int n, const double * x)' (the name may be omitted).
+    modname: string
+        prefix of the extension module name, the full name includes a
+        hash of the kernels (a changed batch gives a new module which
+        can be imported in the same process).
+    build_dir: path string
+        kernels are written and compiled here. Reusing a build_dir makes
+        re-batching incremental: only new or changed kernels are compiled.
+        default: an entry in the managed cache (see `pycompilation.cache`)
+        keyed by the kernels and kwargs (see `build_key`).
+    nproc: int
+        number of concurrent compiler processes. default: os.cpu_count()
+    **kwargs:
+        keyword arguments passed onto `compile_link_import_py_ext`
+        (std defaults to 'c99').
+
+    Returns
+    -------
+    the imported module, it has one function per kernel (and the tuple
+    ``__kernels__`` listing their names).
+    """
+    kernels = list(kernels)
+    if build_dir is None:
+        from .cache import entry_dir
+        build_dir = entry_dir('batch', build_key(
+            [(name + '.c', c_source) for name, c_source, _ in kernels] +
+            [('signatures', repr([(name, signature) for name, _, signature
+                                  in kernels]))],
+            dict(kwargs, modname=modname)))
+    if not os.path.isdir(build_dir):
+        raise OSError("Non-existent directory: ", build_dir)
+    kwargs.setdefault('std', 'c99')
+    kwargs.setdefault('only_update', True)
+
+    srcs, prototypes = [], []
+    md = md5_of_string(modname.encode('utf-8'))
+    for name, c_source, signature in kernels:
+        proto = parse_prototype(signature, name=name)
+        prototypes.append(proto)
+        src = os.path.join(build_dir, name + '.c')
+        write_code_string(src, c_source, kwargs['only_update'])
+        srcs.append(src)
+        md.update(format_prototype(proto).encode('utf-8'))
+        md.update(md5_of_string(c_source.encode('utf-8')).digest())
+    extname = '{}_{}'.format(modname, md.hexdigest()[:12])
+    header = extname + '.h'
+    write_code_string(os.path.join(build_dir, header), (
+        '#include <stddef.h>\n#include <stdint.h>\n' + ''.join(
+            format_prototype(p) + ';\n' for p in prototypes)),
+        kwargs['only_update'])
+    pyx = os.path.join(build_dir, extname + '.pyx')
+    write_code_string(pyx, batch_wrapper_code(prototypes, header),
+                      kwargs['only_update'])
+
+    compile_kwargs = dict(kwargs.pop('compile_kwargs', None) or {})
+    compile_kwargs.setdefault('nproc', nproc or os.cpu_count())
+    return compile_link_import_py_ext(
+        srcs + [pyx], extname=extname, build_dir=build_dir,
+        compile_kwargs=compile_kwargs, **kwargs)
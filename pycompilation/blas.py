@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+Detection of BLAS/LAPACK backends and control of their thread counts.
+
+Candidate backends (MKL, OpenBLAS, BLIS and the reference
+implementation) are tried in order of preference by linking a snippet
+calling ``dgemm`` and ``dgesv`` (see `pycompilation.probe`), the first
+one which links is used by the 'lapack' option of `CompilerRunner`::
+
+    >>> from pycompilation.blas import detect_blas
+    >>> detect_blas('gcc')  # doctest: +SKIP
+    BlasInfo(name='openblas', libraries=['openblas'], ..., threading='pthreads')
+
+MKL is preferred on Intel CPUs and tried after OpenBLAS and BLIS
+elsewhere. The environment variable PYCOMPILATION_BLAS (e.g. 'openblas'
+or 'blis,reference') overrides the order of preference.
+
+BLAS libraries start as many threads as there are cores, which
+oversubscribes the machine when kernels calling BLAS run in several
+processes (or threads) at once, see `set_blas_threads` and
+`threads_per_worker`.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import subprocess
+import sys
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+from .cpu import _cpuinfo_field
+from .probe import binary_hash, probe
+from .util import MetaReaderWriter, FileNotFoundError, get_cache_dir
+
+BlasInfo = namedtuple('BlasInfo', 'name libraries library_dirs include_dirs '
+                                  'define threading')
+
+# Backend name mapped to alternative lists of libraries to link
+backend_libraries = OrderedDict([
+    ('mkl', (['mkl_rt'],)),
+    ('openblas', (['openblas'], ['lapack', 'openblas'])),
+    ('blis', (['flame', 'blis'], ['lapack', 'blis'])),
+    ('reference', (['lapack', 'blas'],)),
+])
+
+# Environment variables read by the backends when they are loaded
+thread_environ_keys = {
+    'mkl': 'MKL_NUM_THREADS',
+    'openblas': 'OPENBLAS_NUM_THREADS',
+    'blis': 'BLIS_NUM_THREADS',
+}
+
+# Runtime setters/getters of the number of threads
+_thread_functions = {
+    'mkl': ('MKL_Set_Num_Threads', 'MKL_Get_Max_Threads'),
+    'openblas': ('openblas_set_num_threads', 'openblas_get_num_threads'),
+    'blis': ('bli_thread_set_num_threads', 'bli_thread_get_num_threads'),
+}
+
+link_snippets = {
+    'c': 'extern void dgemm_(void);\nextern void dgesv_(void);\n'
+         'int main(void) {\n'
+         '    void (* volatile f[2])(void) = {dgemm_, dgesv_};\n'
+         '    return f[0] == f[1];\n}\n',
+    'c++': 'extern "C" void dgemm_();\nextern "C" void dgesv_();\n'
+           'int main() {\n'
+           '    void (* volatile f[2])() = {dgemm_, dgesv_};\n'
+           '    return f[0] == f[1];\n}\n',
+    'fortran': 'program probe\nexternal dgemm, dgesv\nif (.false.) then\n'
+               'call dgemm()\ncall dgesv()\nend if\nend program probe\n',
+}
+
+# Run by `threading_layer` in a child process: argv is path, backend name
+_threading_layer_script = """
+import ctypes, sys
+lib = ctypes.CDLL(sys.argv[1])
+if sys.argv[2] == 'openblas':
+    print({0: 'sequential', 1: 'pthreads', 2: 'openmp'}.get(
+        lib.openblas_get_parallel()))
+elif lib.bli_info_get_enable_openmp():
+    print('openmp')
+elif lib.bli_info_get_enable_pthreads():
+    print('pthreads')
+else:
+    print('sequential')
+"""
+
+_blas_rw = MetaReaderWriter('.metadata_blas')
+_detected = {}
+
+
+def preferred_backends():
+    """
+    Backend names in order of preference: from the environment variable
+    PYCOMPILATION_BLAS if set, else MKL first on Intel CPUs only.
+    """
+    if os.environ.get('PYCOMPILATION_BLAS'):
+        names = os.environ['PYCOMPILATION_BLAS'].split(',')
+        for name in names:
+            if name not in backend_libraries:
+                raise ValueError("Unknown BLAS backend: {}".format(name))
+        return names
+    names = list(backend_libraries)
+    if _cpuinfo_field('vendor_id') != 'GenuineIntel':
+        names.remove('mkl')
+        names.insert(names.index('reference'), 'mkl')
+    return names
+
+
+def _library_dirs(name):
+    if name == 'mkl' and os.environ.get('MKLROOT'):
+        return [d for d in (os.path.join(os.environ['MKLROOT'], 'lib',
+                                         'intel64'),
+                            os.path.join(os.environ['MKLROOT'], 'lib'))
+                if os.path.isdir(d)]
+    return []
+
+
+def _include_dirs(name):
+    if name == 'mkl' and os.environ.get('MKLROOT'):
+        return [os.path.join(os.environ['MKLROOT'], 'include')]
+    return []
+
+
+def find_library(name, library_dirs=()):
+    """ Path (or soname) of a shared library, None if not found """
+    for d in library_dirs:
+        for fname in sorted(os.listdir(d)):
+            if fname.startswith('lib' + name + '.') and '.so' in fname or \
+               fname == 'lib' + name + '.dylib':
+                return os.path.join(d, fname)
+    import ctypes.util
+    return ctypes.util.find_library(name)
+
+
+def _load(info, only_loaded=False):
+    """ ctypes handle of the (core) library of a backend or None """
+    import ctypes
+    path = find_library(info.libraries[-1], info.library_dirs)
+    if path is None:
+        return None
+    mode = ctypes.DEFAULT_MODE
+    if only_loaded:
+        if not hasattr(os, 'RTLD_NOLOAD'):
+            return None
+        mode |= os.RTLD_NOLOAD
+    try:
+        return ctypes.CDLL(path, mode=mode)
+    except OSError:
+        return None
+
+
+def threading_layer(name, libraries, library_dirs=()):
+    """
+    Returns the threading layer of a backend: 'sequential', 'openmp',
+    'pthreads', 'tbb' or None (unknown). OpenBLAS and BLIS are queried
+    in a child process, the calling process never loads the library
+    (which would start its thread pool).
+    """
+    if name == 'reference':
+        return 'sequential'
+    if name == 'mkl':  # mkl_rt selects the layer when loaded
+        return {'sequential': 'sequential', 'tbb': 'tbb',
+                'gnu': 'openmp', 'intel': 'openmp'}.get(os.environ.get(
+                    'MKL_THREADING_LAYER', 'intel').lower())
+    path = find_library(libraries[-1], library_dirs)
+    if path is None:
+        return None
+    env = dict(os.environ)
+    env.update((k, '1') for k in thread_environ_keys.values())
+    p = subprocess.Popen(
+        [sys.executable, '-c', _threading_layer_script, path, name],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    out, _ = p.communicate()
+    layer = out.decode('utf-8').strip()
+    if p.returncode != 0 or layer == 'None':
+        return None
+    return layer
+
+
+def detect_blas(binary='gcc', language='c', backends=None, logger=None):
+    """
+    Returns a BlasInfo instance for the first backend (in order of
+    preference) whose libraries link with binary, None if none does.
+    The choice is persisted (per compiler binary) in
+    ``get_cache_dir('probe')``, not finding any backend is only
+    remembered by the running process (libraries may be installed
+    later).
+
+    Parameters
+    ----------
+    binary: string
+        compiler (driver) used for linking
+    language: string
+        'c', 'c++' or 'fortran'
+    backends: iterable of strings
+        names (keys of `backend_libraries`), default:
+        `preferred_backends()`
+    logger: logging.Logger
+    """
+    backends = list(backends or preferred_backends())
+    try:
+        key = '{}:{}:{}:{}'.format(binary_hash(binary), language,
+                                   ','.join(backends),
+                                   os.environ.get('MKLROOT', ''))
+    except (OSError, RuntimeError):
+        return None  # compiler not found
+    if key in _detected:
+        return _detected[key]
+    cache_dir = get_cache_dir('probe')
+    try:
+        info = _blas_rw.get_from_metadata_file(cache_dir, key)
+    except (FileNotFoundError, KeyError):
+        info = None
+    if info is not None:
+        _detected[key] = info
+        return info
+    for name in backends:
+        library_dirs = _library_dirs(name)
+        for libraries in backend_libraries[name]:
+            if probe(binary, ['-L' + d for d in library_dirs], language,
+                     link_snippets[language], libraries=libraries):
+                info = BlasInfo(name, list(libraries), library_dirs,
+                                _include_dirs(name), [], threading_layer(
+                                    name, libraries, library_dirs))
+                break
+        if info is not None:
+            break
+    if logger:
+        logger.info("Detected BLAS/LAPACK: {}".format(info))
+    _detected[key] = info
+    if info is not None:
+        _blas_rw.save_to_metadata_file(cache_dir, key, info)
+    return info
+
+
+def threads_per_worker(nworkers, ncpus=None):
+    """
+    Number of BLAS threads per worker for nworkers concurrent workers
+    (processes or threads) not to oversubscribe ncpus (default: all).
+    """
+    if ncpus is None:
+        ncpus = os.cpu_count() if hasattr(os, 'cpu_count') else None
+    return max(1, (ncpus or 1) // max(1, nworkers))
+
+
+def set_blas_threads(nthreads, info=None):
+    """
+    Sets the number of threads used by BLAS: through the environment
+    (read when a backend is loaded, e.g. when importing an extension
+    linked to it) and, if already loaded, through its runtime API.
+
+    Parameters
+    ----------
+    nthreads: int
+    info: BlasInfo
+        default: the environment variables of all backends are set and
+        no runtime call is made.
+
+    Returns
+    -------
+    The previous number of threads when known (loaded backend) else None.
+    """
+    infos = [info] if info is not None else []
+    for name in ([info.name] if info is not None else thread_environ_keys):
+        if name in thread_environ_keys:
+            os.environ[thread_environ_keys[name]] = str(nthreads)
+    previous = None
+    for info in infos:
+        if info.name not in _thread_functions:
+            continue
+        lib = _load(info, only_loaded=True)
+        if lib is None:
+            continue
+        setter, getter = _thread_functions[info.name]
+        try:
+            previous = getattr(lib, getter)()
+            getattr(lib, setter)(nthreads)
+        except AttributeError:
+            pass
+    return previous
+
+
+@contextmanager
+def blas_threads(nthreads, info=None):
+    """
+    Context manager limiting the number of BLAS threads (see
+    `set_blas_threads`), the environment is restored on exit::
+
+        with blas_threads(threads_per_worker(4)):
+            mod = compile_link_import_strings(codes, options=['lapack'])
+    """
+    names = [info.name] if info is not None else list(thread_environ_keys)
+    saved = {k: os.environ.get(k) for k in (
+        thread_environ_keys[n] for n in names if n in thread_environ_keys)}
+    previous = set_blas_threads(nthreads, info)
+    try:
+        yield
+    finally:
+        if previous is not None:
+            set_blas_threads(previous, info)
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
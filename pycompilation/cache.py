@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+"""
+Managed on-disk cache.
+
+Cache entries are directories laid out as ``<root>/<namespace>/<xy>/<key>``
+where ``xy`` are the first two characters of the key (sharding keeps the
+number of entries per directory small). Every lookup through `entry_dir`
+records the access time in a small file inside the entry, which is what
+least-recently-used eviction in `gc` is based on (file system atimes are
+unreliable, e.g. on ``noatime`` mounts).
+
+Size and age limits are read from the environment variables
+PYCOMPILATION_CACHE_MAX_SIZE (e.g. '10G', default: 10G) and
+PYCOMPILATION_CACHE_MAX_AGE (in days, default: 30). Garbage collection is
+run automatically (at most once per hour) when new entries are created,
+or explicitly via::
+
+    $ python -m pycompilation cache gc
+
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import time
+import uuid
+
+from .util import get_cache_dir, make_dirs, md5_of_file
+
+access_filename = '.pycompilation_access'
+manifest_filename = '.pycompilation_manifest'
+_gc_stamp_filename = '.pycompilation_last_gc'
+_special_filenames = (access_filename, manifest_filename)
+
+default_max_size = '10G'
+default_max_age = 30.0  # days
+auto_gc_interval = 3600.0  # seconds
+
+_size_suffixes = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3,
+                  'T': 1024**4}
+
+
+def parse_size(size):
+    """
+    Parses a size string with optional (binary) suffix: '512M' -> 536870912
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    size = size.strip().upper().rstrip('B').rstrip('I')
+    suffix = size[-1] if size and size[-1] in _size_suffixes else ''
+    return int(float(size[:len(size)-len(suffix)]) * _size_suffixes[suffix])
+
+
+def format_size(nbytes):
+    """ Formats a number of bytes for humans: 1536 -> '1.5K' """
+    for suffix in ('', 'K', 'M', 'G'):
+        if nbytes < 1024:
+            break
+        nbytes /= 1024.0
+    else:
+        suffix = 'T'
+    return '{:.1f}{}'.format(nbytes, suffix) if suffix else str(int(nbytes))
+
+
+def get_limits():
+    """ Returns (max_size in bytes, max_age in seconds) from environment """
+    max_size = parse_size(os.environ.get(
+        'PYCOMPILATION_CACHE_MAX_SIZE', default_max_size))
+    max_age = float(os.environ.get(
+        'PYCOMPILATION_CACHE_MAX_AGE', default_max_age))*86400
+    return max_size, max_age
+
+
+def touch(path):
+    """ Records an access of the entry at path. """
+    with open(os.path.join(path, access_filename), 'wt') as ofh:
+        ofh.write(repr(time.time()))
+
+
+def last_access(path):
+    """ Returns the time of the last recorded access of an entry. """
+    try:
+        with open(os.path.join(path, access_filename), 'rt') as ifh:
+            return float(ifh.read())
+    except (IOError, OSError, ValueError):
+        return os.path.getmtime(path)
+
+
+def entry_dir(namespace, key, create=True, root=None):
+    """
+    Returns the path of a cache entry and records the access.
+
+    Parameters
+    ----------
+    namespace: string
+        e.g. 'build' or 'support'
+    key: string
+        hex digest identifying the entry
+    create: bool
+        create the entry directory if missing (otherwise the access is
+        only recorded for existing entries).
+    root: path string
+        cache root, default: ``get_cache_dir()``
+    """
+    root = root or get_cache_dir()
+    path = os.path.join(root, namespace, key[:2], key)
+    if not os.path.isdir(path):
+        if not create:
+            return path
+        maybe_gc(root)
+        try:
+            make_dirs(path)
+        except OSError:  # created concurrently
+            if not os.path.isdir(path):
+                raise
+    touch(path)
+    return path
+
+
+def mkdtemp(root=None):
+    """
+    Creates a uniquely named entry in the 'tmp' namespace (subject to the
+    same limits as all other entries, unlike ``tempfile.mkdtemp``).
+    """
+    return entry_dir('tmp', uuid.uuid4().hex, root=root)
+
+
+def iter_entries(root=None, namespace=None):
+    """ Yields (namespace, key, path) for entries in the cache. """
+    root = root or get_cache_dir()
+    if namespace is None:
+        namespaces = sorted(
+            ns for ns in os.listdir(root) if not ns.startswith('.') and
+            os.path.isdir(os.path.join(root, ns)))
+    else:
+        namespaces = [namespace]
+    for ns in namespaces:
+        ns_dir = os.path.join(root, ns)
+        if not os.path.isdir(ns_dir):
+            continue
+        for shard in sorted(os.listdir(ns_dir)):
+            shard_dir = os.path.join(ns_dir, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_dir):
+                continue
+            for key in sorted(os.listdir(shard_dir)):
+                path = os.path.join(shard_dir, key)
+                if key.startswith(shard) and '.' not in key and \
+                   os.path.isdir(path):
+                    yield ns, key, path
+
+
+def entry_size(path):
+    """ Total size (in bytes) of files in an entry. """
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for fn in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, fn)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def stats(root=None):
+    """
+    Returns a dict mapping namespace to a dict with the keys
+    'entries' and 'size' (bytes).
+    """
+    result = {}
+    for ns, key, path in iter_entries(root):
+        d = result.setdefault(ns, {'entries': 0, 'size': 0})
+        d['entries'] += 1
+        d['size'] += entry_size(path)
+    return result
+
+
+def remove_entry(path):
+    """ Removes an entry (renamed first so that it disappears atomically) """
+    doomed = path + '.removing_' + uuid.uuid4().hex[:8]
+    try:
+        os.rename(path, doomed)
+    except OSError:
+        return False
+    shutil.rmtree(doomed, ignore_errors=True)
+    return True
+
+
+def gc(max_size=None, max_age=None, root=None, dry_run=False):
+    """
+    Evicts entries older than max_age and then least recently used
+    entries until the total size is below max_size.
+
+    Parameters
+    ----------
+    max_size: int or string
+        e.g. '5G', default from environment (see `get_limits`)
+    max_age: float
+        seconds, default from environment (see `get_limits`)
+    root: path string
+        cache root, default: ``get_cache_dir()``
+    dry_run: bool
+        only report what would be removed.
+
+    Returns
+    -------
+    list of (path, size) of evicted entries
+    """
+    env_max_size, env_max_age = get_limits()
+    max_size = env_max_size if max_size is None else parse_size(max_size)
+    max_age = env_max_age if max_age is None else max_age
+    now = time.time()
+    entries = sorted(
+        (last_access(path), path, entry_size(path))
+        for ns, key, path in iter_entries(root))
+    total = sum(size for _, _, size in entries)
+    evicted = []
+    for accessed, path, size in entries:
+        if now - accessed <= max_age and total <= max_size:
+            continue
+        if dry_run or remove_entry(path):
+            evicted.append((path, size))
+            total -= size
+    return evicted
+
+
+def maybe_gc(root=None):
+    """ Runs `gc` if it was not run during the last ``auto_gc_interval`` """
+    root = root or get_cache_dir()
+    stamp = os.path.join(root, _gc_stamp_filename)
+    try:
+        if time.time() - os.path.getmtime(stamp) < auto_gc_interval:
+            return []
+    except OSError:
+        pass
+    with open(stamp, 'wt') as ofh:
+        ofh.write(repr(time.time()))
+    return gc(root=root)
+
+
+def clear(root=None, namespace=None):
+    """ Removes all entries (of namespace), returns number removed. """
+    return sum(remove_entry(path) for ns, key, path in list(
+        iter_entries(root, namespace)))
+
+
+def _entry_files(path):
+    for dirpath, dirnames, filenames in os.walk(path):
+        for fn in filenames:
+            if fn not in _special_filenames:
+                yield os.path.relpath(os.path.join(dirpath, fn), path)
+
+
+def write_manifest(path):
+    """ Records the md5 sums of all files in an entry (see `verify`). """
+    with open(os.path.join(path, manifest_filename), 'wt') as ofh:
+        for relpath in sorted(_entry_files(path)):
+            ofh.write('{}  {}\n'.format(md5_of_file(os.path.join(
+                path, relpath)).hexdigest(), relpath))
+
+
+def verify_entry(path):
+    """
+    Checks files of an entry against its manifest.
+
+    Returns
+    -------
+    list of problems (strings), empty if the entry is intact or has no
+    manifest.
+    """
+    manifest = os.path.join(path, manifest_filename)
+    if not os.path.exists(manifest):
+        return []
+    problems = []
+    with open(manifest, 'rt') as ifh:
+        for line in ifh:
+            digest, relpath = line.rstrip('\n').split('  ', 1)
+            fullpath = os.path.join(path, relpath)
+            if not os.path.exists(fullpath):
+                problems.append('missing: ' + relpath)
+            elif md5_of_file(fullpath).hexdigest() != digest:
+                problems.append('checksum mismatch: ' + relpath)
+    return problems
+
+
+def verify(root=None, remove=False):
+    """
+    Verifies all entries with a manifest.
+
+    Returns
+    -------
+    list of (path, problems) for corrupt entries (removed if remove=True)
+    """
+    corrupt = []
+    for ns, key, path in list(iter_entries(root)):
+        problems = verify_entry(path)
+        if problems:
+            corrupt.append((path, problems))
+            if remove:
+                remove_entry(path)
+    return corrupt
+
+
+def main(args):
+    """ Entry point of ``python -m pycompilation cache ...`` """
+    root = args.root
+    if args.action == 'stats':
+        root = root or get_cache_dir()
+        print('Cache root: {}'.format(root))
+        total_entries, total_size = 0, 0
+        for ns, d in sorted(stats(root).items()):
+            print('{:>12}: {:>8} entries {:>10}'.format(
+                ns, d['entries'], format_size(d['size'])))
+            total_entries += d['entries']
+            total_size += d['size']
+        print('{:>12}: {:>8} entries {:>10}'.format(
+            'total', total_entries, format_size(total_size)))
+    elif args.action == 'gc':
+        evicted = gc(args.max_size, None if args.max_age is None else
+                     args.max_age*86400, root, dry_run=args.dry_run)
+        for path, size in evicted:
+            print('{} {}'.format('would remove' if args.dry_run else 'removed',
+                                 path))
+        print('{} entries ({}) {}'.format(
+            len(evicted), format_size(sum(size for _, size in evicted)),
+            'would be evicted' if args.dry_run else 'evicted'))
+    elif args.action == 'clear':
+        print('Removed {} entries'.format(clear(root, args.namespace)))
+    elif args.action == 'verify':
+        corrupt = verify(root, remove=args.remove)
+        for path, problems in corrupt:
+            print('{}{}:\n    {}'.format(
+                path, ' (removed)' if args.remove else '',
+                '\n    '.join(problems)))
+        print('{} corrupt entries'.format(len(corrupt)))
+        return 1 if corrupt and not args.remove else 0
+    return 0
+
+
+def add_arguments(parser):
+    """ Adds the 'cache' sub-commands to an argparse parser. """
+    parser.add_argument('--root', default=None,
+                        help='cache root (default: $PYCOMPILATION_CACHE_DIR '
+                        'or the user cache directory)')
+    actions = parser.add_subparsers(dest='action')
+    actions.required = True
+    actions.add_parser('stats', help='show number of entries and sizes')
+    gc_parser = actions.add_parser('gc', help='evict old/least recently '
+                                   'used entries')
+    gc_parser.add_argument('--max-size', default=None,
+                           help="e.g. '5G' (default: environment or %s)" %
+                           default_max_size)
+    gc_parser.add_argument('--max-age', type=float, default=None,
+                           help='in days (default: environment or %s)' %
+                           default_max_age)
+    gc_parser.add_argument('--dry-run', action='store_true')
+    clear_parser = actions.add_parser('clear', help='remove all entries')
+    clear_parser.add_argument('--namespace', default=None)
+    verify_parser = actions.add_parser('verify', help='check entries '
+                                       'against their manifests')
+    verify_parser.add_argument('--remove', action='store_true',
+                               help='remove corrupt entries')
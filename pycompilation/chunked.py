@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""
+Multithreaded wrappers of array kernels running chunks without the GIL.
+
+Array kernels (taking a length and pointers to arrays of that length)
+are wrapped by generated Cython functions splitting the arrays into
+cache sized chunks which are processed by an OpenMP thread pool
+(``prange``) with the GIL released, so other Python threads keep running::
+
+    mod = compile_link_import_strings([('sigmoid.c', code)], chunked={
+        'sigmoid': 'void sigmoid(int n, const double * x, double * y, '
+                   'double lim)',
+        'total': dict(prototype='double total(int n, const double * x)',
+                      reduce='+'),
+    }, std='c99')
+    y = mod.sigmoid(x, 350.0)  # preallocated output: out=...
+    s = mod.total(x, num_threads=8, chunk_size=2**16)
+
+Const pointers are inputs (memoryviews, no copy), other pointers are
+outputs (allocated unless passed as keyword arguments named after the
+C arguments) and scalars are passed on unchanged. Kernels returning a
+value are reductions: the results of the chunks are combined with
+`reductions` in chunk order, i.e. independently of the number of
+threads.
+
+The default chunk size fills the L2 cache (the module attribute
+``chunk_bytes`` divided by the bytes per element of all arrays), the
+default number of threads is the OpenMP default (the module attribute
+``num_threads``, 0).
+"""
+
+from __future__ import print_function, division, absolute_import
+
+from collections import OrderedDict, namedtuple
+
+from .cpu import cache_size
+from .prototypes import (
+    add_cython_code, cimport_lines, ctype_dtype_char, parse_prototype,
+    py_name
+)
+
+ChunkedSpec = namedtuple('ChunkedSpec', 'name prototype size reduce')
+
+# Reduction operators mapped to the NumPy method combining partials
+reductions = OrderedDict([
+    ('+', 'sum'),
+    ('*', 'prod'),
+    ('min', 'min'),
+    ('max', 'max'),
+])
+
+
+def default_chunk_bytes():
+    """ Size of the L2 cache (256 KiB when unknown) """
+    return cache_size(2) or 256*1024
+
+
+def _spec(name, value):
+    if isinstance(value, str):
+        value = dict(prototype=value)
+    unknown = set(value) - set(ChunkedSpec._fields)
+    if unknown:
+        raise ValueError("Unknown chunked keys for {}: {}".format(
+            name, ', '.join(sorted(unknown))))
+    proto = parse_prototype(value['prototype'])
+    reduce_ = value.get('reduce', None)
+    if reduce_ is not None and reduce_ not in reductions:
+        raise ValueError("Unknown reduction for {}: {}".format(
+            name, reduce_))
+    if (reduce_ is None) != (proto.restype == 'void'):
+        raise ValueError("Kernel {} should return {} (reduce={!r})".format(
+            name, 'void' if reduce_ is None else 'its partial result',
+            reduce_))
+    if reduce_ is not None and any(a.pointer and not a.const
+                                   for a in proto.args):
+        raise ValueError("Reduction {} cannot have outputs".format(name))
+    size = value.get('size', None)
+    if size is None:
+        for a in proto.args:
+            if not a.pointer and ctype_dtype_char[a.ctype] not in 'fdg':
+                size = a.name
+                break
+        else:
+            raise ValueError("No integer length argument in {}".format(name))
+    if size not in [a.name for a in proto.args if not a.pointer]:
+        raise ValueError("{} is not a scalar argument of {}".format(
+            size, name))
+    if not any(a.pointer and a.const for a in proto.args):
+        raise ValueError("Kernel {} takes no input arrays".format(name))
+    return ChunkedSpec(name, proto, size, reduce_)
+
+
+def wrapper_function(spec):
+    """ Returns Cython code of the def function wrapping spec """
+    proto = spec.prototype
+    arrays = [a for a in proto.args if a.pointer]
+    inputs = [a for a in proto.args if a.name != spec.size and
+              (not a.pointer or a.const)]
+    outputs = [a for a in arrays if not a.const]
+    params = ['{}{}[::1] {}'.format('const ' if a.const else '', a.ctype,
+                                    py_name(a.name)) if a.pointer else
+              '{} {}'.format(a.ctype, py_name(a.name)) for a in inputs]
+    params += ['{}[::1] {}=None'.format(a.ctype, py_name(a.name))
+               for a in outputs]
+    params += ['*', 'chunk_size=None', 'num_threads=None']
+    first = [a for a in arrays if a.const][0]  # outputs may be None
+    lines = ['def {}({}):'.format(spec.name, ', '.join(params)),
+             '    cdef Py_ssize_t _n = {}.shape[0]'.format(
+                 py_name(first.name)),
+             '    cdef Py_ssize_t _c, _start, _cs, _nchunks',
+             '    cdef int _nt']
+    for a in arrays:
+        lines.append('    cdef {}{} *_p_{} = NULL'.format(
+            'const ' if a.const else '', a.ctype, a.name))
+    for a in outputs:
+        lines += ['    if {} is None:'.format(py_name(a.name)),
+                  '        {} = _pyc_np.empty(_n, dtype={!r})'.format(
+                      py_name(a.name), ctype_dtype_char[a.ctype])]
+    for a in arrays:
+        if a is first:
+            continue
+        lines += ['    if {}.shape[0] != _n:'.format(py_name(a.name)),
+                  '        raise ValueError("Length of {} differs from {}")'
+                  .format(a.name, first.name)]
+    itemsizes = ' + '.join('sizeof({})'.format(a.ctype) for a in arrays)
+    lines += ['    _cs, _nchunks, _nt = _pyc_chunking(_n, {}, chunk_size, '
+              'num_threads)'.format(itemsizes)]
+    if spec.reduce is not None:
+        lines += ['    _partials = _pyc_np.empty(_nchunks, dtype={!r})'.format(
+            ctype_dtype_char[proto.restype]),
+            '    cdef {}[::1] _partials_view = _partials'.format(
+                proto.restype)]
+        lines.append('    cdef {} *_p_partials = NULL'.format(proto.restype))
+    lines += ['    if _n > 0:']
+    for a in arrays:
+        lines.append('        _p_{} = &{}[0]'.format(a.name, py_name(a.name)))
+    if spec.reduce is not None:
+        lines.append('        _p_partials = &_partials_view[0]')
+    call = '_k_{}({})'.format(proto.name, ', '.join(
+        '_p_{} + _start'.format(a.name) if a.pointer else
+        '<{}>min(_cs, _n - _start)'.format(a.ctype) if a.name == spec.size
+        else py_name(a.name) for a in proto.args))
+    if spec.reduce is not None:
+        call = '_p_partials[_c] = ' + call
+    lines += ['        with nogil:',
+              '            for _c in prange(_nchunks, num_threads=_nt, '
+              "schedule='static'):",
+              '                _start = _c*_cs',
+              '                ' + call]
+    if spec.reduce is not None:
+        lines.append('    return _partials.{}()'.format(
+            reductions[spec.reduce]))
+    elif len(outputs) == 1:
+        lines.append('    return _pyc_np.asarray({})'.format(
+            py_name(outputs[0].name)))
+    else:
+        lines.append('    return ({})'.format(''.join(
+            '_pyc_np.asarray({}), '.format(py_name(a.name))
+            for a in outputs)))
+    return '\n'.join(lines)
+
+
+_chunking = '''
+def _pyc_chunking(Py_ssize_t n, Py_ssize_t itemsize, chunk_size,
+                  num_threads):
+    """ Returns (chunk size, number of chunks, number of threads) """
+    cdef Py_ssize_t cs = chunk_size or max(1, chunk_bytes // itemsize)
+    if cs < 1:
+        raise ValueError("chunk_size must be positive")
+    cdef Py_ssize_t nchunks = (n + cs - 1) // cs
+    nt = num_threads or globals()['num_threads'] or \\
+        _pyc_omp.omp_get_max_threads()
+    return cs, nchunks, max(1, min(nt, nchunks))
+'''
+
+
+def chunked_wrapper_code(specs, chunk_bytes=None):
+    """
+    Returns Cython source of wrappers (see module docstring).
+
+    Parameters
+    ----------
+    specs: iterable of ChunkedSpec instances
+    chunk_bytes: int
+        default of the module attribute ``chunk_bytes``, default:
+        `default_chunk_bytes()`
+    """
+    specs = list(specs)
+    used = set(a.ctype for s in specs for a in s.prototype.args) | set(
+        s.prototype.restype for s in specs)
+    lines = ['', '# Generated by pycompilation.chunked, do not edit.',
+             'from cython.parallel cimport prange',
+             'cimport openmp as _pyc_omp']
+    lines += cimport_lines(used)
+    lines += ['import numpy as _pyc_np', '',
+              'chunk_bytes = {}'.format(chunk_bytes or default_chunk_bytes()),
+              'num_threads = 0', '']
+    for s in specs:
+        p = s.prototype
+        lines.append('cdef extern {} _k_{} "{}" ({}) nogil'.format(
+            p.restype, p.name, p.name, ', '.join(
+                '{}{}{}'.format('const ' if a.const else '', a.ctype,
+                                ' *' if a.pointer else '') for a in p.args)))
+    lines.append(_chunking)
+    for s in specs:
+        lines += ['', wrapper_function(s)]
+    return '\n'.join(lines) + '\n'
+
+
+def chunked_codes(codes, chunked, extname=None, chunk_bytes=None):
+    """
+    Adds chunked multithreaded wrappers to code strings.
+
+    The wrappers are appended to the last code string if it is a Cython
+    source, otherwise a Cython source named after extname is added.
+
+    Parameters
+    ----------
+    codes: iterable of name/source pair tuples
+    chunked: dict
+        wrapper names mapped to a prototype string or a dict with the keys
+        'prototype', 'reduce' (a key of `reductions`, for kernels
+        returning the result of a chunk) and 'size' (name of the length
+        argument, default: the first integer scalar).
+    extname: string
+        name of the extension module, default: taken from the last code
+        string
+    chunk_bytes: int
+        see `chunked_wrapper_code`
+
+    Returns
+    -------
+    (codes, extname)
+    """
+    specs = [_spec(name, value) for name, value in sorted(chunked.items())]
+    return add_cython_code(codes, chunked_wrapper_code(specs, chunk_bytes),
+                           extname, '_chunked')
@@ -21,15 +21,16 @@ import glob
 import os
 import shutil
 import sys
-import tempfile
+import threading
 import warnings
+from collections import OrderedDict
 
 from .util import (
     MetaReaderWriter, missing_or_other_newer, get_abspath,
     expand_collection_in_dict, make_dirs, copy, Glob, ArbitraryDepthGlob,
-    glob_at_depth, CompilationError, FileNotFoundError,
+    get_directory_index, CompilationError, FileNotFoundError,
     import_module_from_file, pyx_is_cplus,
-    md5_of_string, md5_of_file
+    md5_of_string, md5_of_file, find_binary_of_command
 )
 
 from .runners import (
@@ -38,8 +39,15 @@ from .runners import (
     FortranCompilerRunner
 )
 
+from .remote_cache import get_remote_cache, object_key, cython_key
+
 from distutils.sysconfig import get_config_var
 
+_objects_lock = threading.Lock()  # guards `objects` of compile_sources
+# Cython changes the working directory of the process (and has global
+# state): only one thread at a time may cythonize.
+_cythonize_lock = threading.RLock()
+
 # if sys.version_info[0] == 2:  # python 2
 sharedext = get_config_var('EXT_SUFFIX')
 # else:
@@ -89,6 +97,11 @@ def compile_sources(files, CompilerRunner_=None,
                     destdir=None, cwd=None,
                     keep_dir_struct=False,
                     per_file_kwargs=None,
+                    nproc=None,
+                    opt_policy=None,
+                    split=None,
+                    executor=None,
+                    objects=None,
                     **kwargs):
     """
     Compile source code files to object files.
@@ -109,48 +122,187 @@ def compile_sources(files, CompilerRunner_=None,
         Reproduce directory structure in `destdir`. default: False
     per_file_kwargs: dict
         dict mapping instances in `files` to keyword arguments
+    nproc: int
+        number of files to compile concurrently. default: 1
+    opt_policy: callable (optional)
+        called with the absolute path of each (non-Cython) source and
+        its previous compile record (see `get_compile_record`) or None,
+        returns flags passed as `opt_flags` to `src2obj`, see e.g.
+        `pycompilation.opt_policy.OptLevelPolicy`.
+    split: bool or int
+        Split C/C++ sources with split markers (see `pycompilation.split`)
+        into (at most) this many translation units (True: number of CPUs),
+        written to destdir and compiled in parallel (nproc defaults to
+        the number of shards) with the directory of the source added to
+        include_dirs. default: None (no splitting)
+    executor: concurrent.futures.Executor (optional)
+        compile through this executor (instead of a pool of nproc
+        threads), sharing its workers between concurrent calls.
+    objects: dict (optional)
+        registry shared between calls: a source (absolute path) compiled
+        with identical keyword arguments is only compiled once.
     **kwargs: dict
         default keyword arguments to pass to CompilerRunner_
     """
-    _per_file_kwargs = {}
+    _per_file_kwargs = {}  # keyed by absolute path
 
     if per_file_kwargs is not None:
+        index = None
         for k, v in per_file_kwargs.items():
-            if isinstance(k, Glob):
-                for path in glob.glob(k.pathname):
-                    _per_file_kwargs[path] = v
-            elif isinstance(k, ArbitraryDepthGlob):
-                for path in glob_at_depth(k.filename, cwd):
-                    _per_file_kwargs[path] = v
+            if isinstance(k, (Glob, ArbitraryDepthGlob)):
+                if isinstance(k, Glob) and os.path.isabs(k.pathname):
+                    paths = glob.glob(k.pathname)
+                else:
+                    index = index or get_directory_index(cwd or '.')
+                    paths = index.glob(k.pathname) if isinstance(
+                        k, Glob) else index.glob_at_depth(k.filename)
+                for path in paths:
+                    _per_file_kwargs[get_abspath(path, cwd=cwd)] = v
             else:
-                _per_file_kwargs[k] = v
+                _per_file_kwargs[get_abspath(k, cwd=cwd)] = v
 
     # Set up destination directory
     destdir = destdir or '.'
-    if not os.path.isdir(destdir):
-        if os.path.exists(destdir):
+    abs_destdir = get_abspath(destdir, cwd=cwd)
+    if not os.path.isdir(abs_destdir):
+        if os.path.exists(abs_destdir):
             raise IOError("{} is not a directory".format(destdir))
         else:
-            make_dirs(destdir)
+            make_dirs(abs_destdir)
     if cwd is None:
         cwd = '.'
         for f in files:
             copy(f, destdir, only_update=True, dest_is_dir=True)
+    # Cython compilation changes the process working directory (see
+    # `_cythonize`), relative paths are resolved against cwd instead.
+    cwd = get_abspath(cwd)
+
+    if split:
+        files, nshards = list(files), _nshards(split)
+        from .split import split_code, split_extensions, has_split_markers
+        for idx, f in reversed(list(enumerate(files))):
+            if os.path.splitext(f)[1].lower() not in split_extensions:
+                continue
+            abs_f = get_abspath(f, cwd=cwd)
+            with open(abs_f, 'rt') as ifh:
+                code_ = ifh.read()
+            if not has_split_markers(code_):
+                continue
+            file_kwargs = dict(_per_file_kwargs.get(abs_f, {}))
+            file_kwargs['include_dirs'] = list(file_kwargs.get(
+                'include_dirs', kwargs.get('include_dirs', None)) or []) + [
+                    os.path.dirname(abs_f)]
+            shards = []
+            for name, shard_code in split_code(
+                    os.path.basename(f), code_, nshards):
+                dest = os.path.join(abs_destdir, name)
+                write_code_string(dest, shard_code)
+                if not name.endswith('.h'):
+                    shards.append(dest)
+                    _per_file_kwargs[dest] = file_kwargs
+            files[idx:idx+1] = shards
+            nproc = nproc or nshards
+
+    def _file_kwargs(f):
+        return _per_file_kwargs.get(get_abspath(f, cwd=cwd), {})
 
     # Compile files and return list of paths to the objects
-    dstpaths = []
-    for f in files:
-        if keep_dir_struct:
-            name, ext = os.path.splitext(f)
-        else:
-            name, ext = os.path.splitext(os.path.basename(f))
+    def _compile(f):
         file_kwargs = kwargs.copy()
-        file_kwargs.update(_per_file_kwargs.get(f, {}))
-        dstpaths.append(src2obj(
-            f, CompilerRunner_, cwd=cwd,
-            **file_kwargs
-        ))
-    return dstpaths
+        file_kwargs.update(_file_kwargs(f))
+        for k, v in file_kwargs.items():
+            if isinstance(v, list):  # runners extend e.g. flags in-place
+                file_kwargs[k] = list(v)
+        if opt_policy is not None and not f.lower().endswith('.pyx'):
+            abs_f = get_abspath(f, cwd=cwd)
+            file_kwargs['opt_flags'] = list(file_kwargs.get(
+                'opt_flags', [])) + list(opt_policy(
+                    abs_f, get_compile_record(abs_f, cwd)) or [])
+        return src2obj(f, CompilerRunner_, cwd=cwd, **file_kwargs)
+
+    def _submit(f):
+        if objects is None:
+            return executor.submit(_compile, f)
+        key = (get_abspath(f, cwd=cwd), get_abspath(cwd), repr(sorted(
+            (k, v) for k, v in dict(kwargs, **_file_kwargs(f)).items()
+            if k != 'logger')))
+        with _objects_lock:
+            if key not in objects:
+                objects[key] = executor.submit(_compile, f)
+            return objects[key]
+
+    if executor is None and objects is None and (
+            nproc is None or nproc <= 1 or len(files) <= 1):
+        return [_compile(f) for f in files]
+    if executor is not None:
+        return [future.result() for future in list(map(_submit, files))]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(nproc or 1, 1)) as executor:
+        return [future.result() for future in list(map(_submit, files))]
+
+
+# Linkers selectable through -fuse-ld= (in order of preference) mapped
+# to the binaries which need to be present on the PATH.
+fast_linkers = OrderedDict([
+    ('mold', ('mold', 'ld.mold')),
+    ('lld', ('ld.lld',)),
+    ('gold', ('ld.gold',)),
+])
+
+
+def fuse_ld_supported(compiler_binary, linker):
+    """
+    Probes (see `pycompilation.probe`) whether the compiler driver can
+    link a shared object using ``-fuse-ld=<linker>``.
+    """
+    from .probe import probe, shared_snippet
+    return probe(compiler_binary, ['-fuse-ld=' + linker], 'c',
+                 code=shared_snippet, shared=True)
+
+
+def find_fast_linker(compiler_binary, preferred=True):
+    """
+    Returns the name of the first linker in `preferred` which is
+    installed and accepted by the compiler driver (or None).
+
+    Parameters
+    ----------
+    compiler_binary: path string
+        compiler driver used for linking
+    preferred: bool, string or iterable of strings
+        True means all of ``fast_linkers`` (in that order), a string
+        is interpreted as a comma separated list, e.g. "mold,lld".
+    """
+    if preferred is True:
+        preferred = list(fast_linkers)
+    elif isinstance(preferred, str):
+        preferred = [name.strip() for name in preferred.split(',')]
+    for name in preferred:
+        try:
+            find_binary_of_command(fast_linkers.get(name, (name,)))
+        except RuntimeError:
+            continue
+        if fuse_ld_supported(compiler_binary, name):
+            return name
+    return None
+
+
+def link_signature(runner):
+    """
+    Hex digest of a link command: the command line together with the
+    contents of the input objects (and size/mtime of libraries given
+    as paths).
+    """
+    md = md5_of_string(' '.join(
+        [runner.out] + runner.cmd()).encode('utf-8'))
+    for path in runner.sources:
+        md.update(md5_of_file(get_abspath(path, cwd=runner.cwd)).digest())
+    for lib in runner.libraries:
+        if os.path.exists(lib):
+            st = os.stat(lib)
+            md.update('{}:{}:{}'.format(
+                lib, st.st_size, st.st_mtime).encode('utf-8'))
+    return md.hexdigest()
 
 
 def link(obj_files, out_file=None, shared=False, CompilerRunner_=None,
@@ -175,6 +327,14 @@ def link(obj_files, out_file=None, shared=False, CompilerRunner_=None,
         C++ objects? default: False
     fort: bool
         Fortran objects? default: False
+    use_linker: bool, string or iterable of strings (optional)
+        Prefer a fast linker (see `find_fast_linker`) via -fuse-ld=.
+        default: environment variable PYCOMPILATION_USE_LINKER
+        (e.g. "mold,lld,gold") or None (compiler driver default).
+    only_update: bool
+        Skip linking if the output exists and the hash of input objects,
+        libraries and flags matches the last link recorded in the
+        directory of the output (see `link_signature`). default: False
     **kwargs: dict
         keyword arguments passed onto CompilerRunner_
 
@@ -219,12 +379,42 @@ def link(obj_files, out_file=None, shared=False, CompilerRunner_=None,
     if not run_linker:
         raise ValueError("link(..., run_linker=False)!?")
 
+    use_linker = kwargs.pop('use_linker', os.environ.get(
+        'PYCOMPILATION_USE_LINKER', None))
+    only_update = kwargs.pop('only_update', False)
+
     out_file = get_abspath(out_file, cwd=cwd)
     runner = CompilerRunner_(
         obj_files, out_file, flags,
         cwd=cwd,
         **kwargs)
+    if use_linker:
+        linker = find_fast_linker(runner.compiler_binary, use_linker)
+        if linker:
+            runner.flags.append('-fuse-ld=' + linker)
+        elif runner.logger:
+            runner.logger.info("No fast linker found among: {}".format(
+                use_linker))
+
+    if only_update:
+        rw = MetaReaderWriter('.metadata_link')
+        metadir = os.path.dirname(out_file)
+        signature = link_signature(runner)
+        try:
+            prev_signature = rw.get_from_metadata_file(metadir, out_file)
+        except (FileNotFoundError, KeyError):
+            prev_signature = None
+        if signature == prev_signature and os.path.exists(out_file):
+            msg = "Found {0} (same link signature), did not relink.".format(
+                out_file)
+            if runner.logger:
+                runner.logger.info(msg)
+            else:
+                print(msg)
+            return out_file
     runner.run()
+    if only_update:
+        rw.save_to_metadata_file(metadir, out_file, signature)
     return out_file
 
 
@@ -250,6 +440,10 @@ def link_py_so(obj_files, so_file=None, cwd=None, libraries=None,
         Any C++ objects? default: False
     fort: bool
         Any Fortran objects? default: False
+    support_libraries: iterable of SupportLibrary instances
+        prebuilt libraries to link against (see
+        `pycompilation.support.build_support_library`). Shared ones are
+        copied next to so_file (the cache may evict the originals).
     kwargs**: dict
         keyword arguments passed onto `link(...)`
 
@@ -257,7 +451,20 @@ def link_py_so(obj_files, so_file=None, cwd=None, libraries=None,
     -------
     Absolute path to the generate shared object
     """
-    libraries = libraries or []
+    libraries = list(libraries or [])
+    flags = kwargs.pop('flags', [])
+    out_dir = os.path.dirname(get_abspath(so_file or obj_files[-1], cwd=cwd))
+    for lib in kwargs.pop('support_libraries', ()):
+        if lib.kind == 'shared':
+            path = os.path.join(out_dir, os.path.basename(lib.path))
+            copy(lib.path, path, only_update=True)
+            if '-Wl,-rpath,' + out_dir not in flags:
+                flags.append('-Wl,-rpath,' + out_dir)
+        else:
+            path = lib.path
+        libraries.append(path)
+        fort = fort or lib.fort
+        cplus = cplus or lib.cplus
 
     include_dirs = kwargs.pop('include_dirs', [])
     library_dirs = kwargs.pop('library_dirs', [])
@@ -282,7 +489,6 @@ def link_py_so(obj_files, so_file=None, cwd=None, libraries=None,
                 ABIFLAGS or '')
             libraries += [pythonlib]
 
-    flags = kwargs.pop('flags', [])
     needed_flags = ('-pthread',)
     for flag in needed_flags:
         if flag not in flags:
@@ -302,13 +508,13 @@ def link_py_so(obj_files, so_file=None, cwd=None, libraries=None,
 
     # flags.extend(kwargs.pop('flags', []))
 
-    return link(obj_files, shared=True, flags=flags, cwd=cwd,
+    return link(obj_files, so_file, shared=True, flags=flags, cwd=cwd,
                 cplus=cplus, fort=fort, include_dirs=include_dirs,
                 libraries=libraries, library_dirs=library_dirs, **kwargs)
 
 
 def simple_cythonize(src, destdir=None, cwd=None, logger=None,
-                     full_module_name=None, only_update=False,
+                     full_module_name=None, only_update=False, cache=False,
                      **cy_kwargs):
     """
     Generates a C file from a Cython source file.
@@ -327,15 +533,15 @@ def simple_cythonize(src, destdir=None, cwd=None, logger=None,
         passed to cy_compile (default: None)
     only_update: bool
         Only cythonize if source is newer. default: False
+    cache: bool
+        Reuse (and store) the output in the managed cache (see
+        `pycompilation.cache`), keyed by the content of the source and
+        its .pxd/.pxi dependencies and the options (see
+        `pycompilation.remote_cache.cython_key`). default: False
     **cy_kwargs:
         second argument passed to cy_compile.
         Generates a .cpp file if cplus=True in cy_kwargs, else a .c file.
     """
-    from Cython.Compiler.Main import (
-        default_options, CompilationOptions
-    )
-    from Cython.Compiler.Main import compile as cy_compile
-
     assert src.lower().endswith('.pyx') or src.lower().endswith('.py')
     cwd = cwd or '.'
     destdir = destdir or '.'
@@ -355,6 +561,43 @@ def simple_cythonize(src, destdir=None, cwd=None, logger=None,
                 print(msg)
             return dstfile
 
+    remote = get_remote_cache()
+    if remote is not None or cache:
+        key = cython_key(src, cwd, full_module_name, cy_kwargs)
+    if cache:
+        from .cache import entry_dir
+        cached = os.path.join(entry_dir('cython', key, create=False), c_name)
+        if os.path.exists(cached):
+            shutil.copyfile(cached, os.path.join(cwd, dstfile))
+            if logger:
+                logger.info("Reused cached {0}".format(dstfile))
+            return dstfile
+    if remote is not None:
+        if remote.get_file('cython', key, os.path.join(cwd, dstfile)):
+            if logger:
+                logger.info("Fetched {0} from remote cache".format(dstfile))
+            return dstfile
+
+    with _cythonize_lock:
+        _cythonize(src, destdir, cwd, logger, full_module_name, dstfile,
+                   c_name, cy_kwargs)
+    if cache:  # entry only created once Cython succeeded
+        cached = os.path.join(entry_dir('cython', key), c_name)
+        tmp = '{0}.{1}.tmp'.format(cached, os.getpid())
+        shutil.copyfile(os.path.join(cwd, dstfile), tmp)
+        os.rename(tmp, cached)  # atomic: concurrent builds
+    if remote is not None:
+        remote.put_file('cython', key, os.path.join(cwd, dstfile))
+    return dstfile
+
+
+def _cythonize(src, destdir, cwd, logger, full_module_name, dstfile, c_name,
+               cy_kwargs):
+    from Cython.Compiler.Main import (
+        default_options, CompilationOptions
+    )
+    from Cython.Compiler.Main import compile as cy_compile
+
     if cwd:
         ori_dir = os.getcwd()
     else:
@@ -377,7 +620,6 @@ def simple_cythonize(src, destdir=None, cwd=None, logger=None,
                         destdir)
     finally:
         os.chdir(ori_dir)
-    return dstfile
 
 
 extension_mapping = {
@@ -419,8 +661,15 @@ def src2obj(srcpath, CompilerRunner_=None, objpath=None,
         ('.o'/'.obj' for Unix/Windows).
     inc_py: bool
         add Python include path to include_dirs. default: False
+    opt_flags: iterable of strings
+        flags appended after all others (i.e. e.g. '-O1' takes precedence
+        over the optimization level implied by options).
     **kwargs: dict
         keyword arguments passed onto CompilerRunner_ or pyx2obj
+
+    The wall time (and phase times when using time_report='report' or
+    'trace') of the compilation is recorded in cwd (see
+    `get_compile_record`).
     """
     name, ext = os.path.splitext(os.path.basename(srcpath))
     if objpath is None:
@@ -463,13 +712,145 @@ def src2obj(srcpath, CompilerRunner_=None, objpath=None,
             else:
                 print(msg)
             return objpath
+    opt_flags = list(kwargs.pop('opt_flags', None) or [])
     runner = CompilerRunner_(
         [srcpath], objpath, include_dirs=include_dirs,
         run_linker=run_linker, cwd=cwd, **kwargs)
+    runner.flags.extend(opt_flags)
+    remote = get_remote_cache()
+    key = None
+    if remote is not None and remote.available and issubclass(
+            CompilerRunner_, (CCompilerRunner, CppCompilerRunner)):
+        key = object_key(runner)  # runs the preprocessor
+        if key and remote.get_file('objects', key,
+                                   get_abspath(objpath, cwd=cwd)):
+            if kwargs.get('logger', None):
+                kwargs['logger'].info(
+                    "Fetched {0} from remote cache".format(objpath))
+            return objpath
     runner.run()
+    _record_compile(runner, get_abspath(srcpath, cwd=cwd), cwd, opt_flags)
+    if key:
+        remote.put_file('objects', key, get_abspath(objpath, cwd=cwd))
     return objpath
 
 
+_compile_times_rw = MetaReaderWriter('.metadata_compile_times')
+
+
+def _record_compile(runner, abs_src, cwd, opt_flags, size=None):
+    _compile_times_rw.save_to_metadata_file(
+        get_abspath(cwd or '.'), abs_src, {
+            'wall_time': runner.wall_time,
+            'phase_times': runner.phase_times,
+            'opt_flags': opt_flags,
+            'size': os.path.getsize(abs_src) if size is None else size,
+        })
+
+
+def get_compile_record(srcpath, cwd=None):
+    """
+    Returns a dict describing the last compilation of srcpath in cwd
+    (keys: 'wall_time', 'phase_times', 'opt_flags' and 'size') or None.
+    """
+    try:
+        return _compile_times_rw.get_from_metadata_file(
+            get_abspath(cwd or '.'), get_abspath(srcpath, cwd=cwd))
+    except (FileNotFoundError, KeyError):
+        return None
+
+
+def src2obj_from_string(code_, name, objpath=None, cwd=None,
+                        only_update=False, CompilerRunner_=None, inc_py=False,
+                        **kwargs):
+    """
+    Compiles a source code string to an object file by piping it to the
+    compiler (no source file is written). A #line directive makes
+    diagnostics refer to `name` and the directory of `name` is added
+    to the quote include path (-iquote).
+
+    Parameters
+    ----------
+    code_: string
+        source code
+    name: path string
+        (virtual) path of the source file, the extension determines the
+        language (see `extension_mapping`).
+    objpath: path string (optional)
+        path to generated object. default: deduced from name
+    cwd: path string (optional)
+        working directory and root of relative paths. default: current dir.
+    only_update: bool
+        only compile if the md5 sum of the source (and the keyword
+        arguments) differs from the one recorded for objpath when it
+        was last compiled. default: False
+    CompilerRunner_: pycompilation.CompilerRunner subclass (optional)
+        Default: deduced from extension of name
+    inc_py: bool
+        add Python include path to include_dirs. default: False
+    **kwargs: dict
+        keyword arguments passed onto CompilerRunner_
+
+    Returns
+    -------
+    objpath
+    """
+    cwd = cwd or '.'
+    base, ext = os.path.splitext(name)
+    objpath = objpath or base + objext
+    logger = kwargs.get('logger', None)
+    include_dirs = list(kwargs.pop('include_dirs', []))
+    if inc_py:
+        from distutils.sysconfig import get_python_inc
+        py_inc_dir = get_python_inc()
+        if py_inc_dir not in include_dirs:
+            include_dirs.append(py_inc_dir)
+    if CompilerRunner_ is None:
+        CompilerRunner_, std = extension_mapping[ext.lower()]
+        if 'std' not in kwargs:
+            kwargs['std'] = std
+    flags = list(kwargs.pop('flags', []))
+    flags += ['-iquote', os.path.dirname(get_abspath(name, cwd=cwd))]
+    if issubclass(CompilerRunner_, FortranCompilerRunner):
+        flags.append('-ffixed-form' if ext.lower() in (
+            '.f', '.for', '.ftn') else '-ffree-form')
+
+    md = md5_of_string(code_.encode('utf-8'))
+    md.update(repr([CompilerRunner_.__name__, name, flags, include_dirs] +
+                   sorted((k, v) for k, v in kwargs.items()
+                          if k != 'logger')).encode('utf-8'))
+    key = md.hexdigest()
+    abs_objpath = get_abspath(objpath, cwd=cwd)
+    metadir = os.path.dirname(abs_objpath)
+    if only_update and os.path.exists(abs_objpath):
+        try:
+            prev_key = _stdin_rw.get_from_metadata_file(metadir, abs_objpath)
+        except (FileNotFoundError, KeyError):
+            prev_key = None
+        if key == prev_key:
+            msg = "Found {0} (same source md5), did not recompile.".format(
+                objpath)
+            if logger:
+                logger.info(msg)
+            else:
+                print(msg)
+            return objpath
+    opt_flags = list(kwargs.pop('opt_flags', None) or [])
+    runner = CompilerRunner_(
+        ['-'], objpath, flags=flags, include_dirs=include_dirs,
+        run_linker=False, cwd=cwd, stdin=CompilerRunner_.line_directive.format(
+            1, name) + code_, **kwargs)
+    runner.flags.extend(opt_flags)
+    runner.run()
+    _record_compile(runner, get_abspath(name, cwd=cwd), cwd, opt_flags,
+                    len(code_))
+    _stdin_rw.save_to_metadata_file(metadir, abs_objpath, key)
+    return objpath
+
+
+_stdin_rw = MetaReaderWriter('.metadata_stdin')
+
+
 def pyx2obj(pyxpath, objpath=None, interm_c_dir=None, cwd=None,
             logger=None, full_module_name=None, only_update=False,
             metadir=None, include_numpy=False, include_dirs=None,
@@ -615,7 +996,7 @@ def any_cplus(srcs):
 
 def compile_link_import_py_ext(
         srcs, extname=None, build_dir=None, compile_kwargs=None,
-        link_kwargs=None, **kwargs):
+        link_kwargs=None, support_libraries=None, extra_objs=None, **kwargs):
     """
     Compiles sources in `srcs` to a shared object (python extension)
     which is imported. If shared object is newer than the sources, they
@@ -634,6 +1015,12 @@ def compile_link_import_py_ext(
         keyword arguments passed to compile_sources
     link_kwargs: dict
         keyword arguments passed to link_py_so
+    support_libraries: iterable of SupportLibrary instances
+        prebuilt libraries to link against, their include_dirs are
+        added when compiling.
+    extra_objs: iterable of path strings
+        additional (already compiled) object files to link, they are
+        considered dependencies of the extension module as well.
     **kwargs:
         additional keyword arguments overwrites to both compile_kwargs
         and link_kwargs useful for convenience e.g. when passing logger
@@ -660,32 +1047,250 @@ def compile_link_import_py_ext(
     link_kwargs = link_kwargs or {}
     link_kwargs.update(kwargs)
 
+    if support_libraries:
+        include_dirs = list(compile_kwargs.get('include_dirs', []))
+        for lib in support_libraries:
+            include_dirs.extend(d for d in lib.include_dirs
+                                if d not in include_dirs)
+        compile_kwargs['include_dirs'] = include_dirs
+        link_kwargs['support_libraries'] = support_libraries
+
+    extra_objs = [get_abspath(obj, cwd=build_dir) for obj in extra_objs or []]
+    link_kwargs.setdefault('so_file', extname + sharedext)
+
     try:
-        mod = import_module_from_file(os.path.join(build_dir, extname), srcs)
+        mod = import_module_from_file(os.path.join(build_dir, extname),
+                                      list(srcs) + extra_objs)
     except ImportError:
         objs = compile_sources(list(map(get_abspath, srcs)), destdir=build_dir,
                                cwd=build_dir, **compile_kwargs)
-        so = link_py_so(
-            objs, cwd=build_dir, fort=any_fort(srcs), cplus=any_cplus(srcs),
-            **link_kwargs)
+        fort = link_kwargs.pop('fort', False) or any_fort(srcs)
+        cplus = link_kwargs.pop('cplus', False) or any_cplus(srcs)
+        so = link_py_so(extra_objs + objs, cwd=build_dir, fort=fort,
+                        cplus=cplus, **link_kwargs)
         mod = import_module_from_file(so)
     return mod
 
 
-def compile_link_import_strings(codes, build_dir=None, **kwargs):
+def write_code_string(dest, code_, only_update=True):
     """
-    Creates a temporary directory and dumps, compiles and links
-    provided source code.
+    Writes source code to `dest` (together with a '.md5' sidecar file).
+    If only_update is True the file is left untouched (keeping its
+    modification time) when its content is identical.
+
+    Returns
+    -------
+    True if the file was written
+    """
+    differs = True
+    md5_in_mem = md5_of_string(code_.encode('utf-8')).hexdigest()
+    if only_update and os.path.exists(dest):
+        if os.path.exists(dest+'.md5'):
+            with open(dest+'.md5', 'rt') as ifh:
+                md5_on_disk = ifh.read()
+        else:
+            md5_on_disk = md5_of_file(dest).hexdigest()
+        differs = md5_on_disk != md5_in_mem
+    if not only_update or differs:
+        with open(dest, 'wt') as ofh:
+            ofh.write(code_)
+            with open(dest+'.md5', 'wt') as ofh_md5:
+                ofh_md5.write(md5_in_mem)
+    return not only_update or differs
+
+
+def toolchain_identity(preferred_vendor=None):
+    """
+    Returns a string identifying the C, C++ and Fortran compilers which
+    would be used (path, size and modification time of the binaries)
+    together with the environment variables affecting compilation.
+    """
+    parts = []
+    for Runner in (CCompilerRunner, CppCompilerRunner, FortranCompilerRunner):
+        binary = os.environ.get(Runner.environ_key_compiler, None)
+        if not binary:
+            vendor = preferred_vendor or os.environ.get('COMPILER_VENDOR')
+            candidates = list(Runner.compiler_dict.values())
+            if vendor in Runner.compiler_dict:
+                candidates.insert(0, Runner.compiler_dict[vendor])
+            try:
+                name, binary = find_binary_of_command(candidates)
+            except RuntimeError:
+                binary = None
+        if binary and os.path.exists(binary):
+            st = os.stat(binary)
+            binary = '{}:{}:{}'.format(binary, st.st_size, st.st_mtime)
+        parts.append('{}={}'.format(Runner.__name__, binary))
+    for key in ('CFLAGS', 'CXXFLAGS', 'FFLAGS', 'LDFLAGS'):
+        parts.append('{}={}'.format(key, os.environ.get(key, '')))
+    return ';'.join(parts)
+
+
+def python_abi_tag():
+    """ Returns a string identifying the Python ABI (and Cython version) """
+    try:
+        from Cython import __version__ as cython_version
+    except ImportError:
+        cython_version = None
+    return '{};{};cython={}'.format(sharedext, sys.version, cython_version)
+
+
+def build_key(codes, kwargs, python_abi=True):
+    """
+    Hex digest identifying a build of code strings: their content, the
+    keyword arguments (except 'logger'), the toolchain (see
+    `toolchain_identity`) and the Python ABI (see `python_abi_tag`).
+
+    Parameters
+    ----------
+    codes: iterable of name/source pair tuples
+    kwargs: dict
+        keyword arguments of `compile_link_import_strings`
+    python_abi: bool
+        include the Python ABI (False for plain shared libraries).
+        default: True
+    """
+    md = md5_of_string(python_abi_tag().encode('utf-8') if python_abi
+                       else b'')
+    md.update(toolchain_identity(kwargs.get(
+        'preferred_vendor', None)).encode('utf-8'))
+    md.update(repr(sorted(
+        (k, v) for k, v in kwargs.items() if k != 'logger')).encode('utf-8'))
+    for name, code_ in codes:
+        md.update(name.encode('utf-8'))
+        md.update(md5_of_string(code_.encode('utf-8')).digest())
+    return md.hexdigest()
+
+
+def _nshards(split):
+    return (os.cpu_count() or 1) if split is True else int(split)
+
+
+def _split_codes(codes, nshards):
+    from .split import split_code, split_extensions, has_split_markers
+    result = []
+    for name, code_ in codes:
+        if os.path.splitext(name)[1].lower() in split_extensions and \
+           has_split_markers(code_):
+            result.extend(split_code(name, code_, nshards))
+        else:
+            result.append((name, code_))
+    return result
+
+
+def _compile_strings(codes, build_dir, only_update, kwargs):
+    """ Compiles code strings in memory using the compile keyword
+    arguments of `compile_link_import_py_ext`, returns object paths. """
+    compile_kwargs = dict(kwargs.get('compile_kwargs', None) or {})
+    compile_kwargs.update((k, v) for k, v in kwargs.items() if k not in (
+        'extname', 'compile_kwargs', 'link_kwargs', 'support_libraries',
+        'extra_objs'))
+    compile_kwargs['only_update'] = only_update
+    for lib in kwargs.get('support_libraries', None) or ():
+        compile_kwargs['include_dirs'] = list(compile_kwargs.get(
+            'include_dirs', [])) + list(lib.include_dirs)
+    nproc = compile_kwargs.pop('nproc', None)
+    for key in ('per_file_kwargs', 'keep_dir_struct', 'destdir'):
+        compile_kwargs.pop(key, None)
+
+    def _compile(name_code):
+        file_kwargs = dict((k, list(v) if isinstance(v, list) else v)
+                           for k, v in compile_kwargs.items())
+        return src2obj_from_string(name_code[1], name_code[0],
+                                   cwd=build_dir, **file_kwargs)
+
+    if nproc is None or nproc <= 1 or len(codes) <= 1:
+        return [_compile(nc) for nc in codes]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=nproc) as executor:
+        return list(executor.map(_compile, codes))
+
+
+def compile_link_import_strings(codes, build_dir=None, use_tuned=False,
+                                in_memory=None, split=None, ufuncs=None,
+                                chunked=None, wrappers=None, **kwargs):
+    """
+    Dumps, compiles and links provided source code in a build directory
+    and imports the resulting extension module.
 
     Parameters
     ----------
     codes: iterable of name/source pair tuples
     build_dir: string (default: None)
-        path to cache_dir. None implies use a temporary directory.
+        path to cache_dir. None implies use a persistent directory in
+        the managed cache (see `pycompilation.cache`) derived from
+        `build_key`, i.e. identical inputs are only compiled once (also
+        across processes).
+    use_tuned: bool
+        Apply configuration persisted by `pycompilation.tuning.autotune`
+        (if any) for these codes on this CPU model. When applied to an
+        explicit build_dir a subdirectory unique to the configuration is
+        used. default: False
+    in_memory: bool
+        Pipe C, C++ and Fortran code strings to the compiler (see
+        `src2obj_from_string`) instead of writing them to build_dir.
+        Cython sources and other files (e.g. headers) are still written,
+        as are all sources when the 'debug' option or an 'opt_policy'
+        (which measures source files) is given.
+        default: environment variable PYCOMPILATION_IN_MEMORY == '1'
+    split: bool or int
+        Split C/C++ code strings with split markers into (at most) this
+        many translation units (True: number of CPUs) which are compiled
+        in parallel (see `pycompilation.split`). default: None (no split)
+    ufuncs: dict
+        NumPy ufuncs to generate from (scalar) C kernels: names mapped to
+        prototypes (see `pycompilation.ufuncs.ufunc_codes`).
+        default: None
+    chunked: dict
+        multithreaded wrappers (processing chunks without the GIL) to
+        generate for array kernels: names mapped to prototypes (see
+        `pycompilation.chunked.chunked_codes`), implies the 'openmp'
+        option. default: None
+    wrappers: dict or True
+        zero-copy Cython wrappers to generate from C prototypes (True:
+        for the bind(c) procedures of the Fortran code strings), see
+        `pycompilation.wrappers.wrapper_codes`. default: None
     **kwargs:
         keyword arguments passed onto `compile_link_import_py_ext`
     """
-    build_dir = build_dir or tempfile.mkdtemp()
+    codes = list(codes)
+    if use_tuned:
+        from .tuning import get_tuned_config, apply_config
+        tuned = get_tuned_config(codes, dict(
+            kwargs, ufuncs=ufuncs, chunked=chunked, wrappers=wrappers))
+    else:
+        tuned = None
+    if ufuncs:
+        from .ufuncs import ufunc_codes
+        codes, kwargs['extname'] = ufunc_codes(
+            codes, ufuncs, kwargs.get('extname', None))
+        kwargs['compile_kwargs'] = dict(
+            kwargs.get('compile_kwargs', None) or {}, include_numpy=True)
+    if chunked:
+        from .chunked import chunked_codes
+        codes, kwargs['extname'] = chunked_codes(
+            codes, chunked, kwargs.get('extname', None))
+        kwargs['options'] = list(kwargs.get('options', None) or [])
+        if 'openmp' not in kwargs['options']:
+            kwargs['options'].append('openmp')
+    if wrappers:
+        from .wrappers import wrapper_codes
+        codes, kwargs['extname'] = wrapper_codes(
+            codes, wrappers, kwargs.get('extname', None))
+    if tuned:
+        kwargs = apply_config(kwargs, tuned)
+
+    remote = get_remote_cache()
+    key = build_key(codes, kwargs) if (
+        build_dir is None or remote is not None) else None
+    if build_dir is None:
+        from .cache import entry_dir
+        build_dir = entry_dir('build', key)
+    elif tuned:
+        build_dir = os.path.join(build_dir, 'tuned_' + md5_of_string(
+            repr(sorted(tuned.items())).encode('utf-8')).hexdigest()[:10])
+        if not os.path.isdir(build_dir):
+            make_dirs(build_dir)
     if not os.path.isdir(build_dir):
         raise OSError("Non-existent directory: ", build_dir)
 
@@ -695,24 +1300,51 @@ def compile_link_import_strings(codes, build_dir=None, **kwargs):
         logging.basicConfig(level=logging.DEBUG)
         kwargs['logger'] = logging.getLogger()
 
+    if in_memory is None:
+        in_memory = os.environ.get('PYCOMPILATION_IN_MEMORY', '0') == '1'
+    if 'debug' in kwargs.get('options', ()) or kwargs.get(
+            'opt_policy', None) or (kwargs.get('compile_kwargs', None) or
+                                    {}).get('opt_policy', None):
+        in_memory = False
     only_update = kwargs.get('only_update', True)
-    for name, code_ in codes:
+    source_codes = codes
+    if split:
+        nshards = _nshards(split)
+        source_codes = _split_codes(codes, nshards)
+        if len(source_codes) > len(codes):
+            kwargs['compile_kwargs'] = dict(
+                kwargs.get('compile_kwargs', None) or {})
+            kwargs['compile_kwargs'].setdefault('nproc', nshards)
+    in_memory_codes = []
+    for name, code_ in source_codes:
+        ext = os.path.splitext(name)[1].lower()
+        if in_memory and ext in extension_mapping:
+            in_memory_codes.append((name, code_))
+            continue
         dest = os.path.join(build_dir, name)
-        differs = True
-        md5_in_mem = md5_of_string(code_.encode('utf-8')).hexdigest()
-        if only_update and os.path.exists(dest):
-            if os.path.exists(dest+'.md5'):
-                with open(dest+'.md5', 'rt') as ifh:
-                    md5_on_disk = ifh.read()
-            else:
-                md5_on_disk = md5_of_file(dest).hexdigest()
-            differs = md5_on_disk != md5_in_mem
-        if not only_update or differs:
-            with open(dest, 'wt') as ofh:
-                ofh.write(code_)
-                with open(dest+'.md5', 'wt') as ofh_md5:
-                    ofh_md5.write(md5_in_mem)
-        source_files.append(dest)
-
-    return compile_link_import_py_ext(
+        write_code_string(dest, code_, only_update)
+        if ext in extension_mapping or ext == '.pyx':
+            source_files.append(dest)  # i.e. not e.g. headers
+    if in_memory_codes:
+        kwargs['extra_objs'] = _compile_strings(
+            in_memory_codes, build_dir, only_update, kwargs)
+        names = [name for name, _ in in_memory_codes]
+        kwargs['link_kwargs'] = dict(kwargs.get('link_kwargs', None) or {},
+                                     fort=any_fort(names),
+                                     cplus=any_cplus(names))
+
+    extname = kwargs.get('extname', None) or os.path.splitext(
+        os.path.basename(codes[-1][0]))[0]
+    kwargs['extname'] = extname
+    so_file = None
+    if remote is not None:
+        so_file = os.path.join(build_dir, extname + sharedext)
+        if os.path.exists(so_file) or remote.get_file(
+                'extensions', key, so_file):
+            so_file = None  # present (or fetched), nothing to upload
+
+    mod = compile_link_import_py_ext(
         source_files, build_dir=build_dir, **kwargs)
+    if so_file is not None and os.path.exists(so_file):
+        remote.put_file('extensions', key, so_file)
+    return mod
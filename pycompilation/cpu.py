@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+Information about the CPU of the running machine.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import platform
+from collections import OrderedDict
+
+
+# x86-64 micro-architecture levels (as understood by -march=) mapped to the
+# /proc/cpuinfo flags required in addition to those of the previous level.
+x86_64_isa_levels = OrderedDict([
+    ('x86-64', ()),
+    ('x86-64-v2', ('cx16', 'lahf_lm', 'popcnt', 'sse4_1', 'sse4_2',
+                   'ssse3')),
+    ('x86-64-v3', ('avx', 'avx2', 'bmi1', 'bmi2', 'f16c', 'fma', 'abm',
+                   'movbe', 'xsave')),
+    ('x86-64-v4', ('avx512f', 'avx512bw', 'avx512cd', 'avx512dq',
+                   'avx512vl')),
+])
+
+
+def _cpuinfo_field(field, path='/proc/cpuinfo'):
+    """ Returns the value of the first occurrence of field (or None) """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rt') as ifh:
+        for line in ifh:
+            if ':' not in line:
+                continue
+            key, value = line.split(':', 1)
+            if key.strip() == field:
+                return value.strip()
+    return None
+
+
+def cpu_model():
+    """
+    Returns a string identifying the CPU model, e.g.
+    'Intel(R) Xeon(R) CPU E5-2680 v3 @ 2.50GHz'.
+
+    Read from /proc/cpuinfo when available, otherwise the information
+    of the ``platform`` module is used.
+    """
+    model = _cpuinfo_field('model name') or _cpuinfo_field('cpu model')
+    if model:
+        return model
+    return platform.processor() or platform.machine()
+
+
+def cpu_flags():
+    """
+    Returns the set of CPU feature flags (as listed under 'flags' in
+    /proc/cpuinfo), empty if unavailable.
+    """
+    flags = _cpuinfo_field('flags') or _cpuinfo_field('Features') or ''
+    return set(flags.split())
+
+
+def is_x86_64():
+    return platform.machine().lower() in ('x86_64', 'amd64')
+
+
+def supported_isa_levels(flags=None):
+    """
+    Returns the x86-64 ISA levels (keys of ``x86_64_isa_levels``)
+    supported by the running CPU, ordered from baseline to most capable.
+
+    Parameters
+    ==========
+    flags: set of strings
+        CPU flags, default: ``cpu_flags()``
+    """
+    if not is_x86_64():
+        return []
+    flags = cpu_flags() if flags is None else flags
+    levels, required = [], set()
+    for level, level_flags in x86_64_isa_levels.items():
+        required.update(level_flags)
+        if not required.issubset(flags):
+            break
+        levels.append(level)
+    return levels
+
+
+def cache_size(level=2, cpu=0):
+    """
+    Returns the size in bytes of the data (or unified) cache of a given
+    level, None when unknown (read from sysfs on Linux).
+
+    Parameters
+    ==========
+    level: int
+        1, 2 or 3
+    cpu: int
+        index of the CPU
+    """
+    base = '/sys/devices/system/cpu/cpu{}/cache'.format(cpu)
+    if not os.path.isdir(base):
+        return None
+    for index in sorted(os.listdir(base)):
+        path = os.path.join(base, index)
+        try:
+            with open(os.path.join(path, 'level'), 'rt') as ifh:
+                if int(ifh.read()) != level:
+                    continue
+            with open(os.path.join(path, 'type'), 'rt') as ifh:
+                if ifh.read().strip() not in ('Data', 'Unified'):
+                    continue
+            with open(os.path.join(path, 'size'), 'rt') as ifh:
+                size = ifh.read().strip()
+        except (IOError, OSError, ValueError):
+            continue
+        factor = {'K': 1024, 'M': 1024**2, 'G': 1024**3}.get(size[-1:], 1)
+        return int(size.rstrip('KMG'))*factor
+    return None
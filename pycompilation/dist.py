@@ -8,17 +8,21 @@ from __future__ import print_function, division, absolute_import
 
 import os
 import re
+from collections import OrderedDict
 
 from distutils.command import build_ext, sdist
+from distutils.errors import DistutilsSetupError
 from distutils.extension import Extension
 
 from .compilation import (
     compile_sources, link_py_so, any_fort,
-    any_cplus, simple_cythonize
+    any_cplus, simple_cythonize, objext, toolchain_identity, python_abi_tag
 )
+from .templating import render_to
 from .util import (
-    copy, get_abspath, missing_or_other_newer,
-    MetaReaderWriter, FileNotFoundError, pyx_is_cplus, make_dirs
+    copy, get_abspath,
+    MetaReaderWriter, FileNotFoundError, pyx_is_cplus,
+    md5_of_file, md5_of_string
 )
 
 
@@ -116,34 +120,26 @@ def render_python_template_to(src, dest, subsd, only_update=False,
                               prev_subsd=None, create_dest_dirs=True,
                               logger=None):
         """
-        Overload this function if you want to use a template engine such as
-        e.g. mako.
+        Renders src using %-formatting, dest is only written when its
+        content changes. See `pycompilation.templating.template_renderer`
+        for other template engines (e.g. jinja2 or mako).
         """
-        if only_update:
-            if subsd == prev_subsd:
-                if not missing_or_other_newer(dest, src):
-                    if logger:
-                        msg = ("Did not re-render {}. "
-                               "(destination newer + same dict)")
-                        logger.info(msg.format(src))
-                    return
-
-        with open(src, 'rt') as ifh:
-            data = ifh.read()  # Don't go crazy on file size...
-
-        if create_dest_dirs:
-            dest_dir = os.path.dirname(dest)
-            if not os.path.exists(dest_dir):
-                make_dirs(dest_dir)
-
-        with open(dest, 'wt') as ofh:
-            ofh.write(data % subsd)
+        render_to(src, dest, subsd, 'percent', only_update, prev_subsd,
+                  create_dest_dirs, logger)
 
 
 class pc_build_ext(build_ext.build_ext):
     """
     build_ext class for PCExtension
     Support for template_regexps
+
+    Extensions whose inputs are unchanged since the last build (see
+    `extension_fingerprint`) are skipped unless ``--force`` is given.
+
+    With ``--parallel``/``-j`` (``self.parallel``) extensions are built
+    concurrently, all compilations and links share one pool of that many
+    workers. A source used by several extensions is compiled once per
+    distinct set of compile options.
     """
 
     render_callback = staticmethod(render_python_template_to)
@@ -151,110 +147,351 @@ class pc_build_ext(build_ext.build_ext):
     def run(self):
         if self.dry_run:
             return  # honor the --dry-run flag
+        build_temp = get_abspath(self.build_temp)
+        toolchain = toolchain_identity()
+        fingerprints, extensions = {}, []
         for ext in self.extensions:
-            sources = []
-            if ext.logger:
-                ext.logger.info("Copying/rendering sources...")
+            if ext.only_update:
+                fingerprints[ext.name] = extension_fingerprint(
+                    ext, self.get_ext_fullpath(ext.name), toolchain)
+                if not self.force and self._pc_is_unchanged(
+                        ext, fingerprints[ext.name]):
+                    if ext.logger:
+                        ext.logger.info("Inputs of {} unchanged, skipping "
+                                        "build.".format(ext.name))
+                    continue
+            extensions.append(ext)
+        prepared = [(ext, self._pc_prepare(ext, build_temp))
+                    for ext in extensions]
+        _disambiguate_objects(prepared)
+        objects = {}
+        njobs = self._pc_njobs()
+        if njobs <= 1:
+            results = [self._pc_compile_link(ext, sources, compile_kwargs,
+                                             link_kwargs, build_temp, objects)
+                       for ext, (sources, compile_kwargs, link_kwargs)
+                       in prepared]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=njobs) as executor:
+                with ThreadPoolExecutor(
+                        max_workers=max(len(prepared), 1)) as ext_executor:
+                    futures = [ext_executor.submit(
+                        self._pc_compile_link, ext, sources, compile_kwargs,
+                        link_kwargs, build_temp, objects, executor)
+                        for ext, (sources, compile_kwargs, link_kwargs)
+                        in prepared]
+                    results = [future.result() for future in futures]
+
+        for ext, abs_so_path in zip(extensions, results):
+            if abs_so_path is not None:
+                copy(
+                    abs_so_path, self.get_ext_fullpath(ext.name),
+                    only_update=ext.only_update and not self.force,
+                    create_dest_dirs=True, logger=ext.logger
+                )
+            if ext.name in fingerprints:
+                _fingerprint_rw.save_to_metadata_file(
+                    self.build_temp, ext.name, (fingerprints[ext.name],
+                                                self._pc_output_stat(ext)))
+
+    def _pc_output_stat(self, ext):
+        if not ext.link_ext:
+            return None
+        st = os.stat(self.get_ext_fullpath(ext.name))
+        return st.st_size, st.st_mtime
+
+    def _pc_is_unchanged(self, ext, fingerprint):
+        """ Single lookup of the fingerprint recorded by the last build """
+        try:
+            prev, output_stat = _fingerprint_rw.get_from_metadata_file(
+                self.build_temp, ext.name)
+            return prev == fingerprint and \
+                output_stat == self._pc_output_stat(ext)
+        except (FileNotFoundError, KeyError, OSError):
+            return False
+
+    def _pc_njobs(self):
+        njobs = self.parallel
+        if njobs is True:
+            njobs = os.cpu_count() if hasattr(os, 'cpu_count') else None
+        return int(njobs or 1)
+
+    def _pc_prepare(self, ext, build_temp):
+        """
+        Copies/renders sources, copies build_files and dist_files and runs
+        the build_callbacks. Returns the sources (relative to build_temp)
+        and the keyword arguments for compile_sources and link_py_so.
+
+        Paths are made absolute here, i.e. before worker threads run
+        (Cython compilation changes the process working directory).
+        """
+        sources = []
+        if ext.logger:
+            ext.logger.info("Copying/rendering sources...")
+        njobs = self._pc_njobs()
+        if njobs <= 1 or len(ext.sources) <= 1:
             for f in ext.sources:
                 sources.append(_copy_or_render_source(
                     ext, f, self.build_temp, self.render_callback))
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=njobs) as executor:
+                sources.extend(executor.map(
+                    lambda f: _copy_or_render_source(
+                        ext, f, self.build_temp, self.render_callback),
+                    ext.sources))
+
+        if ext.logger:
+            ext.logger.info("Copying build_files...")
+        for f in ext.build_files:
+            copy(f, os.path.join(self.build_temp,
+                                 os.path.dirname(f)),
+                 only_update=ext.only_update,
+                 dest_is_dir=True,
+                 create_dest_dirs=True,
+                 logger=ext.logger)
 
-            if ext.logger:
-                ext.logger.info("Copying build_files...")
-            for f in ext.build_files:
-                copy(f, os.path.join(self.build_temp,
-                                     os.path.dirname(f)),
-                     only_update=ext.only_update,
-                     dest_is_dir=True,
-                     create_dest_dirs=True,
-                     logger=ext.logger)
-
-            if ext.pass_extra_compile_args:
-                # By default we do not pass extra_compile_kwargs
-                # since it contains '-fno-strict-aliasing' which
-                # harms performance.
-                ext.pycompilation_compile_kwargs['flags'] =\
-                    ext.extra_compile_args,
-            if ext.define_macros:
-                ext.pycompilation_compile_kwargs['define'] =\
-                    list(set(ext.define_macros +
-                             ext.pycompilation_compile_kwargs['define']))
-            if ext.undef_macros:
-                ext.pycompilation_compile_kwargs['undef'] =\
-                    list(set(ext.undef_macros +
-                             ext.pycompilation_compile_kwargs['undef']))
-
-            # Run build_callbaks if any were provided
-            for cb, args, kwargs in ext.build_callbacks:
-                cb(self.build_temp, self.get_ext_fullpath(
-                    ext.name), ext, *args, **kwargs)
-
-            # Compile sources to object files
-            src_objs = compile_sources(
-                sources,
-                cwd=self.build_temp,
-                include_dirs=list(map(get_abspath, ext.include_dirs)),
-                logger=ext.logger,
+        if ext.pass_extra_compile_args:
+            # By default we do not pass extra_compile_kwargs
+            # since it contains '-fno-strict-aliasing' which
+            # harms performance.
+            ext.pycompilation_compile_kwargs['flags'] =\
+                ext.extra_compile_args,
+        if ext.define_macros:
+            ext.pycompilation_compile_kwargs['define'] =\
+                list(set(ext.define_macros +
+                         ext.pycompilation_compile_kwargs['define']))
+        if ext.undef_macros:
+            ext.pycompilation_compile_kwargs['undef'] =\
+                list(set(ext.undef_macros +
+                         ext.pycompilation_compile_kwargs['undef']))
+
+        # Run build_callbaks if any were provided
+        for cb, args, kwargs in ext.build_callbacks:
+            cb(self.build_temp, self.get_ext_fullpath(
+                ext.name), ext, *args, **kwargs)
+
+        if ext.logger:
+            ext.logger.info(
+                "Copying files needed for distribution..")
+        for f, rel_dst in ext.dist_files:
+            rel_dst = rel_dst or os.path.basename(f)
+            copy(
+                f,
+                os.path.join(
+                    os.path.dirname(self.get_ext_fullpath(ext.name)),
+                    rel_dst,
+                ),
                 only_update=ext.only_update,
-                **ext.pycompilation_compile_kwargs
+                logger=ext.logger,
             )
 
-            if ext.logger:
-                ext.logger.info(
-                    "Copying files needed for distribution..")
-            for f, rel_dst in ext.dist_files:
-                rel_dst = rel_dst or os.path.basename(f)
-                copy(
-                    f,
-                    os.path.join(
-                        os.path.dirname(self.get_ext_fullpath(ext.name)),
-                        rel_dst,
-                    ),
-                    only_update=ext.only_update,
-                    logger=ext.logger,
-                )
+        compile_kwargs = dict(
+            ext.pycompilation_compile_kwargs,
+            include_dirs=list(map(get_abspath, ext.include_dirs)),
+            logger=ext.logger,
+            only_update=ext.only_update and not self.force,
+        )
+        link_kwargs = dict(
+            ext.pycompilation_link_kwargs,
+            cwd=build_temp,
+            flags=ext.extra_link_args,
+            library_dirs=list(map(get_abspath, ext.library_dirs)),
+            libraries=ext.libraries,
+            fort=any_fort(sources),
+            cplus=(((ext.language or '').lower() == 'c++') or
+                   any_cplus(sources)),
+            logger=ext.logger,
+            only_update=ext.only_update and not self.force,
+            extra_objects=list(map(get_abspath, ext.extra_objects)),
+        )
+        return sources, compile_kwargs, link_kwargs
+
+    def _pc_compile_link(self, ext, sources, compile_kwargs, link_kwargs,
+                         build_temp, objects, executor=None):
+        """
+        Compiles (objects are shared between extensions, see
+        `compile_sources`) and links an extension, returns the absolute
+        path of the shared object (None if ext.link_ext is False).
+        """
+        # Compile sources to object files
+        src_objs = compile_sources(
+            sources,
+            cwd=build_temp,
+            executor=executor,
+            objects=objects,
+            **compile_kwargs
+        )
 
-            # Link objects to a shared object
-            if ext.link_ext:
-                abs_so_path = link_py_so(
-                    src_objs+ext.extra_objects,
-                    cwd=self.build_temp,
-                    flags=ext.extra_link_args,
-                    library_dirs=list(map(get_abspath, ext.library_dirs)),
-                    libraries=ext.libraries,
-                    fort=any_fort(sources),
-                    cplus=(((ext.language or '').lower() == 'c++') or
-                           any_cplus(sources)),
-                    logger=ext.logger,
-                    only_update=ext.only_update,
-                    **ext.pycompilation_link_kwargs
-                )
-                copy(
-                    abs_so_path, self.get_ext_fullpath(ext.name),
-                    only_update=ext.only_update,
-                    create_dest_dirs=True, logger=ext.logger
-                )
+        # Link objects to a shared object
+        if not ext.link_ext:
+            return None
+        link_kwargs = dict(link_kwargs)
+        objs = src_objs + link_kwargs.pop('extra_objects')
+        if executor is None:
+            return link_py_so(objs, **link_kwargs)
+        return executor.submit(link_py_so, objs, **link_kwargs).result()
+
+
+_fingerprint_rw = MetaReaderWriter('.metadata_ext_fingerprint')
+
+
+def _file_digests(paths):
+    return [(f, md5_of_file(f).hexdigest() if os.path.isfile(f) else None)
+            for f in paths]
+
+
+def extension_fingerprint(ext, output, toolchain=None):
+    """
+    Hex digest of everything going into the build of a PCExtension: the
+    content of its sources, depends, build_files, dist_files and
+    extra_objects, its options (flags, macros, libraries, templates,
+    build_callbacks, ...), the output path and the toolchain (see
+    `pycompilation.compilation.toolchain_identity`).
+
+    Options with a non-deterministic repr (e.g. functions) make every
+    fingerprint unique, i.e. such extensions are always rebuilt. Headers
+    which are not listed in ``depends`` are not tracked.
+    """
+    def _kwargs(d):
+        return sorted((k, v) for k, v in d.items() if k != 'logger')
+    callbacks = [(getattr(cb, '__module__', None),
+                  getattr(cb, '__name__', repr(cb)), args, _kwargs(kwargs))
+                 for cb, args, kwargs in ext.build_callbacks]
+    return md5_of_string(repr([
+        python_abi_tag(), output, toolchain or toolchain_identity(),
+        _file_digests(ext.sources), _file_digests(ext.depends),
+        _file_digests(ext.build_files),
+        _file_digests([f for f, _ in ext.dist_files]), list(ext.dist_files),
+        _file_digests(ext.extra_objects), ext.template_regexps,
+        _kwargs(ext.pycompilation_compile_kwargs),
+        _kwargs(ext.pycompilation_link_kwargs), ext.pass_extra_compile_args,
+        ext.extra_compile_args, ext.extra_link_args, ext.define_macros,
+        ext.undef_macros, ext.include_dirs, ext.library_dirs, ext.libraries,
+        ext.language, ext.link_ext, callbacks
+    ]).encode('utf-8')).hexdigest()
+
+
+def _disambiguate_objects(prepared):
+    """
+    Sources (other than Cython sources) compiled with different options
+    by different extensions get distinct object files (suffixed by a
+    hash of the options) through 'per_file_kwargs'.
+    """
+    variants = {}
+    for ext, (sources, compile_kwargs, _) in prepared:
+        signature = repr(sorted((k, v) for k, v in compile_kwargs.items()
+                                if k != 'logger'))
+        for f in sources:
+            if not f.lower().endswith('.pyx'):
+                variants.setdefault(f, set()).add(signature)
+    for ext, (sources, compile_kwargs, _) in prepared:
+        signature = repr(sorted((k, v) for k, v in compile_kwargs.items()
+                                if k != 'logger'))
+        per_file_kwargs = dict(compile_kwargs.get('per_file_kwargs') or {})
+        for f in sources:
+            if len(variants.get(f, ())) < 2:
+                continue
+            name = os.path.splitext(os.path.basename(f))[0]
+            per_file_kwargs[f] = dict(per_file_kwargs.get(f, {}), objpath=(
+                os.path.join(os.path.dirname(f), '{}_{}{}'.format(
+                    name, md5_of_string(signature.encode('utf-8')
+                                        ).hexdigest()[:8], objext))))
+        if per_file_kwargs:
+            compile_kwargs['per_file_kwargs'] = per_file_kwargs
+
+
+def _sdist_cythonize(job):
+    src, cy_kwargs = job
+    return simple_cythonize(src, os.path.dirname(src), cache=True,
+                            **cy_kwargs)
+
+
+def _process_map(func, jobs, njobs):
+    """
+    Maps func over jobs in a pool of njobs forked processes (serially if
+    fork is unavailable: worker processes must not re-run setup.py).
+    """
+    if njobs > 1 and len(jobs) > 1:
+        try:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            context = multiprocessing.get_context('fork')
+        except (ImportError, AttributeError, ValueError):
+            pass
+        else:
+            with ProcessPoolExecutor(max_workers=min(njobs, len(jobs)),
+                                     mp_context=context) as executor:
+                return list(executor.map(func, jobs))
+    return list(map(func, jobs))
 
 
 class pc_sdist(sdist.sdist):
+    """
+    sdist class for PCExtension: Cython sources are cythonized (in a pool
+    of ``--parallel``/``-j`` processes, default: number of CPUs, reusing
+    cached output, see `simple_cythonize`) and templates are rendered.
+    A .pyx file shared by several extensions is cythonized once, which
+    requires the same include_dirs for all of them.
+    """
 
     render_callback = staticmethod(render_python_template_to)
 
+    user_options = sdist.sdist.user_options + [
+        ('parallel=', 'j', "number of parallel jobs (default: number of "
+         "CPUs)"),
+    ]
+
+    def initialize_options(self):
+        sdist.sdist.initialize_options(self)
+        self.parallel = None
+
+    def finalize_options(self):
+        sdist.sdist.finalize_options(self)
+        if self.parallel is not None:
+            self.parallel = int(self.parallel)
+
     def run(self):
+        njobs = self.parallel or (os.cpu_count() if hasattr(
+            os, 'cpu_count') else 1) or 1
+        cy_jobs, renders = OrderedDict(), []
         for ext in self.distribution.ext_modules:
-            _sources = []
             for src in ext.sources:
                 if src.endswith('.pyx'):
                     cy_kwargs = {
                         'cplus': pyx_is_cplus(src),
                         'include_path': ext.include_dirs
                     }
-                    _sources.append(simple_cythonize(
-                        src, os.path.dirname(src), **cy_kwargs))
+                    path = os.path.normpath(src)
+                    if cy_jobs.setdefault(path, cy_kwargs) != cy_kwargs:
+                        raise DistutilsSetupError(
+                            "{} is cythonized with conflicting options: "
+                            "{} and {}".format(src, cy_jobs[path],
+                                               cy_kwargs))
                 else:
-                    # Copy or render
-                    _sources.append(_copy_or_render_source(
-                        ext, src, '.',
-                        self.render_callback, skip_copy=True))
-            ext.sources = _sources
+                    renders.append((ext, src))
+
+        # Copy or render
+        if njobs > 1 and len(renders) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=njobs) as executor:
+                rendered = list(executor.map(
+                    lambda job: _copy_or_render_source(
+                        job[0], job[1], '.', self.render_callback,
+                        skip_copy=True), renders))
+        else:
+            rendered = [_copy_or_render_source(
+                ext, src, '.', self.render_callback, skip_copy=True)
+                for ext, src in renders]
+        rendered = dict(zip(renders, rendered))
+
+        if njobs > 1 and len(cy_jobs) > 1:
+            import Cython.Compiler.Main  # noqa, imported once (before fork)
+        cythonized = dict(zip(cy_jobs, _process_map(
+            _sdist_cythonize, list(cy_jobs.items()), njobs)))
+        for ext in self.distribution.ext_modules:
+            ext.sources = [
+                cythonized[os.path.normpath(src)] if src.endswith('.pyx')
+                else rendered[ext, src] for src in ext.sources]
         sdist.sdist.run(self)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+"""
+Builds of python extensions for several x86-64 ISA levels.
+
+The same sources are compiled once per ISA level (``-march=x86-64-v3``
+etc.) into sibling subdirectories of the build directory (named after the
+level, so that a build directory can be shared by a heterogeneous
+cluster). A variant is rebuilt when its sources, build options or
+compilers change (see `isa_build_key`). At import the variant for the most capable level supported by
+the running CPU is selected (see `import_best_isa`).
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import warnings
+
+from .compilation import (
+    compile_sources, link_py_so, any_fort, any_cplus, sharedext,
+    toolchain_identity
+)
+from .cpu import supported_isa_levels, x86_64_isa_levels, is_x86_64
+from .util import (
+    CompilationError, FileNotFoundError, MetaReaderWriter, get_abspath,
+    import_module_from_file, make_dirs, md5_of_file, md5_of_string
+)
+
+
+# -march= is understood by GCC >= 11 and Clang >= 12 for these levels.
+isa_flags = dict((level, ('-march=' + level,)) for level in x86_64_isa_levels)
+
+
+_isa_rw = MetaReaderWriter('.metadata_multi_isa')
+
+
+def isa_build_dir(build_dir, level):
+    """ Returns the subdirectory of build_dir for an ISA level. """
+    return os.path.join(build_dir, 'isa_' + level)
+
+
+def isa_build_key(srcs, extname, level, compile_kwargs, link_kwargs):
+    """
+    Computes a hex digest identifying the variant of an extension for an
+    ISA level: the sources, build options and compilers (see
+    `toolchain_identity`).
+
+    Parameters
+    ----------
+    srcs: iterable of path strings
+    extname: string
+    level: string
+        key of ``isa_flags``
+    compile_kwargs: dict
+    link_kwargs: dict
+        keyword arguments affecting the build (``logger`` is ignored)
+    """
+    md = md5_of_string('{}:{}'.format(extname, level).encode('utf-8'))
+    for src in srcs:
+        md.update(os.path.basename(src).encode('utf-8'))
+        md.update(md5_of_file(src).digest())
+    for d in (compile_kwargs, link_kwargs):
+        items = sorted((k, v) for k, v in d.items() if k != 'logger')
+        md.update(repr(items).encode('utf-8'))
+    md.update(toolchain_identity(compile_kwargs.get(
+        'preferred_vendor', None)).encode('utf-8'))
+    return md.hexdigest()
+
+
+def _is_up_to_date(level_dir, so_path, key):
+    if not os.path.exists(so_path):
+        return False
+    try:
+        return _isa_rw.get_from_metadata_file(level_dir, 'key') == key
+    except (FileNotFoundError, KeyError):
+        return False
+
+
+def compile_link_py_ext_multi_isa(
+        srcs, extname=None, build_dir=None, isa_levels=None,
+        compile_kwargs=None, link_kwargs=None, **kwargs):
+    """
+    Compiles and links `srcs` into one extension per ISA level.
+
+    Levels for which the compiler fails (e.g. too old to know about
+    ``-march=x86-64-v4``) are skipped with a warning. A variant is only
+    rebuilt when its key (see `isa_build_key`) has changed.
+
+    Parameters
+    ----------
+    srcs: iterable of path strings
+        paths to sources
+    extname: string
+        name of extension (default: None)
+        (taken from the last file in `srcs` - without extension)
+    build_dir: path string
+        variants are built in ``build_dir/isa_<level>`` (default: '.')
+    isa_levels: iterable of strings
+        keys of ``isa_flags``, default: all x86-64 levels (on x86-64).
+    compile_kwargs: dict
+        keyword arguments passed to compile_sources
+    link_kwargs: dict
+        keyword arguments passed to link_py_so
+    **kwargs:
+        additional keyword arguments overwrites to both compile_kwargs
+        and link_kwargs
+
+    Returns
+    -------
+    dict mapping ISA level to the absolute path of its shared object
+    """
+    build_dir = get_abspath(build_dir or '.')
+    srcs = [get_abspath(src) for src in srcs]
+    if extname is None:
+        extname = os.path.splitext(os.path.basename(srcs[-1]))[0]
+    if isa_levels is None:
+        isa_levels = list(x86_64_isa_levels) if is_x86_64() else []
+
+    compile_kwargs = dict(compile_kwargs or {})
+    compile_kwargs.update(kwargs)
+    link_kwargs = dict(link_kwargs or {})
+    link_kwargs.update(kwargs)
+
+    so_files = {}
+    for level in isa_levels:
+        level_dir = isa_build_dir(build_dir, level)
+        so_path = os.path.join(level_dir, extname + sharedext)
+        key = isa_build_key(srcs, extname, level, compile_kwargs,
+                            link_kwargs)
+        if _is_up_to_date(level_dir, so_path, key):
+            so_files[level] = so_path
+            continue
+        if not os.path.isdir(level_dir):
+            make_dirs(level_dir)
+        ckw = dict(compile_kwargs)
+        ckw['flags'] = list(ckw.get('flags', [])) + list(isa_flags[level])
+        lkw = dict(link_kwargs)
+        lkw['flags'] = list(lkw.get('flags', [])) + list(isa_flags[level])
+        try:
+            objs = compile_sources(srcs, destdir=level_dir, cwd=level_dir,
+                                   **ckw)
+            so_files[level] = link_py_so(
+                objs, cwd=level_dir, fort=any_fort(srcs),
+                cplus=any_cplus(srcs), **lkw)
+            _isa_rw.save_to_metadata_file(level_dir, 'key', key)
+        except CompilationError as exc:
+            warnings.warn("Could not build {} for {}: {}".format(
+                extname, level, str(exc).split('\n')[0]))
+    return so_files
+
+
+def best_isa_level(available, supported=None):
+    """
+    Returns the most capable level in `available` which is also in
+    `supported` (default: ``supported_isa_levels()``), or None.
+    """
+    supported = supported_isa_levels() if supported is None else supported
+    for level in reversed(list(x86_64_isa_levels)):
+        if level in available and level in supported:
+            return level
+    return None
+
+
+def import_best_isa(build_dir, extname, isa_levels=None):
+    """
+    Imports the variant of extension `extname` in `build_dir` built for
+    the most capable ISA level supported by the running CPU.
+
+    Parameters
+    ----------
+    build_dir: path string
+        directory previously passed to `compile_link_py_ext_multi_isa`
+    extname: string
+        name of extension
+    isa_levels: iterable of strings
+        restrict the candidate levels (default: None, meaning all)
+
+    Raises
+    ------
+    ImportError if no usable variant exists.
+    """
+    build_dir = get_abspath(build_dir)
+    if isa_levels is None:
+        isa_levels = x86_64_isa_levels
+    available = [level for level in isa_levels
+                 if os.path.exists(os.path.join(
+                     isa_build_dir(build_dir, level), extname + sharedext))]
+    level = best_isa_level(available)
+    if level is None:
+        raise ImportError("No variant of {} usable on this CPU in {}".format(
+            extname, build_dir))
+    mod = import_module_from_file(os.path.join(
+        isa_build_dir(build_dir, level), extname + sharedext))
+    mod.__isa_level__ = level
+    return mod
+
+
+def compile_link_import_py_ext_multi_isa(srcs, extname=None, build_dir=None,
+                                         isa_levels=None, **kwargs):
+    """
+    Convenience function: `compile_link_py_ext_multi_isa` followed by
+    `import_best_isa`. On CPUs which are not x86-64 a single variant
+    without ISA flags is built and imported (via
+    `compile_link_import_py_ext`).
+
+    Parameters
+    ----------
+    srcs: iterable of path strings
+    extname: string
+    build_dir: path string
+    isa_levels: iterable of strings
+    **kwargs:
+        passed onto `compile_link_py_ext_multi_isa`
+
+    Returns
+    -------
+    the imported module (with the attribute ``__isa_level__`` set)
+    """
+    if not is_x86_64() and isa_levels is None:
+        from .compilation import compile_link_import_py_ext
+        return compile_link_import_py_ext(srcs, extname=extname,
+                                          build_dir=build_dir, **kwargs)
+    build_dir = get_abspath(build_dir or '.')
+    if extname is None:
+        extname = os.path.splitext(os.path.basename(srcs[-1]))[0]
+    so_files = compile_link_py_ext_multi_isa(
+        srcs, extname=extname, build_dir=build_dir, isa_levels=isa_levels,
+        **kwargs)
+    return import_best_isa(build_dir, extname, isa_levels=list(so_files))
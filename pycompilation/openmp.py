@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+
+"""
+Control of the OpenMP runtime of extensions built with the 'openmp'
+option, and measurement of their thread scaling.
+
+The number of threads, the schedule of ``schedule(runtime)`` loops, the
+thread binding and the places are read from the environment when the
+OpenMP runtime (libgomp, libiomp5 or libomp) is initialized; the number
+of threads and the schedule can also be changed at runtime through
+``omp_set_*`` (called via ctypes here)::
+
+    mod = import_openmp_module('kernels.so', num_threads=4,
+                               proc_bind='close', schedule='dynamic,16')
+
+Extensions loaded in one process share one runtime, the wrapper returned
+by `import_openmp_module` applies the thread count (and schedule) of
+its module around each call, see `split_cores` for dividing cores
+between modules. Note that the runtime settings apply to parallel
+regions started from the calling thread.
+
+`thread_sweep` times a kernel for increasing thread counts::
+
+    print(format_sweep(thread_sweep(mod.kernel, (x,))))
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import functools
+import os
+import re
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from timeit import default_timer
+
+from .util import import_module_from_file
+
+# Keyword arguments mapped to the environment variables of the runtime
+environ_keys = OrderedDict([
+    ('num_threads', 'OMP_NUM_THREADS'),
+    ('schedule', 'OMP_SCHEDULE'),
+    ('proc_bind', 'OMP_PROC_BIND'),
+    ('places', 'OMP_PLACES'),
+])
+
+# omp_sched_t
+schedule_kinds = {'static': 1, 'dynamic': 2, 'guided': 3, 'auto': 4}
+
+runtime_names = ('gomp', 'iomp5', 'omp')  # GNU, Intel, LLVM
+
+_runtime_re = re.compile(r'/lib(?:gomp|iomp5|omp)\.(?:so[.\d]*|dylib)$')
+
+SweepResult = namedtuple('SweepResult', 'threads time speedup efficiency')
+
+
+def loaded_runtimes():
+    """
+    Returns ctypes handles of the OpenMP runtimes loaded in the process.
+    """
+    import ctypes
+    paths = []
+    if os.path.exists('/proc/self/maps'):
+        with open('/proc/self/maps', 'rt') as ifh:
+            for line in ifh:
+                path = line.split()[-1]
+                if _runtime_re.search(path) and path not in paths:
+                    paths.append(path)
+    elif hasattr(os, 'RTLD_NOLOAD'):
+        import ctypes.util
+        paths = [p for p in map(ctypes.util.find_library, runtime_names) if p]
+    handles = []
+    for path in paths:
+        try:
+            handles.append(ctypes.CDLL(path, mode=ctypes.DEFAULT_MODE | getattr(
+                os, 'RTLD_NOLOAD', 0)))
+        except OSError:
+            pass
+    return handles
+
+
+def parse_schedule(schedule):
+    """ 'dynamic,16' -> (2, 16) (kind of omp_sched_t and chunk size) """
+    kind, _, chunk = schedule.partition(',')
+    kind = kind.strip().lower()
+    if kind.startswith('monotonic:') or kind.startswith('nonmonotonic:'):
+        kind = kind.split(':', 1)[1]
+    if kind not in schedule_kinds:
+        raise ValueError("Unknown OpenMP schedule: {}".format(schedule))
+    return schedule_kinds[kind], int(chunk) if chunk.strip() else 0
+
+
+def get_schedule(lib):
+    """ (kind, chunk size) from omp_get_schedule of a runtime handle """
+    import ctypes
+    kind, chunk = ctypes.c_int(), ctypes.c_int()
+    lib.omp_get_schedule(ctypes.byref(kind), ctypes.byref(chunk))
+    return kind.value, chunk.value
+
+
+def _save_runtimes(runtimes):
+    """ Number of threads and schedule of each runtime """
+    return [(lib.omp_get_max_threads(), get_schedule(lib))
+            for lib in runtimes]
+
+
+def _restore_runtimes(runtimes, saved):
+    for lib, (num_threads, sched) in zip(runtimes, saved):
+        lib.omp_set_num_threads(num_threads)
+        lib.omp_set_schedule(*sched)
+
+
+def get_num_threads():
+    """ omp_get_max_threads() of the first loaded runtime (or None) """
+    for lib in loaded_runtimes():
+        return lib.omp_get_max_threads()
+    return None
+
+
+def set_openmp(num_threads=None, schedule=None, proc_bind=None,
+               places=None):
+    """
+    Sets OpenMP runtime parameters: in the environment (read when a
+    runtime is initialized, e.g. when first importing an extension) and
+    through ``omp_set_num_threads``/``omp_set_schedule`` for runtimes
+    already loaded (proc_bind and places cannot be changed then).
+
+    Parameters
+    ----------
+    num_threads: int
+    schedule: string
+        e.g. 'static', 'dynamic,16' or 'guided'
+    proc_bind: string
+        e.g. 'close', 'spread', 'master' or 'true'
+    places: string
+        e.g. 'cores' or 'threads'
+    """
+    values = dict(num_threads=num_threads, schedule=schedule,
+                  proc_bind=proc_bind, places=places)
+    sched = None if schedule is None else parse_schedule(schedule)
+    for k, v in values.items():
+        if v is not None:
+            os.environ[environ_keys[k]] = str(v)
+    if num_threads is None and sched is None:
+        return
+    for lib in loaded_runtimes():
+        if num_threads is not None:
+            lib.omp_set_num_threads(int(num_threads))
+        if sched is not None:
+            lib.omp_set_schedule(*sched)
+
+
+@contextmanager
+def openmp_settings(**kwargs):
+    """
+    Context manager applying `set_openmp` (kwargs), the environment,
+    the number of threads and the schedule are restored on exit.
+    """
+    saved = {k: os.environ.get(k) for k in environ_keys.values()}
+    runtimes = loaded_runtimes()
+    previous = _save_runtimes(runtimes)
+    set_openmp(**kwargs)
+    try:
+        yield
+    finally:
+        _restore_runtimes(runtimes, previous)
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+class OpenMPModule(object):
+    """
+    Wraps an imported module: its callables run with the given OpenMP
+    settings (restored after each call), other attributes are passed
+    through. The module itself is available as ``module``.
+    """
+
+    def __init__(self, module, num_threads=None, schedule=None):
+        self.module = module
+        self.num_threads = num_threads
+        self.schedule = schedule
+        self._runtimes = None  # looked up on first call
+
+    def __getattr__(self, name):
+        attr = getattr(self.module, name)
+        if not callable(attr) or (self.num_threads is None and
+                                  self.schedule is None):
+            return attr
+
+        @functools.wraps(attr)
+        def wrapper(*args, **kwargs):
+            if self._runtimes is None:
+                self._runtimes = loaded_runtimes()
+            runtimes = self._runtimes
+            previous = _save_runtimes(runtimes)
+            for lib in runtimes:
+                if self.num_threads is not None:
+                    lib.omp_set_num_threads(int(self.num_threads))
+                if self.schedule is not None:
+                    lib.omp_set_schedule(*parse_schedule(self.schedule))
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                _restore_runtimes(runtimes, previous)
+        return wrapper
+
+    def __repr__(self):
+        return '<{} {!r} num_threads={} schedule={!r}>'.format(
+            type(self).__name__, self.module, self.num_threads,
+            self.schedule)
+
+
+def import_openmp_module(path, num_threads=None, schedule=None,
+                         proc_bind=None, places=None, only_if_newer_than=None):
+    """
+    Imports an extension (built with the 'openmp' option) with the given
+    settings (see `set_openmp`).
+
+    The environment is set before the import (initializing the runtime
+    with e.g. the requested binding), the returned `OpenMPModule` applies
+    num_threads and schedule around every call so that several modules
+    sharing a runtime can use different budgets (see `split_cores`).
+    """
+    set_openmp(num_threads, schedule, proc_bind, places)
+    return OpenMPModule(import_module_from_file(path, only_if_newer_than),
+                        num_threads, schedule)
+
+
+def split_cores(weights, ncpus=None):
+    """
+    Divides ncpus (default: all) between consumers proportionally to
+    weights (dict), every consumer gets at least one thread.
+
+    Examples
+    --------
+    >>> split_cores({'a': 2, 'b': 1, 'c': 1}, ncpus=8) == {
+    ...     'a': 4, 'b': 2, 'c': 2}
+    True
+    """
+    if ncpus is None:
+        ncpus = os.cpu_count() if hasattr(os, 'cpu_count') else None
+    ncpus = ncpus or 1
+    total = sum(weights.values())
+    shares = {k: max(1, int(ncpus * w // total)) for k, w in weights.items()}
+    # hand out cores lost to rounding down, largest weight first
+    for k in sorted(weights, key=lambda k: (-weights[k], str(k))):
+        if sum(shares.values()) >= ncpus:
+            break
+        shares[k] += 1
+    return shares
+
+
+def default_thread_counts(ncpus=None):
+    """ 1, 2, 4, ... up to (and including) ncpus (default: all) """
+    if ncpus is None:
+        ncpus = os.cpu_count() if hasattr(os, 'cpu_count') else None
+    ncpus = ncpus or 1
+    counts, n = [], 1
+    while n < ncpus:
+        counts.append(n)
+        n *= 2
+    return counts + [ncpus]
+
+
+def thread_sweep(func, args=(), threads=None, repeat=3, schedule=None):
+    """
+    Times func(*args) for a range of OpenMP thread counts.
+
+    Parameters
+    ----------
+    func: callable
+        calling an OpenMP parallelized kernel
+    args: tuple
+    threads: iterable of ints
+        default: `default_thread_counts()`
+    repeat: int
+        timings per thread count (the best one is used)
+    schedule: string
+        see `set_openmp`
+
+    Returns
+    -------
+    list of SweepResult instances (threads, time, speedup relative to the
+    first thread count and parallel efficiency: speedup per thread
+    relative to the first thread count).
+    """
+    results = []
+    for n in list(threads or default_thread_counts()):
+        with openmp_settings(num_threads=n, schedule=schedule):
+            best = None
+            for _ in range(repeat):
+                t0 = default_timer()
+                func(*args)
+                elapsed = default_timer() - t0
+                best = elapsed if best is None else min(best, elapsed)
+        if not results:
+            base_threads, base_time = n, best
+        speedup = base_time / best if best > 0 else float('inf')
+        results.append(SweepResult(n, best, speedup,
+                                   speedup * base_threads / n))
+    return results
+
+
+def sweep_kernels(kernels, **kwargs):
+    """
+    Runs `thread_sweep` for several kernels.
+
+    Parameters
+    ----------
+    kernels: dict
+        name mapped to (func, args) pairs
+    **kwargs:
+        keyword arguments passed onto `thread_sweep`
+
+    Returns
+    -------
+    OrderedDict mapping names to lists of SweepResult instances.
+    """
+    return OrderedDict((name, thread_sweep(func, args, **kwargs))
+                       for name, (func, args) in sorted(kernels.items()))
+
+
+def format_sweep(results, name=None):
+    """ Formats (a dict of) lists of SweepResult instances as a table """
+    if not isinstance(results, dict):
+        results = OrderedDict([(name or 'kernel', results)])
+    lines = ['{:<20} {:>7} {:>12} {:>8} {:>10}'.format(
+        'kernel', 'threads', 'time [s]', 'speedup', 'efficiency')]
+    for name, rows in results.items():
+        for r in rows:
+            lines.append('{:<20} {:>7d} {:>12.4g} {:>8.2f} {:>10.2f}'.format(
+                name, r.threads, r.time, r.speedup, r.efficiency))
+    return '\n'.join(lines)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per translation unit choice of optimization level.
+
+Huge generated sources (e.g. Jacobians generated by SymPy) may take
+minutes to compile at -O2 for a modest gain, whereas small hot kernels
+benefit from expensive flags. A policy is passed to `compile_sources`
+(or via the keyword arguments of `compile_link_import_py_ext` and
+friends)::
+
+    policy = OptLevelPolicy(budget=30.0, hot=['kernel_*.c'])
+    mod = compile_link_import_py_ext(srcs, opt_policy=policy)
+
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import fnmatch
+import os
+
+default_levels = ((5000, ['-O2']), (50000, ['-O1']), (None, ['-O0']))
+
+
+def count_statements(path):
+    """ Cheap estimate of the number of statements: counts ';' """
+    with open(path, 'rb') as ifh:
+        return ifh.read().count(b';')
+
+
+class OptLevelPolicy(object):
+    """
+    Chooses optimization flags from the size of a source file and from
+    its compile time measured in an earlier build.
+
+    Parameters
+    ----------
+    levels: sequence of (max_size, flags) pairs
+        ordered by increasing max_size (None: unbounded), the first
+        level for which the size of a source does not exceed max_size is
+        used. default: `default_levels`
+    measure: string
+        'statements' (see `count_statements`) or 'bytes'
+    budget: float
+        seconds, if an earlier compilation with the flags of a level took
+        longer, the next (cheaper) level is used instead (and kept as
+        long as the source is unchanged).
+    hot: iterable of strings
+        glob patterns (matched against the basename) of performance
+        critical sources, they are compiled with `hot_flags` when they
+        fit in the first level.
+    hot_flags: iterable of strings
+        default: ['-O3']
+    """
+
+    def __init__(self, levels=None, measure='statements', budget=None,
+                 hot=(), hot_flags=('-O3',)):
+        if measure not in ('statements', 'bytes'):
+            raise ValueError("Unknown measure: {}".format(measure))
+        self.levels = [(max_size, list(flags)) for max_size, flags in
+                       (levels or default_levels)]
+        self.measure = measure
+        self.budget = budget
+        self.hot = list(hot)
+        self.hot_flags = list(hot_flags)
+
+    def size(self, path):
+        if self.measure == 'bytes':
+            return os.path.getsize(path)
+        return count_statements(path)
+
+    def __call__(self, path, record=None):
+        size = self.size(path)
+        idx = len(self.levels) - 1
+        for i, (max_size, flags) in enumerate(self.levels):
+            if max_size is None or size <= max_size:
+                idx = i
+                break
+        if idx == 0 and any(fnmatch.fnmatch(os.path.basename(path), pattern)
+                            for pattern in self.hot):
+            return list(self.hot_flags)
+        if self.budget is not None and record:
+            prev = [i for i, (_, flags) in enumerate(self.levels)
+                    if flags == record.get('opt_flags')]
+            if prev:
+                if record.get('size') == os.path.getsize(path):
+                    idx = max(idx, prev[0])  # unchanged: keep downgrade
+                if (record.get('wall_time') or 0) > self.budget:
+                    idx = max(idx, min(prev[0] + 1, len(self.levels) - 1))
+        return list(self.levels[idx][1])
+
+    def __repr__(self):  # part of build keys, hence deterministic
+        return '{}(levels={!r}, measure={!r}, budget={!r}, hot={!r}, ' \
+            'hot_flags={!r})'.format(type(self).__name__, self.levels,
+                                     self.measure, self.budget, self.hot,
+                                     self.hot_flags)
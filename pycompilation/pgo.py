@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""
+Profile guided optimization (PGO) of python extension modules.
+
+A PGO build is performed in two steps: first an instrumented variant of
+the extension is built (in an isolated temporary directory) and exercised
+by a user supplied training callable. The profile data written by the
+instrumented module is collected and cached (keyed by a hash of the
+sources and build options) before the extension is rebuilt in the
+production build directory using the profile.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import ctypes
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+
+from .compilation import (
+    compile_sources, link_py_so, any_fort, any_cplus, toolchain_identity
+)
+from .util import (
+    CompilationError, FileNotFoundError, MetaReaderWriter, copy,
+    get_abspath, import_module_from_file, make_dirs, md5_of_file,
+    md5_of_string
+)
+
+
+# Flags used for the instrumented ("generate") and the optimized ("use")
+# builds together with the glob pattern of the written profile data.
+pgo_vendor_flags = {
+    'gnu': {
+        'generate': ('-fprofile-generate',),
+        'use': ('-fprofile-use', '-fprofile-correction'),
+        'profile_glob': '*.gcda',
+    },
+    'intel': {
+        'generate': ('-prof-gen', '-prof-dir=.'),
+        'use': ('-prof-use', '-prof-dir=.'),
+        'profile_glob': '*.dyn',
+    },
+}
+
+
+_pgo_rw = MetaReaderWriter('.metadata_pgo')
+
+
+def pgo_key(srcs, extname, *kwargs_dicts):
+    """
+    Computes a hex digest identifying the sources, build options and the
+    compilers (see `toolchain_identity`).
+
+    Parameters
+    ----------
+    srcs: iterable of path strings
+    extname: string
+    *kwargs_dicts: dicts
+        keyword arguments affecting the build (``logger`` is ignored),
+        a 'preferred_vendor' entry selects the compilers identified.
+    """
+    md = md5_of_string(extname.encode('utf-8'))
+    for src in srcs:
+        md.update(os.path.basename(src).encode('utf-8'))
+        md.update(md5_of_file(src).digest())
+    preferred_vendor = None
+    for d in kwargs_dicts:
+        items = sorted((k, v) for k, v in d.items() if k != 'logger')
+        md.update(repr(items).encode('utf-8'))
+        preferred_vendor = d.get('preferred_vendor', preferred_vendor)
+    md.update(toolchain_identity(preferred_vendor).encode('utf-8'))
+    return md.hexdigest()
+
+
+def profile_digest(key_dir):
+    """ Hex digest of the profile data files in key_dir """
+    md = md5_of_string(b'')
+    for path in sorted(glob.glob(os.path.join(key_dir, '*'))):
+        md.update(os.path.basename(path).encode('utf-8'))
+        md.update(md5_of_file(path).digest())
+    return md.hexdigest()
+
+
+def _run_training(so_path, training):
+    """
+    Imports the instrumented module in a forked child process and runs
+    ``training(mod)``. The child terminates through the C library's
+    ``exit`` so that the profiling runtime gets to write its data while
+    the instrumented module never enters the parent's ``sys.modules``.
+    """
+    pid = os.fork()
+    if pid == 0:  # child
+        status = 0
+        try:
+            training(import_module_from_file(so_path))
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            ctypes.CDLL(None).exit(status)
+    _, status = os.waitpid(pid, 0)
+    if status != 0:
+        raise CompilationError(
+            "PGO training of {} failed (exit status {})".format(
+                so_path, status))
+
+
+def _build(srcs, build_dir, flags, compile_kwargs, link_kwargs):
+    """
+    Copies sources into build_dir and compiles them using paths relative
+    to build_dir (profile data is tied to the source file names).
+    """
+    local_srcs = []
+    for src in srcs:
+        copy(src, build_dir, only_update=True, dest_is_dir=True)
+        local_srcs.append(os.path.basename(src))
+    ckw = dict(compile_kwargs)
+    ckw['flags'] = list(ckw.get('flags', [])) + list(flags)
+    objs = compile_sources(local_srcs, destdir=build_dir, cwd=build_dir,
+                           **ckw)
+    lkw = dict(link_kwargs)
+    lkw['flags'] = list(lkw.get('flags', [])) + list(flags)
+    return link_py_so(objs, cwd=build_dir, fort=any_fort(srcs),
+                      cplus=any_cplus(srcs), **lkw)
+
+
+def compile_link_import_py_ext_pgo(
+        srcs, training, extname=None, build_dir=None, profile_dir=None,
+        vendor=None, compile_kwargs=None, link_kwargs=None, **kwargs):
+    """
+    Profile guided variant of `compile_link_import_py_ext`.
+
+    An instrumented extension is built in a temporary directory, imported
+    in a forked child process and passed to ``training``. The collected
+    profile data is stored under ``profile_dir`` (keyed by a hash of
+    sources and options) and used to build the production extension in
+    ``build_dir``. Later calls with the same sources reuse the cached
+    profile (and the extension if it was built from the same sources,
+    options, compilers and profile data).
+
+    Parameters
+    ----------
+    srcs: iterable of path strings
+        paths to sources
+    training: callable
+        called with the instrumented module as its only argument, should
+        exercise representative code paths.
+    extname: string
+        name of extension (default: None)
+        (taken from the last file in `srcs` - without extension)
+    build_dir: path string
+        production build directory (default: '.')
+    profile_dir: path string
+        directory for cached profile data
+        (default: ``build_dir/.pgo_profiles``)
+    vendor: string
+        compiler vendor, one of the keys in ``pgo_vendor_flags``
+        (default: environment variable COMPILER_VENDOR or 'gnu')
+    compile_kwargs: dict
+        keyword arguments passed to compile_sources
+    link_kwargs: dict
+        keyword arguments passed to link_py_so
+    **kwargs:
+        additional keyword arguments overwrites to both compile_kwargs
+        and link_kwargs
+
+    Returns
+    -------
+    the imported (profile optimized) module
+
+    Examples
+    --------
+    >>> mod = compile_link_import_py_ext_pgo(
+    ...     ['kernel.c', '_kernel.pyx'], lambda m: m.run(1000000),
+    ...     build_dir='build', options=['fast', 'pic'])  # doctest: +SKIP
+
+    """
+    build_dir = get_abspath(build_dir or '.')
+    srcs = [get_abspath(src) for src in srcs]
+    if extname is None:
+        extname = os.path.splitext(os.path.basename(srcs[-1]))[0]
+    vendor = (vendor or os.environ.get('COMPILER_VENDOR', None) or
+              'gnu').lower()
+    if vendor not in pgo_vendor_flags:
+        raise ValueError("PGO not supported for vendor: {}".format(vendor))
+    vendor_flags = pgo_vendor_flags[vendor]
+
+    compile_kwargs = dict(compile_kwargs or {})
+    compile_kwargs.update(kwargs)
+    link_kwargs = dict(link_kwargs or {})
+    link_kwargs.update(kwargs)
+    logger = kwargs.get('logger', None)
+
+    key = pgo_key(srcs, extname, compile_kwargs, link_kwargs,
+                  {'vendor': vendor})
+    profile_dir = get_abspath(profile_dir or os.path.join(
+        build_dir, '.pgo_profiles'))
+    key_dir = os.path.join(profile_dir, key)
+
+    def build_key():
+        return pgo_key(srcs, extname, compile_kwargs, link_kwargs, {
+            'vendor': vendor, 'flags': vendor_flags['use'],
+            'profile': profile_digest(key_dir)})
+
+    if os.path.isdir(key_dir):
+        try:
+            built = _pgo_rw.get_from_metadata_file(build_dir, extname)
+        except (FileNotFoundError, KeyError):
+            built = None
+        if built == build_key():
+            try:
+                return import_module_from_file(
+                    os.path.join(build_dir, extname), srcs)
+            except ImportError:
+                pass
+    else:
+        instr_dir = tempfile.mkdtemp(prefix='pgo_instrumented_')
+        try:
+            instr_so = _build(srcs, instr_dir, vendor_flags['generate'],
+                              compile_kwargs, link_kwargs)
+            if logger:
+                logger.info("Running PGO training on {}".format(instr_so))
+            _run_training(instr_so, training)
+            profiles = glob.glob(os.path.join(
+                instr_dir, vendor_flags['profile_glob']))
+            if not profiles:
+                raise CompilationError(
+                    "PGO training produced no profile data in {}".format(
+                        instr_dir))
+            make_dirs(profile_dir)
+            tmp_key_dir = tempfile.mkdtemp(dir=profile_dir)
+            for path in profiles:
+                shutil.copy(path, tmp_key_dir)
+            try:
+                os.rename(tmp_key_dir, key_dir)
+            except OSError:  # another process stored the same profile
+                shutil.rmtree(tmp_key_dir, ignore_errors=True)
+        finally:
+            shutil.rmtree(instr_dir, ignore_errors=True)
+
+    make_dirs(build_dir)
+    for path in glob.glob(os.path.join(key_dir, '*')):
+        shutil.copy(path, build_dir)
+    built = build_key()
+    compile_kwargs['only_update'] = False
+    link_kwargs['only_update'] = False
+    so = _build(srcs, build_dir, vendor_flags['use'],
+                compile_kwargs, link_kwargs)
+    _pgo_rw.save_to_metadata_file(build_dir, extname, built)
+    return import_module_from_file(so)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+Probing of compiler capabilities.
+
+Tiny snippets are compiled (and linked) to find out whether a compiler
+accepts a flag, a ``-std=`` value, OpenMP or LTO. Results are persisted
+(keyed by a hash of the compiler binary) in ``get_cache_dir('probe')``
+so each probe is only run once per compiler.
+
+`CompilerRunner` uses `filter_flags` to drop (or substitute) unsupported
+flags up front when constructed with ``probe=True`` (or when the
+environment variable PYCOMPILATION_PROBE_FLAGS is set to '1')::
+
+    >>> from pycompilation.probe import flag_supported
+    >>> flag_supported('gcc', '-fwrapv')  # doctest: +SKIP
+    True
+
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from .util import (
+    MetaReaderWriter, FileNotFoundError, find_binary_of_command,
+    get_cache_dir, md5_of_file, md5_of_string
+)
+
+snippets = {
+    'c': ('probe.c', 'int main(void) { return 0; }\n'),
+    'c++': ('probe.cpp', 'int main() { return 0; }\n'),
+    'fortran': ('probe.f90', 'program probe\nend program probe\n'),
+}
+
+openmp_snippets = {
+    'c': '#include <omp.h>\n'
+         'int main(void) { return omp_get_max_threads() > 0 ? 0 : 1; }\n',
+    'c++': '#include <omp.h>\n'
+           'int main() { return omp_get_max_threads() > 0 ? 0 : 1; }\n',
+    'fortran': 'program probe\nuse omp_lib\ninteger :: n\n'
+               'n = omp_get_max_threads()\nend program probe\n',
+}
+
+shared_snippet = 'int pycompilation_probe(void) { return 0; }\n'
+
+# Equivalent spellings tried when a flag is not supported
+flag_substitutes = {
+    '-std=c++0x': ['-std=c++11'],
+    '-std=c++11': ['-std=c++0x'],
+    '-std=c++14': ['-std=c++1y'],
+    '-std=c++17': ['-std=c++1z'],
+    '-std=c++20': ['-std=c++2a'],
+    '-std=c17': ['-std=c18'],
+    '-fopenmp': ['-qopenmp', '-openmp'],
+    '-openmp': ['-qopenmp', '-fopenmp'],
+}
+
+# Flags never probed, and flags taking the next argument
+_unprobed = ('-c', '-o', '-shared')
+_unprobed_prefixes = ('-I', '-D', '-U', '-L', '-l', '-Wl,')
+_flags_with_argument = ('-o', '-x', '-iquote', '-isystem', '-include',
+                        '-MF', '-Xlinker', '-framework')
+
+# Diagnostics of accepted-but-ignored flags (not affected by -Werror)
+_ignored_re = re.compile(r'not for|unrecognized|unknown|ignor', re.IGNORECASE)
+
+_probe_rw = MetaReaderWriter('.metadata_probe')
+_binary_hashes = {}
+_results = {}
+
+
+def binary_hash(binary):
+    """ md5 hex digest of (the resolved path of) a compiler binary """
+    if not os.path.isabs(binary):
+        binary = find_binary_of_command([binary])[1]
+    path = os.path.realpath(binary)
+    st = os.stat(path)
+    memo_key = (path, st.st_size, st.st_mtime)
+    if memo_key not in _binary_hashes:
+        _binary_hashes[memo_key] = md5_of_file(path).hexdigest()
+    return _binary_hashes[memo_key]
+
+
+def probe(binary, flags, language='c', code=None, shared=False,
+          libraries=()):
+    """
+    Returns whether binary compiles and links a snippet with flags
+    (warnings, including those about ignored flags, count as errors).
+
+    Parameters
+    ----------
+    binary: path string
+        compiler (driver)
+    flags: iterable of strings
+    language: string
+        'c', 'c++' or 'fortran'
+    code: string
+        snippet, default: an empty program (see `snippets`)
+    shared: bool
+        link a shared object (code should then define no main).
+    libraries: iterable of strings
+        libraries to link (e.g. 'm'), passed after the snippet.
+    """
+    fname, default_code = snippets[language]
+    code = code or default_code
+    flags = list(flags)
+    link_flags = ['-l' + lib for lib in libraries]
+    try:
+        key = '{}:{}:{}:{}:{}'.format(
+            binary_hash(binary), language, ' '.join(flags + link_flags),
+            shared, md5_of_string(code.encode('utf-8')).hexdigest())
+    except (OSError, RuntimeError):
+        return False  # compiler not found
+    if key in _results:
+        return _results[key]
+    cache_dir = get_cache_dir('probe')
+    try:
+        _results[key] = _probe_rw.get_from_metadata_file(cache_dir, key)
+        return _results[key]
+    except (FileNotFoundError, KeyError):
+        pass
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tmpdir, fname), 'wt') as ofh:
+            ofh.write(code)
+        cmd = [binary] + flags + ['-Werror'] + (
+            ['-fPIC', '-shared'] if shared else []) + [
+                fname, '-o', 'probe.out'] + link_flags
+        p = subprocess.Popen(cmd, cwd=tmpdir, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+        out = p.communicate()[0].decode('utf-8', 'replace')
+        result = p.returncode == 0 and not _ignored_re.search(out)
+    except OSError:
+        result = False
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    _results[key] = result
+    _probe_rw.save_to_metadata_file(cache_dir, key, result)
+    return result
+
+
+def flag_supported(binary, flag, language='c'):
+    return probe(binary, [flag], language)
+
+
+def supported_standards(binary, standards, language='c',
+                        formater='-std={}'.format):
+    """ Returns the subset of standards (e.g. 'c++17') accepted. """
+    return [std for std in standards if std is not None and
+            flag_supported(binary, formater(std), language)]
+
+
+def openmp_supported(binary, language='c', flag='-fopenmp'):
+    return probe(binary, [flag], language, code=openmp_snippets[language])
+
+
+def lto_supported(binary, language='c', flag='-flto'):
+    return probe(binary, [flag], language)
+
+
+def filter_flags(binary, flags, language='c', logger=None):
+    """
+    Returns flags where unsupported ones are substituted (see
+    `flag_substitutes`) or dropped.
+    """
+    result, is_argument = [], False
+    for flag in flags:
+        if is_argument or not flag.startswith('-') or flag in _unprobed or \
+           flag in _flags_with_argument or \
+           flag.startswith(_unprobed_prefixes):
+            is_argument = not is_argument and flag in _flags_with_argument
+            result.append(flag)
+            continue
+        for candidate in [flag] + flag_substitutes.get(flag, []):
+            if flag_supported(binary, candidate, language):
+                result.append(candidate)
+                if candidate != flag and logger:
+                    logger.info("Substituted {} with {}".format(
+                        flag, candidate))
+                break
+        else:
+            if logger:
+                logger.info("Dropped unsupported flag {} ({})".format(
+                    flag, binary))
+    return result
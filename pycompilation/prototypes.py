@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""
+Parsing of (simple) C function prototypes.
+
+Only the subset of C needed to describe numerical kernels is supported:
+scalar arguments of arithmetic types and pointers (or unsized arrays) to
+them, optionally qualified by ``const`` and ``restrict``.
+
+>>> proto = parse_prototype('double dot(int n, const double * restrict x, double y[])')
+>>> proto.name, proto.restype
+('dot', 'double')
+>>> [(a.name, a.ctype, a.pointer, a.const) for a in proto.args]
+[('n', 'int', False, False), ('x', 'double', True, True), ('y', 'double', True, False)]
+
+Helpers shared by the generators of Cython wrappers (`pycompilation.batch`,
+`pycompilation.ufuncs`, `pycompilation.chunked` and
+`pycompilation.wrappers`) are found here as well.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import keyword
+import os
+import re
+from collections import namedtuple
+
+Argument = namedtuple('Argument', 'name ctype pointer const')
+Prototype = namedtuple('Prototype', 'name restype args')
+
+# Arithmetic C types mapped to the NumPy dtype character codes
+ctype_dtype_char = {
+    'char': 'b',
+    'signed char': 'b',
+    'unsigned char': 'B',
+    'short': 'h',
+    'unsigned short': 'H',
+    'int': 'i',
+    'unsigned int': 'I',
+    'unsigned': 'I',
+    'long': 'l',
+    'unsigned long': 'L',
+    'long long': 'q',
+    'unsigned long long': 'Q',
+    'float': 'f',
+    'double': 'd',
+    'long double': 'g',
+    'int8_t': 'b',
+    'uint8_t': 'B',
+    'int16_t': 'h',
+    'uint16_t': 'H',
+    'int32_t': 'i',
+    'uint32_t': 'I',
+    'int64_t': 'q',
+    'uint64_t': 'Q',
+    'size_t': 'L',
+    'ptrdiff_t': 'l',
+}
+
+# Fixed width types cimported from libc.stdint by generated Cython code
+stdint_types = ('int8_t', 'uint8_t', 'int16_t', 'uint16_t', 'int32_t',
+                'uint32_t', 'int64_t', 'uint64_t')
+
+_type_words = set(' '.join(ctype_dtype_char).split()) | set(['void'])
+_qualifiers = set(['const', 'restrict', '__restrict', '__restrict__',
+                   'register', 'volatile'])
+_ident_re = re.compile(r'^[A-Za-z_]\w*$')
+_proto_re = re.compile(r'^\s*(?P<head>[^(]+?)\s*\((?P<args>[^)]*)\)\s*;?\s*$',
+                       re.DOTALL)
+
+
+def _parse_decl(decl, allow_unnamed=True):
+    """ Returns (name, base ctype, pointer, const) of a declaration. """
+    const = 'const' in re.findall(r'\w+', decl)
+    array = decl.rstrip().endswith(']')
+    if array:
+        decl = decl[:decl.rindex('[')]
+    nstars = decl.count('*') + (1 if array else 0)
+    if nstars > 1:
+        raise ValueError("Only single level pointers supported: " + decl)
+    words = [w for w in decl.replace('*', ' ').split() if w not in _qualifiers]
+    name = None
+    if len(words) > 1 and words[-1] not in _type_words:
+        name = words.pop()
+    elif not allow_unnamed:
+        raise ValueError("Missing name in: " + decl)
+    ctype = ' '.join(words)
+    if ctype not in ctype_dtype_char and ctype != 'void':
+        raise ValueError("Unsupported type '{}' in: {}".format(ctype, decl))
+    return name, ctype, nstars == 1, const
+
+
+def parse_prototype(proto, name=None):
+    """
+    Parses a C function prototype.
+
+    Parameters
+    ----------
+    proto: string
+        e.g. 'double f(int n, const double * x)', argument names and the
+        function name are optional: 'double (int, const double *)'
+    name: string
+        name of the function (overrides/complements the name in `proto`).
+
+    Returns
+    -------
+    Prototype instance (fields: name, restype, args) where args is a list
+    of Argument instances (fields: name, ctype, pointer, const). Unnamed
+    arguments are given the names ``arg0``, ``arg1``, ...
+    """
+    m = _proto_re.match(proto)
+    if m is None:
+        raise ValueError("Could not parse prototype: " + proto)
+    head = m.group('head')
+    parsed_name, restype, ptr, _ = _parse_decl(head)
+    if ptr:
+        raise ValueError("Pointer return types not supported: " + proto)
+    if parsed_name is None and not _ident_re.match(name or ''):
+        raise ValueError("No function name given for: " + proto)
+    args = []
+    args_str = m.group('args').strip()
+    if args_str and args_str != 'void':
+        for idx, decl in enumerate(args_str.split(',')):
+            arg_name, ctype, pointer, const = _parse_decl(decl)
+            if ctype == 'void':
+                raise ValueError("void argument in: " + proto)
+            args.append(Argument(arg_name or 'arg%d' % idx, ctype,
+                                 pointer, const))
+    return Prototype(name or parsed_name, restype, args)
+
+
+def format_prototype(proto, name=None):
+    """ Formats a Prototype instance as a C declaration (without ';'). """
+    return '{} {}({})'.format(proto.restype, name or proto.name, ', '.join(
+        '{}{}{}{}'.format('const ' if a.const else '', a.ctype,
+                          ' *' if a.pointer else ' ', a.name)
+        for a in proto.args) or 'void')
+
+
+def py_name(name):
+    """
+    Returns the Python/Cython identifier of a C argument name (Python
+    keywords get a trailing underscore).
+
+    Examples
+    --------
+    >>> py_name('lambda')
+    'lambda_'
+    """
+    return name + '_' if keyword.iskeyword(name) else name
+
+
+def cimport_lines(ctypes):
+    """
+    Returns Cython cimport statements of the (fixed width or stddef)
+    types among ctypes.
+
+    Examples
+    --------
+    >>> cimport_lines(['double', 'uint8_t', 'size_t', 'int64_t'])
+    ['from libc.stdint cimport uint8_t, int64_t', 'from libc.stddef cimport size_t']
+    """
+    ctypes = set(ctypes)
+    lines = []
+    stdint = [t for t in stdint_types if t in ctypes]
+    if stdint:
+        lines.append('from libc.stdint cimport ' + ', '.join(stdint))
+    stddef = [t for t in ('ptrdiff_t', 'size_t') if t in ctypes]
+    if stddef:
+        lines.append('from libc.stddef cimport ' + ', '.join(stddef))
+    return lines
+
+
+def cython_target(codes, extname=None, suffix='_generated', renamed=()):
+    """
+    Decides where generated Cython code goes: appended to the last code
+    string if it is a Cython source (and extname is None or its stem),
+    otherwise into a new source ``extname + '.pyx'``.
+
+    Parameters
+    ----------
+    codes: list of name/source pair tuples
+    extname: string
+        name of the extension module, default: the stem of the last code
+        string (with suffix appended if another code string has that
+        stem).
+    suffix: string
+    renamed: iterable of strings
+        extensions of code strings which are renamed by the caller (and
+        hence do not clash with extname)
+
+    Returns
+    -------
+    (append, extname)
+    """
+    stem = os.path.splitext(os.path.basename(codes[-1][0]))[0]
+    if codes[-1][0].endswith('.pyx') and extname in (None, stem):
+        return True, stem
+    if extname is None:
+        extname = stem
+        if any(os.path.splitext(os.path.basename(n))[0] == stem and
+               os.path.splitext(n)[1] not in renamed for n, _ in codes):
+            extname = stem + suffix
+    return False, extname
+
+
+def add_cython_code(codes, code_, extname=None, suffix='_generated'):
+    """
+    Adds generated Cython code to code strings (see `cython_target`).
+
+    Returns
+    -------
+    (codes, extname)
+    """
+    codes = list(codes)
+    append, extname = cython_target(codes, extname, suffix)
+    if append:
+        codes[-1] = (codes[-1][0], codes[-1][1] + '\n' + code_)
+    else:
+        codes.append((extname + '.pyx', code_))
+    return codes, extname
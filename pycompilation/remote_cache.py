@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+
+"""
+Remote (HTTP) artifact cache.
+
+Artifacts (object files, Cython generated sources and extension modules)
+are stored content addressed under ``<url>/<namespace>/<key>``:
+
+- ``GET`` returns the (optionally zlib compressed) artifact, with the
+  headers ``X-Content-SHA256`` (digest of the uncompressed artifact) and
+  ``X-Pycompilation-Compression`` ('zlib' or 'none'). 404 means a miss.
+- ``PUT`` stores an artifact, the same headers are required and the
+  digest is verified by the server.
+
+The client (`RemoteCache`) verifies downloads, uploads asynchronously
+through a bounded queue (writes never block a build, excess uploads are
+dropped) and disables itself for a while after repeated errors, so that
+misses and failures always fall through to local compilation.
+
+The remote tier is enabled by setting the environment variable
+PYCOMPILATION_REMOTE_CACHE to the URL of a server (or programmatically
+via `set_remote_cache`). `RemoteCacheServer` is a small reference
+implementation, e.g.::
+
+    $ python -m pycompilation serve-cache --directory /srv/cache --port 8765
+
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import atexit
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+_name_re = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9_.-]*$')
+
+
+def sha256_hexdigest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class RemoteCache(object):
+    """
+    Client of a remote artifact cache.
+
+    Parameters
+    ----------
+    url: string
+        e.g. 'http://localhost:8765'
+    compress: bool
+        zlib compress uploads. default: True
+    timeout: float
+        seconds per request.
+    max_queue: int
+        maximum number of pending uploads (further uploads are dropped).
+    max_errors: int
+        number of consecutive errors after which the cache is disabled
+        for `backoff` seconds.
+    backoff: float
+        seconds
+    logger: logging.Logger
+        info level used.
+    """
+
+    def __init__(self, url, compress=True, timeout=10.0, max_queue=64,
+                 max_errors=3, backoff=60.0, logger=None):
+        self.url = url.rstrip('/')
+        self.compress = compress
+        self.timeout = timeout
+        self.max_errors = max_errors
+        self.backoff = backoff
+        self.logger = logger
+        self._errors = 0
+        self._disabled_until = 0.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def _log(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def _url(self, namespace, key):
+        if not (_name_re.match(namespace) and _name_re.match(key)):
+            raise ValueError("Invalid namespace/key: {}/{}".format(
+                namespace, key))
+        return '{}/{}/{}'.format(self.url, namespace, key)
+
+    @property
+    def available(self):
+        return time.time() >= self._disabled_until
+
+    def _failed(self, exc):
+        with self._lock:
+            self._errors += 1
+            if self._errors >= self.max_errors:
+                self._disabled_until = time.time() + self.backoff
+                self._errors = 0
+                self._log("Remote cache {} disabled for {} s after: {}".format(
+                    self.url, self.backoff, exc))
+
+    def _succeeded(self):
+        with self._lock:
+            self._errors = 0
+
+    def get(self, namespace, key):
+        """ Returns the artifact (bytes) or None (miss or error). """
+        if not self.available:
+            return None
+        try:
+            from urllib.request import urlopen
+            from urllib.error import HTTPError
+        except ImportError:  # Python 2
+            from urllib2 import urlopen, HTTPError
+        try:
+            resp = urlopen(self._url(namespace, key), timeout=self.timeout)
+            try:
+                body = resp.read()
+                digest = resp.headers.get('X-Content-SHA256')
+                compression = resp.headers.get(
+                    'X-Pycompilation-Compression', 'none')
+            finally:
+                resp.close()
+            data = zlib.decompress(body) if compression == 'zlib' else body
+        except HTTPError as exc:
+            if exc.code == 404:
+                self._succeeded()
+            else:
+                self._failed(exc)
+            return None
+        except Exception as exc:  # network errors, corrupt data, ...
+            self._failed(exc)
+            return None
+        if digest != sha256_hexdigest(data):
+            self._log("Integrity check failed for {}/{}".format(
+                namespace, key))
+            return None
+        self._succeeded()
+        return data
+
+    def _upload(self, namespace, key, data):
+        try:
+            from urllib.request import Request, urlopen
+        except ImportError:  # Python 2
+            from urllib2 import Request, urlopen
+        body = zlib.compress(data) if self.compress else data
+        req = Request(self._url(namespace, key), data=body, headers={
+            'X-Content-SHA256': sha256_hexdigest(data),
+            'X-Pycompilation-Compression': 'zlib' if self.compress
+            else 'none',
+            'Content-Type': 'application/octet-stream',
+        })
+        req.get_method = lambda: 'PUT'
+        urlopen(req, timeout=self.timeout).close()
+
+    def _work(self):
+        while True:
+            namespace, key, data = self._queue.get()
+            try:
+                if self.available:
+                    self._upload(namespace, key, data)
+                    self._succeeded()
+            except Exception as exc:
+                self._failed(exc)
+            finally:
+                self._queue.task_done()
+
+    def put(self, namespace, key, data):
+        """
+        Schedules an upload (never blocks), returns False if the upload
+        was dropped (full queue or disabled cache).
+        """
+        if not self.available:
+            return False
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work)
+                self._worker.daemon = True
+                self._worker.start()
+        try:
+            self._queue.put_nowait((namespace, key, data))
+        except queue.Full:
+            self._log("Upload queue full, dropping {}/{}".format(
+                namespace, key))
+            return False
+        return True
+
+    def flush(self, timeout=None):
+        """ Waits (at most timeout seconds) for pending uploads. """
+        deadline = None if timeout is None else time.time() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def get_file(self, namespace, key, dest):
+        """ Writes the artifact to dest, returns True on hit. """
+        data = self.get(namespace, key)
+        if data is None:
+            return False
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest)))
+        with os.fdopen(fd, 'wb') as ofh:
+            ofh.write(data)
+        os.rename(tmp, dest)
+        return True
+
+    def put_file(self, namespace, key, path):
+        with open(path, 'rb') as ifh:
+            return self.put(namespace, key, ifh.read())
+
+
+_remote_cache = {}
+
+
+def get_remote_cache():
+    """
+    Returns the active RemoteCache instance or None. Unless set by
+    `set_remote_cache`, it is configured from the environment variables
+    PYCOMPILATION_REMOTE_CACHE (url) and
+    PYCOMPILATION_REMOTE_CACHE_COMPRESS ('0' disables compression).
+    """
+    if 'instance' not in _remote_cache:
+        url = os.environ.get('PYCOMPILATION_REMOTE_CACHE', None)
+        set_remote_cache(RemoteCache(url, compress=os.environ.get(
+            'PYCOMPILATION_REMOTE_CACHE_COMPRESS', '1') != '0')
+            if url else None)
+    return _remote_cache['instance']
+
+
+def set_remote_cache(instance):
+    """ Sets (or unsets with None) the active RemoteCache instance. """
+    _remote_cache['instance'] = instance
+
+
+_compiler_versions = {}
+
+
+def _compiler_version(binary):
+    if binary not in _compiler_versions:
+        try:
+            out = subprocess.check_output([binary, '--version'],
+                                          stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            out = b''
+        _compiler_versions[binary] = out
+    return _compiler_versions[binary]
+
+
+def object_key(runner):
+    """
+    Hex digest identifying the object file produced by a compiler runner
+    (C/C++): the preprocessed source, the flags and the compiler version
+    (the key is hence independent of paths, but note that debug info
+    may contain the build directory). Returns None if preprocessing fails.
+    As this runs the preprocessor, `src2obj` only calls it when a remote
+    cache is available.
+    """
+    cmd = ([runner.compiler_binary] +
+           [f for f in runner.flags if f != '-c'] +
+           ['-U'+x for x in runner.undef] +
+           ['-D'+x for x in runner.define] +
+           ['-I'+x for x in runner.include_dirs] +
+           ['-E', '-P'] + runner.sources)
+    try:
+        p = subprocess.Popen(cmd, cwd=runner.cwd, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        out, _ = p.communicate()
+    except OSError:
+        return None
+    if p.returncode != 0:
+        return None
+    md = hashlib.sha256(_compiler_version(runner.compiler_binary))
+    md.update(repr(runner.flags + ['-U'+x for x in runner.undef] +
+                   ['-D'+x for x in runner.define]).encode('utf-8'))
+    md.update(out)
+    return md.hexdigest()
+
+
+_cython_deps_re = re.compile(
+    r'^[ \t]*(?:from[ \t]+([\w.]+)[ \t]+cimport|cimport[ \t]+([\w.]+)|'
+    r'include[ \t]+[\'"]([^\'"]+)[\'"])', re.MULTILINE)
+
+
+def cython_dependencies(path, include_path=()):
+    """
+    Returns the paths of the .pxd/.pxi files (found next to path or in
+    include_path) which are cimported/included by the Cython source at
+    path (recursively), a companion .pxd file comes first.
+    """
+    deps, pending = [], [path]
+    companion = os.path.splitext(path)[0] + '.pxd'
+    if os.path.exists(companion):
+        deps.append(companion)
+        pending.append(companion)
+    while pending:
+        current = pending.pop()
+        with open(current, 'rt') as ifh:
+            text = ifh.read()
+        dirs = [os.path.dirname(current)] + list(include_path)
+        for m in _cython_deps_re.finditer(text):
+            if m.group(3):
+                candidates = [m.group(3)]
+            else:
+                module = (m.group(1) or m.group(2)).replace('.', os.sep)
+                candidates = [module + '.pxd',
+                              os.path.join(module, '__init__.pxd')]
+            for d in dirs:
+                found = [os.path.join(d, c) for c in candidates
+                         if os.path.isfile(os.path.join(d, c))]
+                if found:
+                    if found[0] not in deps:
+                        deps.append(found[0])
+                        pending.append(found[0])
+                    break
+    return deps
+
+
+def cython_key(src, cwd, full_module_name, cy_kwargs):
+    """
+    Hex digest identifying the C/C++ file generated by Cython from src:
+    its path (embedded by Cython in its output), its content and that of
+    the .pxd/.pxi files it depends on (see `cython_dependencies`), the
+    options and the Cython version.
+    """
+    from Cython import __version__ as cython_version
+    md = hashlib.sha256(repr([
+        cython_version, src, full_module_name,
+        sorted((k, v) for k, v in cy_kwargs.items() if k != 'output_dir')
+    ]).encode('utf-8'))
+    cwd = cwd or '.'
+    path = src if os.path.isabs(src) else os.path.join(cwd, src)
+    include_path = [d if os.path.isabs(d) else os.path.join(cwd, d)
+                    for d in cy_kwargs.get('include_path') or ()]
+    for fname in [path] + cython_dependencies(path, include_path):
+        md.update(os.path.basename(fname).encode('utf-8'))
+        with open(fname, 'rb') as ifh:
+            md.update(ifh.read())
+    return md.hexdigest()
+
+
+@atexit.register
+def _flush_at_exit():
+    instance = _remote_cache.get('instance', None)
+    if instance is not None:
+        instance.flush(timeout=5.0)
+
+
+def _make_handler(directory):
+    try:
+        from http.server import BaseHTTPRequestHandler
+    except ImportError:  # Python 2
+        from BaseHTTPServer import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, *args):
+            pass  # silence
+
+        def _paths(self):
+            parts = self.path.strip('/').split('/')
+            if len(parts) != 2 or not all(map(_name_re.match, parts)):
+                return None
+            namespace, key = parts
+            base = os.path.join(directory, namespace, key[:2], key)
+            return base, base + '.meta'
+
+        def _reply(self, code, body=b'', headers=()):
+            self.send_response(code)
+            for k, v in headers:
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def do_GET(self):
+            paths = self._paths()
+            if paths is None:
+                return self._reply(400)
+            data_path, meta_path = paths
+            try:
+                with open(meta_path, 'rt') as ifh:
+                    meta = json.load(ifh)
+                with open(data_path, 'rb') as ifh:
+                    body = ifh.read()
+            except (IOError, OSError, ValueError):
+                return self._reply(404)
+            self._reply(200, body, [
+                ('X-Content-SHA256', meta['sha256']),
+                ('X-Pycompilation-Compression', meta['compression']),
+                ('Content-Type', 'application/octet-stream')])
+
+        do_HEAD = do_GET
+
+        def do_PUT(self):
+            paths = self._paths()
+            if paths is None:
+                return self._reply(400)
+            data_path, meta_path = paths
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            digest = self.headers.get('X-Content-SHA256', '')
+            compression = self.headers.get('X-Pycompilation-Compression',
+                                           'none')
+            try:
+                data = zlib.decompress(body) if compression == 'zlib' \
+                    else body
+            except zlib.error:
+                return self._reply(400)
+            if compression not in ('zlib', 'none') or \
+               sha256_hexdigest(data) != digest:
+                return self._reply(400)
+            dirname = os.path.dirname(data_path)
+            if not os.path.isdir(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    pass
+            for path, content in [
+                    (data_path, body),
+                    (meta_path, json.dumps({
+                        'sha256': digest,
+                        'compression': compression}).encode('utf-8'))]:
+                fd, tmp = tempfile.mkstemp(dir=dirname)
+                with os.fdopen(fd, 'wb') as ofh:
+                    ofh.write(content)
+                os.rename(tmp, path)
+            self._reply(201)
+
+    return Handler
+
+
+class RemoteCacheServer(object):
+    """
+    Reference implementation of a remote cache server (for testing and
+    small deployments) storing artifacts in a directory.
+
+    Parameters
+    ----------
+    directory: path string
+        storage, default: a new temporary directory (removed by `stop`)
+    host: string
+    port: int
+        0 means pick a free port.
+
+    Examples
+    --------
+    >>> server = RemoteCacheServer()
+    >>> client = RemoteCache(server.start())
+    >>> client.put('objects', 'abc123', b'data')
+    True
+    >>> client.flush()
+    True
+    >>> client.get('objects', 'abc123')
+    b'data'
+    >>> server.stop()
+
+    """
+
+    def __init__(self, directory=None, host='127.0.0.1', port=0):
+        self._tmpdir = directory is None
+        self.directory = directory or tempfile.mkdtemp()
+        try:
+            from http.server import HTTPServer
+            from socketserver import ThreadingMixIn
+        except ImportError:  # Python 2
+            from BaseHTTPServer import HTTPServer
+            from SocketServer import ThreadingMixIn
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.httpd = Server((host, port), _make_handler(self.directory))
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        """ Serves in a background thread, returns the url. """
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._tmpdir:
+            shutil.rmtree(self.directory, ignore_errors=True)
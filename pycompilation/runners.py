@@ -6,6 +6,7 @@ import os
 import re
 import subprocess
 import sys
+import time
 import warnings
 
 from .util import (
@@ -15,6 +16,43 @@ from .util import (
 )
 
 
+_time_report_re = re.compile(
+    r'^ (\S.*?)\s*:\s*([\d.]+)\s*(?:\(\s*\d+%\))?\s*([\d.]+)\s*'
+    r'(?:\(\s*\d+%\))?\s*([\d.]+)', re.MULTILINE)
+
+
+def parse_time_report(text):
+    """
+    Parses the output of -ftime-report (GCC)
+
+    Returns
+    =======
+    OrderedDict mapping phase (e.g. 'TOTAL') to wall time in seconds
+    """
+    return OrderedDict((m.group(1), float(m.group(4)))
+                       for m in _time_report_re.finditer(text))
+
+
+def parse_time_trace(path):
+    """
+    Parses the json file written by -ftime-trace (Clang)
+
+    Returns
+    =======
+    OrderedDict mapping phase (e.g. 'Total Frontend') to wall time in
+    seconds, or None if path is missing.
+    """
+    import json
+    try:
+        with open(path, 'rt') as ifh:
+            events = json.load(ifh).get('traceEvents', [])
+    except (IOError, OSError, ValueError):
+        return None
+    return OrderedDict((ev['name'], ev['dur']*1e-6) for ev in events
+                       if ev.get('name', '').startswith('Total ') and
+                       'dur' in ev)
+
+
 class CompilerRunner(object):
 
     """
@@ -39,8 +77,10 @@ class CompilerRunner(object):
     std: string
         Standard string, e.g. c++11, c99, f2008
     options: iterable of strings
-        pycompilation convenience tags (fast, warn, pic, openmp).
-        Sets extra compiler flags.
+        pycompilation convenience tags (fast, warn, pic, openmp, lapack).
+        Sets extra compiler flags. 'lapack' links the BLAS/LAPACK backend
+        found by `pycompilation.blas.detect_blas` (stored in ``blas``),
+        falling back to ``vendor_options_dict``.
     define: iterable of strings
         macros to define
     undef: iterable of strings
@@ -56,6 +96,19 @@ class CompilerRunner(object):
         Sets extra libraries.
     only_update: bool
         Only run compiler if sources are newer than destination. default: False
+    stdin: string
+        source code piped to the compiler (pass '-' in sources), requires
+        the compiler to be listed in ``stdin_flags``.
+    time_report: string
+        'report' adds -ftime-report (parsed into ``phase_times`` after
+        `run`), 'trace' adds -ftime-trace (clang only, writes a json
+        file next to the output which is parsed into ``phase_times``,
+        see `parse_time_trace`). The wall time of `run` is always
+        recorded in ``wall_time``.
+    probe: bool
+        Drop (or substitute) flags not supported by the compiler (see
+        `pycompilation.probe.filter_flags`), default: environment
+        variable PYCOMPILATION_PROBE_FLAGS == '1'
 
     Returns
     =======
@@ -68,6 +121,7 @@ class CompilerRunner(object):
     """
 
     compiler_dict = None  # Subclass to vendor/binary dict
+    language = None  # Subclass to 'c', 'c++' or 'fortran'
     environ_key_ldflags = 'LDFLAGS'
 
     # Standards should be a tuple of supported standards
@@ -86,6 +140,12 @@ class CompilerRunner(object):
 
     default_compile_options = ('pic', 'warn')  # , 'fast'
 
+    # Subclass to dict of binary/flags selecting the language of
+    # source read from stdin ('-'), and format of #line directive
+    stdin_flags = {}
+    line_directive = '#line {0} "{1}"\n'
+
+    # Fallbacks of the 'lapack' option (when pycompilation.blas detects none)
     # http://software.intel.com/en-us/articles/intel-mkl-link-line-advisor
     # MKL 11.1 x86-64, *nix, MKLROOT env. set, dynamic linking
     # This is _really_ ugly and not portable in any manner.
@@ -129,7 +189,8 @@ class CompilerRunner(object):
                  library_dirs=None, std=None, options=None, define=None,
                  undef=None, strict_aliasing=None, logger=None,
                  preferred_vendor=None, metadir=None, lib_options=None,
-                 only_update=False, ldflags=None, **kwargs):
+                 only_update=False, ldflags=None, stdin=None,
+                 time_report=None, probe=None, **kwargs):
 
         cwd = cwd or '.'
         metadir = get_abspath(metadir or '.', cwd=cwd)
@@ -184,6 +245,25 @@ class CompilerRunner(object):
         self.lib_options = lib_options or []
         self.logger = logger
         self.only_update = only_update
+        self.stdin = stdin
+        if stdin is not None:
+            if self.compiler_name not in self.stdin_flags:
+                raise CompilationError(
+                    "{} cannot read source from stdin".format(
+                        self.compiler_name))
+            self.flags.extend(self.stdin_flags[self.compiler_name])
+        self.time_report = time_report
+        self.wall_time = None
+        self.phase_times = None
+        if time_report == 'report':
+            self.flags.append('-ftime-report')
+        elif time_report == 'trace':
+            if self.compiler_name not in ('clang', 'clang++'):
+                raise CompilationError("-ftime-trace not supported by " +
+                                       self.compiler_name)
+            self.flags.append('-ftime-trace')
+        elif time_report:
+            raise ValueError("Unknown time_report={}".format(time_report))
         self.run_linker = run_linker
         if self.run_linker:
             # both gnu and intel compilers use '-c' for disabling linker
@@ -200,10 +280,22 @@ class CompilerRunner(object):
             str.strip, os.environ.get(self.environ_key_ldflags, "").split()) if lf != ""]
 
         # Handle options
+        self.blas = None
         for opt in self.options:
             self.flags.extend(self.option_flag_dict.get(
                 self.compiler_name, {}).get(opt, []))
 
+            if opt == 'lapack':
+                from .blas import detect_blas
+                self.blas = detect_blas(self.compiler_binary, self.language,
+                                        logger=self.logger)
+                if self.blas is not None:
+                    self.libraries.extend(self.blas.libraries)
+                    self.library_dirs.extend(self.blas.library_dirs)
+                    self.include_dirs.extend(self.blas.include_dirs)
+                    self.define.extend(self.blas.define)
+                    continue
+
             # extend based on vendor options dict
             def extend(l, k):
                 l.extend(
@@ -243,6 +335,13 @@ class CompilerRunner(object):
                 raise ValueError("Unknown strict_aliasing={}".format(
                     strict_aliasing))
 
+        if probe is None:
+            probe = os.environ.get('PYCOMPILATION_PROBE_FLAGS', '0') == '1'
+        if probe:
+            from .probe import filter_flags
+            self.flags = filter_flags(self.compiler_binary, self.flags,
+                                      self.language, self.logger)
+
     @classmethod
     def find_compiler(cls, preferred_vendor, metadir, cwd,
                       use_meta=True):
@@ -346,6 +445,7 @@ class CompilerRunner(object):
 
         # NOTE: the ' '.join(self.cmd()) part seems to be necessary for
         # intel compilers
+        t0 = time.time()
         p = subprocess.Popen(' '.join(self.cmd()),
                              shell=True,
                              cwd=self.cwd,
@@ -353,7 +453,9 @@ class CompilerRunner(object):
                              stdout=subprocess.PIPE,
                              stderr=subprocess.STDOUT,
                              env=env)
-        comm = p.communicate()
+        comm = p.communicate(None if self.stdin is None else
+                             self.stdin.encode('utf-8'))
+        self.wall_time = time.time() - t0
         if sys.version_info[0] == 2:
             self.cmd_outerr = comm[0]
         else:
@@ -371,6 +473,12 @@ class CompilerRunner(object):
                 ' '.join(self.cmd()), self.cwd, str(self.cmd_returncode),
                 self.cmd_outerr))
 
+        if self.time_report == 'report':
+            self.phase_times = parse_time_report(self.cmd_outerr)
+        elif self.time_report == 'trace':
+            self.phase_times = parse_time_trace(os.path.splitext(
+                get_abspath(self.out, cwd=self.cwd))[0] + '.json')
+
         if self.logger and len(self.cmd_outerr) > 0:
             self.logger.info('...with output:\n'+self.cmd_outerr)
 
@@ -381,6 +489,7 @@ class CCompilerRunner(CompilerRunner, HasMetaData):
 
     environ_key_compiler = 'CC'
     environ_key_flags = 'CFLAGS'
+    language = 'c'
 
     compiler_dict = OrderedDict([
         ('gnu', 'gcc'),
@@ -388,7 +497,13 @@ class CCompilerRunner(CompilerRunner, HasMetaData):
         ('llvm', 'clang'),
     ])
 
-    standards = ('c89', 'c90', 'c99', 'c11')  # First is default
+    standards = ('c89', 'c90', 'c99', 'c11', 'c17')  # First is default
+
+    stdin_flags = {
+        'gcc': ['-x', 'c'],
+        'icc': ['-x', 'c'],
+        'clang': ['-x', 'c'],
+    }
 
     std_formater = {
         'gcc': '-std={}'.format,
@@ -400,7 +515,8 @@ class CCompilerRunner(CompilerRunner, HasMetaData):
         'gcc': {
             'pic': ('-fPIC',),
             'warn': ('-Wall', '-Wextra'),
-            # -march=native not portable and problematic for Mac OSX:
+            # -march=native not portable and problematic for Mac OSX
+            # (see pycompilation.multi_isa for per ISA-level builds):
             'fast': ('-O2',),
             'very-fast-imprecise': ('-O3', '-ffast-math', '-funroll-loops'),
             'openmp': ('-fopenmp',),
@@ -449,6 +565,7 @@ class CppCompilerRunner(CompilerRunner, HasMetaData):
 
     environ_key_compiler = 'CXX'
     environ_key_flags = 'CXXFLAGS'
+    language = 'c++'
 
     compiler_dict = OrderedDict([
         ('gnu', 'g++'),
@@ -456,8 +573,15 @@ class CppCompilerRunner(CompilerRunner, HasMetaData):
         ('llvm', 'clang++'),
     ])
 
-    # First is the default, c++0x == c++11
-    standards = ('c++98', 'c++0x')
+    # First is the default, c++0x == c++11 (see pycompilation.probe for
+    # which ones the compiler supports)
+    standards = ('c++98', 'c++0x', 'c++11', 'c++14', 'c++17', 'c++20')
+
+    stdin_flags = {
+        'g++': ['-x', 'c++'],
+        'icpc': ['-x', 'c++'],
+        'clang++': ['-x', 'c++'],
+    }
 
     std_formater = {
         'g++': '-std={}'.format,
@@ -512,8 +636,16 @@ class FortranCompilerRunner(CompilerRunner, HasMetaData):
 
     environ_key_compiler = 'FC'
     environ_key_flags = 'FFLAGS'
+    language = 'fortran'
+
+    standards = (None, 'f95', 'f2003', 'f2008', 'f2018')  # First is default (F77)
 
-    standards = (None, 'f95', 'f2003', 'f2008')  # First is default (F77)
+    # the preprocessor handles the line marker, source form is given
+    # explicitly ('-ffixed-form'/'-ffree-form') by the caller
+    stdin_flags = {
+        'gfortran': ['-x', 'f95-cpp-input'],
+    }
+    line_directive = '# {0} "{1}"\n'
 
     std_formater = {
         'gfortran': '-std={}'.format,
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""
+Plain shared libraries called through ctypes (or cffi in ABI mode).
+
+For kernels written in C (or Fortran using ``bind(c)``) there is no need
+for a Cython wrapper: the sources are compiled and linked into a plain
+shared library (which does not depend on the Python ABI, so it can be
+reused across Python versions) and NumPy-aware call shims are generated
+from declared C prototypes::
+
+    lib = compile_link_load_strings(
+        [('scale.c', 'void scale(int n, double * x, double f) {...}')],
+        ['void scale(int n, double * x, double f)'])
+    lib.scale(x.size, x, 2.0)
+
+Pointer arguments accept NumPy arrays: const (input) arguments are
+converted to C contiguous arrays of the right dtype (copying if needed)
+whereas non-const (output) arguments must already be C contiguous,
+writeable and of the exact dtype (a ValueError is raised otherwise).
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+
+from .compilation import (
+    compile_sources, link, any_fort, any_cplus, build_key, write_code_string
+)
+from .prototypes import Prototype, parse_prototype, format_prototype, \
+    ctype_dtype_char
+from .support import shared_lib_ext
+from .util import get_abspath
+
+# C types mapped to the names of the corresponding ctypes types
+ctypes_names = {
+    'char': 'c_byte',
+    'signed char': 'c_byte',
+    'unsigned char': 'c_ubyte',
+    'short': 'c_short',
+    'unsigned short': 'c_ushort',
+    'int': 'c_int',
+    'unsigned int': 'c_uint',
+    'unsigned': 'c_uint',
+    'long': 'c_long',
+    'unsigned long': 'c_ulong',
+    'long long': 'c_longlong',
+    'unsigned long long': 'c_ulonglong',
+    'float': 'c_float',
+    'double': 'c_double',
+    'long double': 'c_longdouble',
+    'int8_t': 'c_int8',
+    'uint8_t': 'c_uint8',
+    'int16_t': 'c_int16',
+    'uint16_t': 'c_uint16',
+    'int32_t': 'c_int32',
+    'uint32_t': 'c_uint32',
+    'int64_t': 'c_int64',
+    'uint64_t': 'c_uint64',
+    'size_t': 'c_size_t',
+    'ptrdiff_t': 'c_ssize_t',
+}
+
+backends = ('ctypes', 'cffi')
+
+
+def _as_array(arg, dtype, argument):
+    import numpy as np
+    if argument.const:
+        return np.ascontiguousarray(arg, dtype=dtype)
+    if not isinstance(arg, np.ndarray) or arg.dtype != dtype or \
+       not arg.flags['C_CONTIGUOUS'] or not arg.flags['WRITEABLE']:
+        raise ValueError(
+            "Argument '{}' must be a writeable C contiguous array of "
+            "dtype {}".format(argument.name, dtype))
+    return arg
+
+
+def _make_shim(cfunc, proto, as_pointer):
+    import numpy as np
+    dtypes = [np.dtype(ctype_dtype_char[a.ctype]) if a.pointer else None
+              for a in proto.args]
+
+    def shim(*args):
+        if len(args) != len(proto.args):
+            raise TypeError("{}() takes {} arguments ({} given)".format(
+                proto.name, len(proto.args), len(args)))
+        arrays, cargs = [], []  # arrays kept alive during the call
+        for arg, a, dtype in zip(args, proto.args, dtypes):
+            if a.pointer:
+                arrays.append(_as_array(arg, dtype, a))
+                cargs.append(as_pointer(arrays[-1], a))
+            else:
+                cargs.append(arg)
+        return cfunc(*cargs)
+    shim.__name__ = proto.name
+    shim.__doc__ = format_prototype(proto)
+    return shim
+
+
+class SharedLibrary(object):
+    """
+    A loaded shared library with one call shim (attribute) per prototype.
+
+    Parameters
+    ----------
+    path: path string
+        path to shared library
+    prototypes: iterable of strings or Prototype instances
+        C prototypes of the functions to expose, e.g.
+        'double dot(int n, const double * x, const double * y)'
+    backend: string
+        'ctypes' (default) or 'cffi' (ABI mode)
+
+    Attributes
+    ----------
+    path: path string
+    handle: the ctypes.CDLL instance or the cffi library object
+    """
+
+    def __init__(self, path, prototypes, backend='ctypes'):
+        if backend not in backends:
+            raise ValueError("Unknown backend: {}".format(backend))
+        self.path = path
+        self.backend = backend
+        self.prototypes = [p if isinstance(p, Prototype) else
+                           parse_prototype(p) for p in prototypes]
+        getattr(self, '_load_' + backend)()
+
+    def _load_ctypes(self):
+        import ctypes
+        self.handle = ctypes.CDLL(self.path)
+        pointer_types = {}
+        for proto in self.prototypes:
+            cfunc = getattr(self.handle, proto.name)
+            cfunc.restype = None if proto.restype == 'void' else getattr(
+                ctypes, ctypes_names[proto.restype])
+            argtypes = []
+            for a in proto.args:
+                ctype = getattr(ctypes, ctypes_names[a.ctype])
+                if a.pointer:
+                    ctype = pointer_types.setdefault(
+                        a.ctype, ctypes.POINTER(ctype))
+                argtypes.append(ctype)
+            cfunc.argtypes = argtypes
+            setattr(self, proto.name, _make_shim(
+                cfunc, proto, lambda arr, a: arr.ctypes.data_as(
+                    pointer_types[a.ctype])))
+
+    def _load_cffi(self):
+        import cffi
+        ffi = cffi.FFI()
+        ffi.cdef(''.join(format_prototype(p) + ';\n'
+                         for p in self.prototypes))
+        self.handle = ffi.dlopen(self.path)
+        for proto in self.prototypes:
+            setattr(self, proto.name, _make_shim(
+                getattr(self.handle, proto.name), proto,
+                lambda arr, a: ffi.cast(a.ctype + ' *', arr.ctypes.data)))
+
+    def __repr__(self):
+        return '<{} {!r} ({})>'.format(type(self).__name__, self.path,
+                                       self.backend)
+
+
+def compile_link_shared(srcs, libname=None, build_dir=None,
+                        compile_kwargs=None, link_kwargs=None, **kwargs):
+    """
+    Compiles sources into a plain shared library (no Python wrapper).
+
+    Parameters
+    ----------
+    srcs: iterable of path strings
+    libname: string
+        the library is named ``lib<libname>.so`` (``.dylib`` on OS X).
+        default: basename of the last source file (without extension).
+    build_dir: path string
+        objects and the library are put here. default: '.'
+    compile_kwargs: dict
+        keyword arguments passed to `compile_sources` ('pic' is always
+        added to the options).
+    link_kwargs: dict
+        keyword arguments passed to `link`
+    **kwargs:
+        keyword arguments passed to both compile_sources and link
+        (e.g. logger, only_update).
+
+    Returns
+    -------
+    Absolute path to the shared library.
+    """
+    srcs = list(srcs)
+    build_dir = build_dir or '.'
+    if libname is None:
+        libname = os.path.splitext(os.path.basename(srcs[-1]))[0]
+    compile_kwargs = dict(compile_kwargs or {}, **kwargs)
+    options = list(compile_kwargs.pop('options', ['pic', 'warn', 'fast']))
+    if 'pic' not in options:
+        options.append('pic')
+    compile_kwargs['options'] = options
+    link_kwargs = dict(link_kwargs or {}, **kwargs)
+
+    objs = compile_sources(list(map(get_abspath, srcs)), destdir=build_dir,
+                           cwd=build_dir, **compile_kwargs)
+    return link(objs, 'lib' + libname + shared_lib_ext, shared=True,
+                cwd=build_dir, fort=any_fort(srcs), cplus=any_cplus(srcs),
+                **link_kwargs)
+
+
+def compile_link_load(srcs, prototypes, libname=None, build_dir=None,
+                      backend='ctypes', **kwargs):
+    """
+    Compiles sources into a shared library (see `compile_link_shared`)
+    and loads it (see `SharedLibrary`).
+
+    Note that a library at a given path can only be loaded once per
+    process (use new build directories or library names for changed
+    sources).
+    """
+    kwargs.setdefault('only_update', True)
+    return SharedLibrary(compile_link_shared(
+        srcs, libname, build_dir, **kwargs), prototypes, backend)
+
+
+def compile_link_load_strings(codes, prototypes, build_dir=None,
+                              backend='ctypes', **kwargs):
+    """
+    Dumps, compiles and links code strings into a shared library which is
+    loaded through ctypes/cffi.
+
+    Parameters
+    ----------
+    codes: iterable of name/source pair tuples
+    prototypes: iterable of strings or Prototype instances
+        C prototypes of the functions to expose.
+    build_dir: path string
+        default: a persistent directory in the managed cache (see
+        `pycompilation.cache`) derived from `build_key` (excluding the
+        Python ABI, i.e. shared by all Python versions).
+    backend: string
+        'ctypes' (default) or 'cffi'
+    **kwargs:
+        keyword arguments passed onto `compile_link_load`
+
+    Returns
+    -------
+    SharedLibrary instance
+    """
+    codes = list(codes)
+    if build_dir is None:
+        from .cache import entry_dir
+        build_dir = entry_dir('shared', build_key(
+            codes, kwargs, python_abi=False))
+    elif not os.path.isdir(build_dir):
+        raise OSError("Non-existent directory: ", build_dir)
+    only_update = kwargs.setdefault('only_update', True)
+    source_files = []
+    for name, code_ in codes:
+        dest = os.path.join(build_dir, name)
+        write_code_string(dest, code_, only_update)
+        source_files.append(dest)
+    return compile_link_load(source_files, prototypes, build_dir=build_dir,
+                             backend=backend, **kwargs)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+"""
+Splitting of oversized (generated) C/C++ translation units.
+
+A single huge generated source is compiled on one core (and may need
+a lot of memory). Code generators can mark independent top level
+definitions which are then distributed over N shards (compiled in
+parallel and linked together)::
+
+    #include <math.h>
+    double helper(double);  /* declarations needed by all chunks */
+    /* pycompilation:split-begin */
+    void jac_part0(const double * y, double * out) { ... }
+    /* pycompilation:split */
+    void jac_part1(const double * y, double * out) { ... }
+    /* pycompilation:split-end */
+    void jac(const double * y, double * out) { jac_part0(y, out); ... }
+
+Everything before the first ``split-begin`` marker (includes, type
+definitions and prototypes) is put in a header shared by all shards,
+the chunks between the markers are distributed over the shards and any
+remaining code goes into the first shard. ``//`` style markers work as
+well. #line directives keep diagnostics referring to the original
+source.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import re
+
+_marker_re = re.compile(
+    r'^\s*(?:/\*\s*pycompilation:(split(?:-begin|-end)?)\s*\*/|'
+    r'//\s*pycompilation:(split(?:-begin|-end)?))\s*$')
+
+split_extensions = ('.c', '.cpp', '.cxx')
+
+
+def has_split_markers(code_):
+    return 'pycompilation:split-begin' in code_
+
+
+def parse_split_markers(code_):
+    """
+    Returns (prologue, chunks, rest) where each element is a list of
+    (first line number, text) segments (chunks is a list of such lists).
+    """
+    prologue, chunks, rest = [], [], []
+    current, target = [], prologue
+    state = 'prologue'
+    for lineno, line in enumerate(code_.splitlines(True), 1):
+        m = _marker_re.match(line)
+        kind = m and (m.group(1) or m.group(2))
+        if kind is None:
+            if not current:
+                current.append(lineno)
+            current.append(line)
+            continue
+        if kind == 'split-begin':
+            if state == 'region':
+                raise ValueError("Nested split-begin on line %d" % lineno)
+            state = 'region'
+        elif kind == 'split-end':
+            if state != 'region':
+                raise ValueError("Unmatched split-end on line %d" % lineno)
+            state = 'rest'
+        elif state != 'region':
+            raise ValueError("split marker outside region on line %d" %
+                             lineno)
+        if current:
+            target.append((current[0], ''.join(current[1:])))
+            current = []
+        if kind == 'split-end':
+            target = rest
+        else:
+            target = []
+            chunks.append(target)
+    if state == 'region':
+        raise ValueError("Missing split-end")
+    if current:
+        target.append((current[0], ''.join(current[1:])))
+    return prologue, [c for c in chunks if c], rest
+
+
+def shard_chunks(chunks, nshards):
+    """
+    Distributes chunks over (at most) nshards by size (largest first
+    onto the smallest shard), the original order is kept within shards.
+    """
+    nshards = max(1, min(nshards, len(chunks)))
+    sizes = [sum(len(text) for _, text in c) for c in chunks]
+    shards = [[] for _ in range(nshards)]
+    totals = [0]*nshards
+    for idx in sorted(range(len(chunks)), key=lambda i: (-sizes[i], i)):
+        dest = totals.index(min(totals))
+        shards[dest].append(idx)
+        totals[dest] += sizes[idx]
+    return [[chunks[i] for i in sorted(shard)] for shard in shards]
+
+
+def _with_line_directives(segments, name):
+    return ''.join(text if lineno is None else '#line {0} "{1}"\n{2}'.format(
+        lineno, name, text) for lineno, text in segments)
+
+
+def _shards(name, prologue, chunks, rest, nshards):
+    base, ext = os.path.splitext(name)
+    if ext.lower() not in split_extensions:
+        raise ValueError("Only C/C++ sources can be split: " + name)
+    header = base + '_split.h'
+    guard = re.sub(r'\W', '_', os.path.basename(header)).upper()
+    result = [(header, '#ifndef {0}\n#define {0}\n{1}\n#endif\n'.format(
+        guard, prologue))]
+    include = '#include "{}"\n'.format(os.path.basename(header))
+    for idx, shard in enumerate(shard_chunks(chunks, nshards)):
+        body = ''.join(_with_line_directives(c, name) for c in shard)
+        if idx == 0:
+            body += rest
+        result.append(('{}_split{}{}'.format(base, idx, ext), include + body))
+    return result
+
+
+def split_code(name, code_, nshards):
+    """
+    Splits a source code string with split markers (see module docstring).
+
+    Parameters
+    ----------
+    name: string
+        file name of the source, e.g. 'jac.c'
+    code_: string
+    nshards: int
+        (maximum) number of translation units
+
+    Returns
+    -------
+    list of name/source pair tuples: the shared header ('jac_split.h')
+    followed by the shards ('jac_split0.c', 'jac_split1.c', ...).
+    """
+    prologue, chunks, rest = parse_split_markers(code_)
+    return _shards(name, _with_line_directives(prologue, name), chunks,
+                   _with_line_directives(rest, name), nshards)
+
+
+def split_functions(name, functions, nshards, prologue=''):
+    """
+    Distributes independent function definitions over shards.
+
+    Parameters
+    ----------
+    name: string
+        base file name of the shards, e.g. 'jac.c'
+    functions: iterable of strings
+        C/C++ definitions
+    nshards: int
+    prologue: string
+        code shared by all shards (includes, prototypes, ...)
+
+    Returns
+    -------
+    list of name/source pair tuples (see `split_code`)
+    """
+    return _shards(name, prologue, [[(None, f + '\n')] for f in functions],
+                   '', nshards)
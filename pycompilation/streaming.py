@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming of memory-mapped arrays (larger than RAM) through kernels.
+
+Inputs (``.npy`` files or `numpy.memmap` instances) are split along
+their first axis into chunks of page aligned size. The next chunk is
+read by a background thread while the kernel processes the current
+one. Results are written to a memory-mapped ``.npy`` output. Pages of
+finished chunks are released with ``madvise`` so that the memory use
+does not grow with the size of the data::
+
+    stream_kernel(mod.sigmoid, ['x.npy'], 'y.npy', args=(350.0,))
+
+Windowed (stencil) kernels are given chunks extended by ``overlap``
+elements on both sides (fewer at the ends of the data) and return an
+array of the same length, of which the part belonging to the chunk is
+written::
+
+    stream_kernel(lambda x: np.convolve(x, w, 'same'), ['x.npy'],
+                  'y.npy', overlap=len(w)//2)
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import mmap
+
+try:
+    from math import gcd
+except ImportError:  # Python 2
+    from fractions import gcd
+
+default_chunk_bytes = 16*1024**2  # per chunk, summed over the inputs
+
+
+def aligned_chunk_rows(row_bytes, chunk_bytes=None, page_size=None):
+    """
+    Number of rows per chunk: close to chunk_bytes and a multiple of the
+    page size in bytes (when rows are smaller than pages).
+
+    Examples
+    --------
+    >>> aligned_chunk_rows(8, 10000, page_size=4096)
+    1024
+    """
+    chunk_bytes = chunk_bytes or default_chunk_bytes
+    page_size = page_size or mmap.PAGESIZE
+    row_bytes = max(1, row_bytes)
+    step = page_size // gcd(page_size, row_bytes)
+    rows = chunk_bytes // row_bytes
+    return max(step, rows - rows % step)
+
+
+def _open(src, mode='r'):
+    if isinstance(src, str):
+        import numpy as np
+        return np.load(src, mmap_mode=mode)
+    return src
+
+
+def _advise(arr, start, stop, advice):
+    """ madvise rows [start, stop) of a memory-mapped array """
+    mm = getattr(arr, '_mmap', None)
+    if mm is None or advice is None or not hasattr(mm, 'madvise') or \
+       not arr.flags.c_contiguous or stop <= start:
+        return
+    row_bytes = arr.strides[0] if arr.ndim else arr.itemsize
+    base = getattr(arr, 'offset', 0) % mmap.ALLOCATIONGRANULARITY
+    begin = base + start*row_bytes
+    begin -= begin % mmap.PAGESIZE
+    end = min(len(mm), base + stop*row_bytes)
+    try:
+        mm.madvise(advice, begin, end - begin)
+    except (OSError, ValueError):
+        pass
+
+
+def _chunk_bounds(nrows, rows, overlap):
+    """ Yields (start, stop, lo, hi): chunk and extended chunk bounds """
+    for start in range(0, nrows, rows):
+        stop = min(nrows, start + rows)
+        yield start, stop, max(0, start - overlap), min(nrows, stop + overlap)
+
+
+def stream_kernel(kernel, inputs, output, args=(), kwargs=None,
+                  chunk_bytes=None, overlap=0, prefetch=True,
+                  out_kwarg=None, dtype=None):
+    """
+    Applies kernel chunk-wise to memory-mapped inputs (see module
+    docstring).
+
+    Parameters
+    ----------
+    kernel: callable
+        called as ``kernel(*(input chunks + args), **kwargs)``, returns an
+        array with as many rows as the chunks (e.g. a ufunc or a wrapper
+        generated by `pycompilation.chunked`).
+    inputs: iterable of paths to .npy files or arrays (numpy.memmap)
+        of equal length (first axis)
+    output: path string or numpy.memmap
+        a path is created as a memory-mapped .npy file (shaped after
+        the first result) unless it is an array
+    args: tuple
+        extra positional arguments (e.g. scalars)
+    kwargs: dict
+        extra keyword arguments
+    chunk_bytes: int
+        approximate size of a chunk (summed over the inputs).
+        default: `default_chunk_bytes`
+    overlap: int
+        rows added to both sides of chunks (windowed kernels)
+    prefetch: bool
+        read the next chunk (into memory) while the kernel runs. When
+        False kernels get views of the memory maps.
+    out_kwarg: string
+        name of a keyword argument taking a preallocated output (e.g.
+        'out' for ufuncs), the output map is then written directly
+        (overlap must be 0).
+    dtype: dtype
+        of the output, default: that of the first result
+
+    Returns
+    -------
+    The output (numpy.memmap), flushed.
+    """
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+    kwargs = dict(kwargs or {})
+    arrays = [_open(src) for src in inputs]
+    if not arrays:
+        raise ValueError("No inputs")
+    nrows = arrays[0].shape[0]
+    for arr in arrays[1:]:
+        if arr.shape[0] != nrows:
+            raise ValueError("Inputs differ in length: {} != {}".format(
+                arr.shape[0], nrows))
+    if overlap < 0:
+        raise ValueError("overlap must be non-negative")
+    if out_kwarg is not None and overlap:
+        raise ValueError("out_kwarg cannot be used with overlap")
+    row_bytes = sum(arr.itemsize*(arr.size // nrows if nrows else 1)
+                    for arr in arrays)
+    rows = aligned_chunk_rows(row_bytes, chunk_bytes)
+    out = output if not isinstance(output, str) else None
+    if out is not None and out.shape[0] != nrows:
+        raise ValueError("Output length {} differs from input length {}"
+                         .format(out.shape[0], nrows))
+
+    if out is None and out_kwarg is not None:
+        out = np.lib.format.open_memmap(
+            output, mode='w+', dtype=dtype or arrays[0].dtype,
+            shape=arrays[0].shape)
+
+    def advise_inputs(lo, hi, advice):
+        for arr in arrays:
+            _advise(arr, lo, hi, advice)
+
+    def load(bounds):
+        lo, hi = bounds[2:]
+        if not prefetch:
+            return [arr[lo:hi] for arr in arrays]
+        advise_inputs(lo, hi, getattr(mmap, 'MADV_WILLNEED', None))
+        return [np.array(arr[lo:hi]) for arr in arrays]
+
+    advise_inputs(0, nrows, getattr(mmap, 'MADV_SEQUENTIAL', None))
+    dontneed = getattr(mmap, 'MADV_DONTNEED', None)
+    bounds = list(_chunk_bounds(nrows, rows, overlap))
+    released = 0  # input rows before this are no longer needed
+    with ThreadPoolExecutor(1) as executor:
+        if prefetch and bounds:
+            pending = executor.submit(load, bounds[0])
+        for idx, (start, stop, lo, hi) in enumerate(bounds):
+            if prefetch:
+                chunks = pending.result()
+                if idx + 1 < len(bounds):
+                    pending = executor.submit(load, bounds[idx + 1])
+            else:
+                chunks = load(bounds[idx])
+            call_args = list(chunks) + list(args)
+            if out_kwarg is not None:
+                kernel(*call_args, **dict(kwargs, **{
+                    out_kwarg: out[start:stop]}))
+            else:
+                result = np.asarray(kernel(*call_args, **kwargs))
+                if result.shape[:1] != (hi - lo,):
+                    raise ValueError(
+                        "Kernel returned {} rows for a chunk of {}".format(
+                            result.shape[:1], hi - lo))
+                if out is None:
+                    out = np.lib.format.open_memmap(
+                        output, mode='w+', dtype=dtype or result.dtype,
+                        shape=(nrows,) + result.shape[1:])
+                out[start:stop] = result[start - lo:stop - lo]
+            del chunks, call_args
+            # drop pages of rows no later chunk reads (and written rows)
+            if stop - overlap > released:
+                advise_inputs(released, stop - overlap, dontneed)
+                released = stop - overlap
+            if getattr(out, 'mode', None) in ('r+', 'w+'):  # shared map
+                _advise(out, start, stop, dontneed)
+    if out is None:  # no rows: trailing shape of results unknown
+        out = np.lib.format.open_memmap(
+            output, mode='w+', dtype=dtype or arrays[0].dtype,
+            shape=arrays[0].shape)
+    if hasattr(out, 'flush'):
+        out.flush()
+    return out
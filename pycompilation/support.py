@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reusable support libraries.
+
+Support code shared by many generated extensions (e.g. numerical helpers)
+can be compiled once into a static archive or a shared library which is
+stored in a cache directory keyed by the content of the sources and the
+build options. Extensions are then linked against it (shared libraries
+are copied next to the extension, so that evicting the cache entry does
+not break it)::
+
+    lib = build_support_library(['helpers.c'], 'helpers')
+    mod = compile_link_import_py_ext(srcs, support_libraries=[lib])
+
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import namedtuple
+
+from .cache import entry_dir, maybe_gc, touch, write_manifest
+from .compilation import (
+    compile_sources, link, any_fort, any_cplus, toolchain_identity
+)
+from .util import (
+    CompilationError, get_abspath, make_dirs, md5_of_file, md5_of_string
+)
+
+SupportLibrary = namedtuple(
+    'SupportLibrary', 'name path kind include_dirs fort cplus')
+
+shared_lib_ext = '.dylib' if sys.platform == 'darwin' else '.so'
+
+def support_library_key(srcs, name, kind, kwargs):
+    """
+    Hex digest of source contents, build options and compilers (see
+    `toolchain_identity`).
+    """
+    md = md5_of_string('{}:{}'.format(name, kind).encode('utf-8'))
+    for src in srcs:
+        md.update(os.path.basename(src).encode('utf-8'))
+        md.update(md5_of_file(src).digest())
+    items = sorted((k, v) for k, v in kwargs.items() if k != 'logger')
+    md.update(repr(items).encode('utf-8'))
+    md.update(toolchain_identity(kwargs.get(
+        'preferred_vendor', None)).encode('utf-8'))
+    return md.hexdigest()
+
+
+def _archive(objs, out_file, cwd):
+    ar = os.environ.get('AR', 'ar')
+    p = subprocess.Popen([ar, 'rcs', out_file] + list(objs), cwd=cwd,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out, _ = p.communicate()
+    if p.returncode != 0:
+        raise CompilationError("Error executing '{}': {}".format(
+            ' '.join([ar, 'rcs', out_file] + list(objs)),
+            out.decode('utf-8', 'replace')))
+
+
+def build_support_library(srcs, name, kind='static', cache_dir=None,
+                          include_dirs=None, link_kwargs=None, **kwargs):
+    """
+    Builds (or fetches from the cache) a support library.
+
+    Parameters
+    ----------
+    srcs: iterable of path strings
+        sources of the library
+    name: string
+        library name (``lib<name>.a`` / ``lib<name>.so``)
+    kind: string
+        'static' (archive) or 'shared'
+    cache_dir: path string
+        root of managed cache (see `pycompilation.cache`), libraries
+        are stored in its 'support' namespace. default: ``get_cache_dir()``
+    include_dirs: iterable of path strings
+        include directories used when compiling `srcs`, they are also
+        recorded for compiling code using the library.
+    link_kwargs: dict
+        keyword arguments passed to `link` (kind='shared' only)
+    **kwargs:
+        keyword arguments passed to `compile_sources` ('pic' is always
+        added to the options).
+
+    Returns
+    -------
+    SupportLibrary instance, pass it in ``support_libraries`` to
+    `link_py_so` or `compile_link_import_py_ext`.
+    """
+    if kind not in ('static', 'shared'):
+        raise ValueError("Unknown kind: {}".format(kind))
+    srcs = [get_abspath(src) for src in srcs]
+    include_dirs = [get_abspath(d) for d in (include_dirs or [])]
+    options = list(kwargs.pop('options', ['pic', 'warn', 'fast']))
+    if 'pic' not in options:
+        options.append('pic')
+    kwargs['options'] = options
+    logger = kwargs.get('logger', None)
+
+    key = support_library_key(srcs, name, kind, dict(
+        kwargs, include_dirs=include_dirs, link_kwargs=link_kwargs))
+    lib_dir = entry_dir('support', key, create=False, root=cache_dir)
+    fname = 'lib' + name + ('.a' if kind == 'static' else shared_lib_ext)
+    lib = SupportLibrary(name, os.path.join(lib_dir, fname), kind,
+                         include_dirs, any_fort(srcs), any_cplus(srcs))
+    if os.path.exists(lib.path):
+        if logger:
+            logger.info("Found support library {}".format(lib.path))
+        return lib
+
+    if not os.path.isdir(os.path.dirname(lib_dir)):
+        make_dirs(os.path.dirname(lib_dir))
+    maybe_gc(cache_dir)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(lib_dir), prefix='.tmp_')
+    try:
+        objs = compile_sources(srcs, destdir=tmp_dir, cwd=tmp_dir,
+                               include_dirs=list(include_dirs), **kwargs)
+        if kind == 'static':
+            _archive(objs, fname, tmp_dir)
+        else:
+            link_kwargs = dict(link_kwargs or {})
+            flags = list(link_kwargs.pop('flags', []))
+            if sys.platform != 'darwin':
+                flags.append('-Wl,-soname,' + fname)
+            link(objs, fname, shared=True, cwd=tmp_dir, flags=flags,
+                 fort=lib.fort, cplus=lib.cplus, logger=logger,
+                 **link_kwargs)
+        write_manifest(tmp_dir)
+        try:
+            os.rename(tmp_dir, lib_dir)
+        except OSError:  # built concurrently by another process
+            if not os.path.exists(lib.path):
+                raise
+        touch(lib_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return lib
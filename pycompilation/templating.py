@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""
+Rendering of source templates (see ``template_regexps`` of
+`pycompilation.dist.PCExtension`).
+
+Engines are selected by name: 'percent' (``%``-formatting, the default),
+'string' (`string.Template`), 'jinja2' and 'mako' (when installed)::
+
+    class build_ext(pc_build_ext):
+        render_callback = staticmethod(template_renderer('jinja2'))
+
+Parsed templates are cached (per engine, path and modification time) and
+outputs are only written when their content changed, leaving the
+modification time of unchanged outputs (and hence dependent objects)
+untouched.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import string
+import threading
+from collections import OrderedDict
+
+from .util import get_abspath, make_dirs, missing_or_other_newer
+
+
+class PercentEngine(object):
+    """ Old-style ``%`` formatting with a dict, e.g. ``%(n)d`` """
+
+    def compile(self, text, path=None):
+        return text
+
+    def render(self, template, subsd):
+        return template % subsd
+
+
+class StringTemplateEngine(object):
+    """ `string.Template` substitution, e.g. ``${n}`` """
+
+    def compile(self, text, path=None):
+        return string.Template(text)
+
+    def render(self, template, subsd):
+        return template.substitute(subsd)
+
+
+class Jinja2Engine(object):
+    """ Jinja2 (includes are looked up next to the template) """
+
+    def compile(self, text, path=None):
+        import jinja2
+        env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(os.path.dirname(path or '.')),
+            keep_trailing_newline=True, undefined=jinja2.StrictUndefined)
+        return env.from_string(text)
+
+    def render(self, template, subsd):
+        return template.render(**subsd)
+
+
+class MakoEngine(object):
+    """ Mako (includes are looked up next to the template) """
+
+    def compile(self, text, path=None):
+        from mako.lookup import TemplateLookup
+        from mako.template import Template
+        return Template(text, lookup=TemplateLookup(
+            directories=[os.path.dirname(path or '.')]),
+            strict_undefined=True)
+
+    def render(self, template, subsd):
+        return template.render(**subsd)
+
+
+engines = OrderedDict([
+    ('percent', PercentEngine),
+    ('string', StringTemplateEngine),
+    ('jinja2', Jinja2Engine),
+    ('mako', MakoEngine),
+])
+
+_instances = {}
+_compiled = {}  # abspath -> (engine, mtime, size, compiled template)
+_compiled_lock = threading.Lock()
+
+
+def get_engine(engine):
+    """ Returns an engine instance given its name (or an instance) """
+    if not isinstance(engine, str):
+        return engine
+    if engine not in engines:
+        raise ValueError("Unknown template engine: {}".format(engine))
+    if engine not in _instances:
+        _instances[engine] = engines[engine]()
+    return _instances[engine]
+
+
+def get_template(path, engine='percent'):
+    """
+    Returns the compiled template at path (cached as long as the file is
+    unchanged).
+    """
+    engine = get_engine(engine)
+    path = get_abspath(path)
+    st = os.stat(path)
+    with _compiled_lock:
+        cached = _compiled.get(path)
+    if cached is not None and cached[:3] == (engine, st.st_mtime, st.st_size):
+        return cached[3]
+    with open(path, 'rt') as ifh:
+        template = engine.compile(ifh.read(), path)
+    with _compiled_lock:
+        _compiled[path] = (engine, st.st_mtime, st.st_size, template)
+    return template
+
+
+def render(path, subsd, engine='percent'):
+    """ Renders the template at path with the substitution dict subsd """
+    return get_engine(engine).render(get_template(path, engine), subsd)
+
+
+def write_if_changed(dest, data, create_dest_dirs=True):
+    """
+    Writes the string data to dest unless dest already has that content.
+
+    Returns
+    -------
+    True if the file was written
+    """
+    data = data.encode('utf-8')
+    if os.path.exists(dest):
+        with open(dest, 'rb') as ifh:
+            if ifh.read() == data:
+                return False
+    elif create_dest_dirs:
+        dest_dir = os.path.dirname(dest)
+        if dest_dir and not os.path.exists(dest_dir):
+            make_dirs(dest_dir)
+    with open(dest, 'wb') as ofh:
+        ofh.write(data)
+    return True
+
+
+def render_to(src, dest, subsd, engine='percent', only_update=False,
+              prev_subsd=None, create_dest_dirs=True, logger=None):
+    """
+    Renders the template src to dest (see `write_if_changed`).
+
+    Parameters
+    ----------
+    src: path string
+        template
+    dest: path string
+    subsd: dict
+        substitutions
+    engine: string or engine instance
+        see `engines`. default: 'percent'
+    only_update: bool
+        skip rendering altogether when subsd equals prev_subsd and
+        dest is newer than src.
+    prev_subsd: dict
+        substitutions used when dest was last rendered
+    create_dest_dirs: bool
+    logger: logging.Logger
+
+    Returns
+    -------
+    True if dest was written
+    """
+    if only_update and subsd == prev_subsd and \
+       not missing_or_other_newer(dest, src):
+        if logger:
+            logger.info("Did not re-render {}. "
+                        "(destination newer + same dict)".format(src))
+        return False
+    written = write_if_changed(dest, render(src, subsd, engine),
+                               create_dest_dirs)
+    if logger and not written:
+        logger.info("Rendering {} did not change {}".format(src, dest))
+    return written
+
+
+def template_renderer(engine):
+    """
+    Returns a function usable as ``render_callback`` of
+    `pycompilation.dist.pc_build_ext` and `pycompilation.dist.pc_sdist`.
+    """
+    get_engine(engine)  # fail early for unknown engines
+
+    def render_callback(src, dest, subsd, only_update=False, prev_subsd=None,
+                        create_dest_dirs=True, logger=None):
+        return render_to(src, dest, subsd, engine, only_update, prev_subsd,
+                         create_dest_dirs, logger)
+    return render_callback
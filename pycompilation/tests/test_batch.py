@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import glob
+import os
+
+import pytest
+
+from pycompilation import cache
+from pycompilation.batch import compile_link_import_batch
+
+np = pytest.importorskip('numpy')
+
+_kernels = [
+    ('add1', 'void add1(int n, double * x) '
+     '{ int i; for (i = 0; i < n; ++i) x[i] += 1; }',
+     'void (int n, double * x)'),
+    ('total', 'double total(int n, const double * x) '
+     '{ double s = 0; int i; for (i = 0; i < n; ++i) s += x[i]; return s; }',
+     'double (int n, const double * x)'),
+    ('bits', '#include <stdint.h>\n'
+     'int64_t bits(uint8_t b) { return (int64_t)b << 40; }',
+     'int64_t (uint8_t b)'),
+]
+
+
+def test_compile_link_import_batch(tmpdir):
+    build_dir = str(tmpdir)
+    mod = compile_link_import_batch(_kernels, build_dir=build_dir, nproc=2)
+    assert mod.__kernels__ == ('add1', 'total', 'bits')
+    x = np.arange(4.0)
+    mod.add1(4, x)
+    assert x.tolist() == [1.0, 2.0, 3.0, 4.0]
+    assert mod.total(4, x) == 10.0
+    assert mod.bits(3) == 3 << 40
+
+    obj = os.path.join(build_dir, 'add1.o')
+    mtime = os.path.getmtime(obj)
+    mod2 = compile_link_import_batch(_kernels[:2] + [
+        ('neg', 'double neg(double x) { return -x; }', 'double (double x)')],
+        build_dir=build_dir, nproc=2)
+    assert mod2.neg(2.0) == -2.0
+    assert mod2.__name__ != mod.__name__
+    assert os.path.getmtime(obj) == mtime  # only new kernels compiled
+
+
+def test_compile_link_import_batch__cache(tmpdir, monkeypatch):
+    monkeypatch.setenv('PYCOMPILATION_CACHE_DIR', str(tmpdir))
+    mod = compile_link_import_batch(_kernels[2:], modname='cached')
+    assert mod.bits(1) == 1 << 40
+    compile_link_import_batch(_kernels[2:], modname='cached')
+    entries = list(cache.iter_entries(str(tmpdir), 'batch'))
+    assert len(entries) == 1  # content addressed: reused
+    header, = glob.glob(os.path.join(entries[0][2], 'cached_*.h'))
+    with open(header, 'rt') as ifh:
+        assert '#include <stdint.h>' in ifh.read()
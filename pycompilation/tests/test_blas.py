@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+
+import pytest
+
+from pycompilation import blas
+from pycompilation.blas import (
+    BlasInfo, blas_threads, detect_blas, preferred_backends,
+    threads_per_worker
+)
+
+
+def test_detect_blas(tmpdir, monkeypatch):
+    monkeypatch.setenv('PYCOMPILATION_CACHE_DIR', str(tmpdir))
+    info = detect_blas('gcc', backends=['openblas', 'reference'])
+    if info is None:
+        pytest.skip("No BLAS/LAPACK installed")
+    assert info.name in ('openblas', 'reference')
+    assert info.threading in ('sequential', 'pthreads', 'openmp', None)
+    assert detect_blas('gcc', backends=['openblas', 'reference']) == info
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/maps'),
+                    reason='needs /proc/self/maps')
+def test_threading_layer():
+    def loaded():
+        with open('/proc/self/maps') as ifh:
+            return 'openblas' in ifh.read()
+    if loaded():
+        pytest.skip("OpenBLAS already loaded")
+    if blas.find_library('openblas') is None:
+        pytest.skip("OpenBLAS not installed")
+    assert blas.threading_layer('openblas', ['openblas']) in (
+        'sequential', 'pthreads', 'openmp')
+    assert not loaded()
+
+
+def test_detect_blas__not_found(tmpdir, monkeypatch):
+    monkeypatch.setenv('PYCOMPILATION_CACHE_DIR', str(tmpdir))
+    monkeypatch.setattr(blas, '_detected', {})
+    monkeypatch.setattr(blas, 'probe', lambda *args, **kwargs: False)
+    assert detect_blas('gcc', backends=['blis']) is None
+    monkeypatch.setattr(blas, '_detected', {})  # i.e. a new process
+    monkeypatch.setattr(blas, 'probe', lambda *args, **kwargs: True)
+    monkeypatch.setattr(blas, 'threading_layer', lambda *args: None)
+    info = detect_blas('gcc', backends=['blis'])
+    assert info.name == 'blis'
+
+
+def test_preferred_backends(monkeypatch):
+    monkeypatch.setenv('PYCOMPILATION_BLAS', 'blis,reference')
+    assert preferred_backends() == ['blis', 'reference']
+    monkeypatch.setenv('PYCOMPILATION_BLAS', 'atlas')
+    with pytest.raises(ValueError):
+        preferred_backends()
+
+
+def test_blas_threads(monkeypatch):
+    monkeypatch.delenv('BLIS_NUM_THREADS', raising=False)
+    assert threads_per_worker(4, ncpus=8) == 2
+    assert threads_per_worker(16, ncpus=8) == 1
+    info = BlasInfo('blis', ['blis'], [], [], [], 'openmp')
+    with blas_threads(3, info):
+        assert os.environ['BLIS_NUM_THREADS'] == '3'
+    assert 'BLIS_NUM_THREADS' not in os.environ
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+
+from pycompilation import cache
+
+
+def _add(root, key, nbytes, accessed):
+    path = cache.entry_dir('build', key, root=root)
+    with open(os.path.join(path, 'data'), 'wb') as ofh:
+        ofh.write(b'x'*nbytes)
+    with open(os.path.join(path, cache.access_filename), 'wt') as ofh:
+        ofh.write(repr(accessed))
+    return path
+
+
+def test_parse_size():
+    assert cache.parse_size('512') == 512
+    assert cache.parse_size('2K') == 2048
+    assert cache.parse_size('1.5GiB') == 3*1024**3//2
+
+
+def test_gc__lru(tmpdir):
+    root = str(tmpdir)
+    old = _add(root, 'aa01', 1000, 100.0)
+    new = _add(root, 'ab02', 1000, 200.0)
+    assert cache.stats(root)['build']['entries'] == 2
+    evicted = cache.gc(max_size=1500, max_age=1e12, root=root)
+    assert [path for path, size in evicted] == [old]
+    assert os.path.isdir(new)
+
+
+def test_verify(tmpdir):
+    root = str(tmpdir)
+    path = _add(root, 'ac03', 10, 100.0)
+    cache.write_manifest(path)
+    assert cache.verify(root) == []
+    with open(os.path.join(path, 'data'), 'ab') as ofh:
+        ofh.write(b'y')
+    assert cache.verify(root, remove=True)[0][0] == path
+    assert not os.path.exists(path)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import pytest
+
+from pycompilation import compile_link_import_strings
+
+np = pytest.importorskip('numpy')
+
+_kernels = """
+#include <math.h>
+void sigmoid(int n, const double * in, double * out, double lim) {
+    int i;
+    for (i = 0; i < n; ++i)
+        out[i] = in[i]*pow(pow(in[i]/lim, 8) + 1, -1./8.);
+}
+double largest(long n, const double * x) {
+    double m = x[0];
+    long i;
+    for (i = 1; i < n; ++i)
+        if (x[i] > m)
+            m = x[i];
+    return m;
+}
+void scale(int n, double * y, const double * x) {
+    int i;
+    for (i = 0; i < n; ++i)
+        y[i] = 2*x[i];
+}
+"""
+
+
+def test_compile_link_import_strings_chunked(tmpdir):
+    mod = compile_link_import_strings(
+        [('sigmoid.c', _kernels)], build_dir=str(tmpdir),
+        options=['pic', 'warn'], chunked={
+            'sigmoid': 'void sigmoid(int n, const double * in, '
+                       'double * out, double lim)',
+            'largest': dict(prototype='double largest(long n, '
+                                      'const double * x)', reduce='max'),
+            'scale': 'void scale(int n, double * y, const double * x)',
+        })
+    x = np.random.random(10007)*500
+    ref = x/((x/350.0)**8 + 1)**(1/8.)
+    assert np.allclose(mod.sigmoid(x, 350.0), ref)
+    out = np.empty_like(x)
+    mod.sigmoid(x, 350.0, out=out, chunk_size=1000, num_threads=3)
+    assert np.allclose(out, ref)
+    assert mod.sigmoid(x[:0], 350.0).shape == (0,)
+    assert mod.largest(x, chunk_size=7) == x.max()
+    with pytest.raises(ValueError):
+        mod.sigmoid(x, 350.0, out=out[:10])
+    with pytest.raises(ValueError):
+        mod.largest(x[:0])
+    assert np.allclose(mod.scale(x), 2*x)  # output before input
+    with pytest.raises(ValueError):
+        mod.scale(x, y=out[:10])
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+
+import pytest
+
+from pycompilation import cache
+from pycompilation.compilation import (
+    compile_sources, link, simple_cythonize, src2obj_from_string
+)
+
+
+def test_link__only_update(tmpdir):
+    tmpdir = str(tmpdir)
+    with open(os.path.join(tmpdir, 'main.c'), 'wt') as ofh:
+        ofh.write('int main(void){ return 0; }\n')
+    objs = compile_sources(['main.c'], cwd=tmpdir)
+    exe = link(objs, 'main', cwd=tmpdir, only_update=True)
+    mtime = os.path.getmtime(exe)
+    assert link(objs, 'main', cwd=tmpdir, only_update=True) == exe
+    assert os.path.getmtime(exe) == mtime
+
+
+def test_src2obj_from_string(tmpdir):
+    tmpdir = str(tmpdir)
+    with open(os.path.join(tmpdir, 'two.h'), 'wt') as ofh:
+        ofh.write('#define TWO 2\n')
+    code_ = '#include "two.h"\nint f(void){ return TWO; }\n'
+    obj = src2obj_from_string(code_, 'f.c', cwd=tmpdir, only_update=True)
+    assert obj == 'f.o'
+    assert not os.path.exists(os.path.join(tmpdir, 'f.c'))
+    mtime = os.path.getmtime(os.path.join(tmpdir, obj))
+    src2obj_from_string(code_, 'f.c', cwd=tmpdir, only_update=True)
+    assert os.path.getmtime(os.path.join(tmpdir, obj)) == mtime
+
+
+def test_compile_sources__nproc(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    os.mkdir('build')
+    for name in ('a', 'b', 'c'):
+        with open(os.path.join('build', name + '.c'), 'wt') as ofh:
+            ofh.write('int {0}(void){{ return 1; }}\n'.format(name))
+    with open(os.path.join('build', 'w.pyx'), 'wt') as ofh:
+        ofh.write('def f():\n    return 1\n')
+    objs = compile_sources(['a.c', 'w.pyx', 'b.c', 'c.c'], cwd='build',
+                           nproc=3)
+    assert [os.path.normpath(o) for o in objs] == [
+        'a.o', 'w.o', 'b.o', 'c.o']
+    for obj in objs:
+        assert os.path.exists(os.path.join('build', obj))
+
+
+_split_src = """#include "factor.h"
+/* pycompilation:split-begin */
+int a(void) { return FACTOR; }
+/* pycompilation:split */
+int b(void) { return 2*FACTOR; }
+/* pycompilation:split-end */
+"""
+
+
+def test_compile_sources__split(tmpdir):
+    tmpdir.join('src', 'ab.c').write(_split_src, ensure=True)
+    tmpdir.join('src', 'factor.h').write('#define FACTOR 3\n')
+    objs = compile_sources([os.path.join('src', 'ab.c')], destdir='build',
+                           cwd=str(tmpdir), split=2)
+    assert len(objs) == 2
+    assert sorted(os.listdir(str(tmpdir.join('src')))) == ['ab.c', 'factor.h']
+    for name in ('ab_split.h', 'ab_split0.c', 'ab_split1.c'):
+        assert os.path.exists(str(tmpdir.join('build', name)))
+
+
+def test_simple_cythonize__cache(tmpdir, monkeypatch):
+    root = str(tmpdir.join('cache'))
+    monkeypatch.setenv('PYCOMPILATION_CACHE_DIR', root)
+    tmpdir = str(tmpdir)
+    with open(os.path.join(tmpdir, 'broken.pyx'), 'wt') as ofh:
+        ofh.write('def f(:\n')
+    with pytest.raises(ValueError):
+        simple_cythonize('broken.pyx', cwd=tmpdir, cache=True)
+    assert list(cache.iter_entries(root, 'cython')) == []  # no empty entry
+
+    with open(os.path.join(tmpdir, 'one.pyx'), 'wt') as ofh:
+        ofh.write('def f():\n    return 1\n')
+    assert simple_cythonize('one.pyx', cwd=tmpdir, cache=True) == './one.c'
+    (_, _, path), = cache.iter_entries(root, 'cython')
+    assert os.path.exists(os.path.join(path, 'one.c'))
+    os.unlink(os.path.join(tmpdir, 'one.c'))
+    simple_cythonize('one.pyx', cwd=tmpdir, cache=True)  # reused
+    assert os.path.exists(os.path.join(tmpdir, 'one.c'))
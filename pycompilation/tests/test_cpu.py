@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import pytest
+
+from pycompilation.cpu import supported_isa_levels, is_x86_64, x86_64_isa_levels
+
+
+@pytest.mark.skipif(not is_x86_64(), reason='x86-64 only')
+def test_supported_isa_levels():
+    assert supported_isa_levels(set()) == ['x86-64']
+    v2 = set(x86_64_isa_levels['x86-64-v2'])
+    assert supported_isa_levels(v2) == ['x86-64', 'x86-64-v2']
+    v3_only = set(x86_64_isa_levels['x86-64-v3'])
+    assert supported_isa_levels(v3_only) == ['x86-64']
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import glob
+import os
+import tarfile
+
+import pytest
+from distutils.dist import Distribution
+from distutils.errors import DistutilsSetupError
+
+from pycompilation import dist as dist_module
+from pycompilation.compilation import compile_sources, simple_cythonize
+from pycompilation.dist import (
+    PCExtension, pc_build_ext, pc_sdist, extension_fingerprint
+)
+
+
+def test_pc_build_ext__parallel(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    tmpdir.join('common.c').write(
+        '#ifndef FACTOR\n#define FACTOR 2\n#endif\n'
+        'double scale(double x) { return FACTOR*x; }\n')
+    for name in 'abc':
+        tmpdir.join('pc_dist_' + name + '.pyx').write(
+            'cdef extern double scale(double)\n'
+            'def f(double x):\n    return scale(x)\n')
+    exts = [PCExtension('pc_dist_' + name, sources=[
+                            'common.c', 'pc_dist_' + name + '.pyx'],
+                        pycompilation_compile_kwargs=dict(
+                            define=['FACTOR=3'] if name == 'c' else []),
+                        pycompilation_link_kwargs={}) for name in 'abc']
+    dist = Distribution(dict(name='pc_dist', ext_modules=exts,
+                             cmdclass={'build_ext': pc_build_ext}))
+    cmd = dist.get_command_obj('build_ext')
+    cmd.build_temp = 'build_temp'
+    cmd.build_lib = 'build_lib'
+    cmd.parallel = 3
+    dist.run_command('build_ext')
+    # common.c is compiled once per distinct set of options
+    objs = glob.glob(os.path.join('build_temp', 'common*.o'))
+    assert len(objs) == 2
+    assert len(glob.glob(os.path.join('build_lib', 'pc_dist_*'))) == 3
+
+
+def test_pc_build_ext__relative_paths(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    os.mkdir('libs')
+    tmpdir.join('libs', 'extra.c').write('double extra(void) { return 7; }\n')
+    extra, = compile_sources(['extra.c'], cwd='libs')
+    for name in 'ab':
+        tmpdir.join('pc_rel_' + name + '.pyx').write(
+            'cdef extern double extra()\n'
+            'def f():\n    return extra()\n')
+    exts = [PCExtension('pc_rel_' + name, sources=['pc_rel_' + name + '.pyx'],
+                        extra_objects=[os.path.join('libs', extra)],
+                        library_dirs=['libs'],
+                        pycompilation_compile_kwargs={},
+                        pycompilation_link_kwargs={}) for name in 'ab']
+    dist = Distribution(dict(name='pc_rel', ext_modules=exts,
+                             cmdclass={'build_ext': pc_build_ext}))
+    cmd = dist.get_command_obj('build_ext')
+    cmd.build_temp = 'build_temp'
+    cmd.build_lib = 'build_lib'
+    cmd.parallel = 2
+    dist.run_command('build_ext')
+    assert len(glob.glob(os.path.join('build_lib', 'pc_rel_*'))) == 2
+
+
+def test_pc_build_ext__force(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    tmpdir.join('pc_force.pyx').write('def f():\n    return 1\n')
+
+    def build(force):
+        ext = PCExtension('pc_force', sources=['pc_force.pyx'],
+                          pycompilation_compile_kwargs={},
+                          pycompilation_link_kwargs={})
+        dist = Distribution(dict(name='pc_force', ext_modules=[ext],
+                                 cmdclass={'build_ext': pc_build_ext}))
+        cmd = dist.get_command_obj('build_ext')
+        cmd.build_temp = 'build_temp'
+        cmd.build_lib = 'build_lib'
+        cmd.force = force
+        dist.run_command('build_ext')
+        obj, = glob.glob(os.path.join('build_temp', 'pc_force*.o'))
+        return os.path.getmtime(obj)
+
+    mtime = build(False)
+    assert build(False) == mtime  # unchanged: skipped
+    assert build(True) > mtime
+
+
+def test_extension_fingerprint(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    tmpdir.join('f.c').write('int f(void) { return 1; }\n')
+    ext = PCExtension('f', sources=['f.c'], pycompilation_compile_kwargs={},
+                      pycompilation_link_kwargs={})
+    fp = extension_fingerprint(ext, 'f.so')
+    assert extension_fingerprint(ext, 'f.so') == fp
+    ext.pycompilation_compile_kwargs['define'] = ['N=3']
+    assert extension_fingerprint(ext, 'f.so') != fp
+    del ext.pycompilation_compile_kwargs['define']
+    tmpdir.join('f.c').write('int f(void) { return 2; }\n')
+    assert extension_fingerprint(ext, 'f.so') != fp
+
+
+def test_pc_sdist(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    monkeypatch.setenv('PYCOMPILATION_CACHE_DIR', str(tmpdir.join('cache')))
+    tmpdir.join('setup.py').write('')
+    tmpdir.join('common.c').write('double half(double x) { return x/2; }\n')
+    for name in 'ab':
+        tmpdir.join('pc_sd_' + name + '.pyx').write(
+            'cdef extern double half(double)\n'
+            'def f(double x):\n    return half(x)\n')
+    exts = [PCExtension('pc_sd_' + name, sources=[
+        'common.c', 'pc_sd_' + name + '.pyx']) for name in 'ab']
+    dist = Distribution(dict(name='pc_sd', version='0.1', ext_modules=exts,
+                             script_name='setup.py',
+                             cmdclass={'sdist': pc_sdist}))
+    cmd = dist.get_command_obj('sdist')
+    cmd.formats = ['gztar']
+    cmd.parallel = 2
+    dist.run_command('sdist')
+    with tarfile.open(os.path.join('dist', 'pc_sd-0.1.tar.gz')) as tf:
+        names = set(os.path.relpath(n, 'pc_sd-0.1') for n in tf.getnames())
+        generated = tf.extractfile('pc_sd-0.1/pc_sd_a.c').read()
+    assert set(['setup.py', 'common.c', 'pc_sd_a.c',
+                'pc_sd_b.c']) <= names
+    assert b'__pyx_pw_' in generated  # cythonized, not a copy
+    os.unlink('pc_sd_a.c')
+    simple_cythonize('pc_sd_a.pyx', '.', cplus=False, include_path=[])
+    with open('pc_sd_a.c', 'rb') as ifh:
+        assert ifh.read() == generated  # same as a serial, uncached run
+
+
+def test_pc_sdist__shared_pyx(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    monkeypatch.setenv('PYCOMPILATION_CACHE_DIR', str(tmpdir.join('cache')))
+    tmpdir.join('setup.py').write('')
+    tmpdir.join('pc_sd_shared.pyx').write('def f():\n    return 1\n')
+    jobs = []
+
+    def process_map(func, jobs_, njobs):
+        jobs.extend(jobs_)
+        return [func(job) for job in jobs_]
+    monkeypatch.setattr(dist_module, '_process_map', process_map)
+
+    def run(include_dirs):
+        exts = [PCExtension('pc_sd_' + name, sources=[src],
+                            include_dirs=incl) for name, src, incl in zip(
+                                'ab', ['pc_sd_shared.pyx',
+                                       './pc_sd_shared.pyx'], include_dirs)]
+        dist = Distribution(dict(name='pc_sd', version='0.1',
+                                 ext_modules=exts, script_name='setup.py',
+                                 cmdclass={'sdist': pc_sdist}))
+        cmd = dist.get_command_obj('sdist')
+        cmd.formats = ['gztar']
+        dist.run_command('sdist')
+        return exts
+
+    exts = run([['inc'], ['inc']])
+    assert len(jobs) == 1  # cythonized once
+    assert [list(map(os.path.normpath, ext.sources)) for ext in exts] == [
+        ['pc_sd_shared.c']] * 2
+    with pytest.raises(DistutilsSetupError):
+        run([['inc'], ['other']])
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+
+import pytest
+
+from pycompilation.compilation import sharedext
+from pycompilation.cpu import supported_isa_levels
+from pycompilation.multi_isa import (
+    compile_link_import_py_ext_multi_isa, compile_link_py_ext_multi_isa,
+    import_best_isa, isa_build_dir
+)
+
+_levels = ['x86-64', 'x86-64-v2']
+
+_kernel = """
+int have_sse42(void) {
+#ifdef __SSE4_2__
+    return 1;
+#else
+    return 0;
+#endif
+}
+"""
+
+_wrapper = """
+cdef extern int have_sse42()
+def py_have_sse42():
+    return have_sse42()
+"""
+
+
+@pytest.mark.skipif('x86-64-v2' not in supported_isa_levels(),
+                    reason='needs an x86-64-v2 capable CPU')
+def test_compile_link_import_py_ext_multi_isa(tmpdir):
+    tmpdir.join('kernel.c').write(_kernel)
+    tmpdir.join('_isa.pyx').write(_wrapper)
+    srcs = [str(tmpdir.join('kernel.c')), str(tmpdir.join('_isa.pyx'))]
+    build_dir = str(tmpdir.join('build'))
+
+    mod = compile_link_import_py_ext_multi_isa(
+        srcs, build_dir=build_dir, isa_levels=_levels, options=['pic'])
+    assert mod.__isa_level__ == 'x86-64-v2'
+    assert mod.py_have_sse42() == 1
+
+    baseline = import_best_isa(build_dir, '_isa', isa_levels=['x86-64'])
+    assert baseline.__isa_level__ == 'x86-64'
+    assert baseline.py_have_sse42() == 0
+
+    with pytest.raises(ImportError):
+        import_best_isa(build_dir, '_isa', isa_levels=[])
+
+    def so_mtimes():
+        return [os.path.getmtime(os.path.join(
+            isa_build_dir(build_dir, level), '_isa' + sharedext))
+            for level in _levels]
+
+    mtimes = so_mtimes()
+    compile_link_py_ext_multi_isa(srcs, build_dir=build_dir,
+                                  isa_levels=_levels, options=['pic'])
+    assert so_mtimes() == mtimes  # up to date
+
+    compile_link_py_ext_multi_isa(srcs, build_dir=build_dir,
+                                  isa_levels=_levels, options=['pic'],
+                                  flags=['-DUNUSED'])
+    assert all(new > old for new, old in zip(so_mtimes(), mtimes))
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+
+import pytest
+
+from pycompilation import compile_link_import_strings
+from pycompilation.openmp import (
+    OpenMPModule, format_sweep, get_schedule, loaded_runtimes,
+    openmp_settings, parse_schedule, set_openmp, split_cores, thread_sweep
+)
+
+_kernel = """
+#include <omp.h>
+int nthreads(void) {
+    int n = 0;
+#pragma omp parallel
+    {
+#pragma omp single
+        n = omp_get_num_threads();
+    }
+    return n;
+}
+int schedule(void) {
+    omp_sched_t kind;
+    int chunk;
+    omp_get_schedule(&kind, &chunk);
+    return 1000*(kind & ~omp_sched_monotonic) + chunk;
+}
+"""
+
+_wrapper = """
+cdef extern int nthreads()
+cdef extern int schedule()
+def f():
+    return nthreads()
+def g():
+    return schedule()
+"""
+
+
+def test_OpenMPModule(tmpdir):
+    mod = compile_link_import_strings(
+        [('omp_kernel.c', _kernel), ('_test_openmp.pyx', _wrapper)],
+        build_dir=str(tmpdir), options=['pic', 'warn', 'openmp'])
+    assert OpenMPModule(mod, num_threads=3).f() == 3
+    assert OpenMPModule(mod, num_threads=2).f() == 2
+    results = thread_sweep(OpenMPModule(mod).f, threads=[1, 2], repeat=1)
+    assert [r.threads for r in results] == [1, 2]
+    assert results[0].speedup == 1.0
+    assert 'efficiency' in format_sweep(results)
+
+    lib = loaded_runtimes()[0]
+    initial = get_schedule(lib)
+    omp_schedule = os.environ.get('OMP_SCHEDULE')
+    with openmp_settings():  # restores what set_openmp changes below
+        set_openmp(schedule='static,3')
+        assert OpenMPModule(mod, schedule='dynamic,16').g() == 2016
+        assert mod.g() == 1003 and get_schedule(lib)[1] == 3
+        with openmp_settings(num_threads=2, schedule='guided,5'):
+            assert mod.g() == 3005
+        assert mod.g() == 1003
+    assert get_schedule(lib) == initial
+    assert os.environ.get('OMP_SCHEDULE') == omp_schedule
+
+
+def test_split_cores():
+    assert split_cores({'a': 2, 'b': 1, 'c': 1}, ncpus=8) == {
+        'a': 4, 'b': 2, 'c': 2}
+    assert split_cores({'a': 1, 'b': 1, 'c': 1}, ncpus=2) == {
+        'a': 1, 'b': 1, 'c': 1}
+
+
+def test_parse_schedule():
+    assert parse_schedule('dynamic,16') == (2, 16)
+    assert parse_schedule('nonmonotonic:guided') == (3, 0)
+    with pytest.raises(ValueError):
+        parse_schedule('fastest')
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+
+from pycompilation import compile_link_import_strings
+from pycompilation.compilation import get_compile_record
+from pycompilation.opt_policy import OptLevelPolicy
+
+
+def test_OptLevelPolicy(tmpdir):
+    small = tmpdir.join('kernel_a.c')
+    small.write('int a;\n')
+    big = tmpdir.join('jac.c')
+    big.write('int b;\n' * 100)
+    policy = OptLevelPolicy(levels=[(10, ['-O2']), (None, ['-O0'])],
+                            budget=1.0, hot=['kernel_*.c'])
+    assert policy(str(small)) == ['-O3']
+    assert policy(str(big)) == ['-O0']
+
+    policy = OptLevelPolicy(levels=[(10, ['-O2']), (None, ['-O1'])],
+                            budget=1.0)
+    slow = {'wall_time': 5.0, 'opt_flags': ['-O2'], 'size': 7}
+    assert policy(str(small), slow) == ['-O1']
+    fast = {'wall_time': 0.1, 'opt_flags': ['-O1'], 'size': 7}
+    assert policy(str(small), fast) == ['-O1']  # unchanged source
+    fast['size'] = 8
+    assert policy(str(small), fast) == ['-O2']
+
+
+_kernel = """
+int twice(int x) { return 2*x; }
+"""
+
+_kernel_pyx = """
+cdef extern int twice(int)
+def py_twice(x):
+    return twice(x)
+"""
+
+
+def test_compile_link_import_strings_opt_policy_in_memory(tmpdir):
+    build_dir = str(tmpdir)
+    policy = OptLevelPolicy(levels=[(None, ['-O1'])])
+    mod = compile_link_import_strings(
+        [('kernel.c', _kernel), ('kernel_wrapper.pyx', _kernel_pyx)],
+        build_dir=build_dir, in_memory=True, opt_policy=policy)
+    assert mod.py_twice(21) == 42
+    record = get_compile_record(os.path.join(build_dir, 'kernel.c'),
+                                build_dir)
+    assert record['opt_flags'] == ['-O1']
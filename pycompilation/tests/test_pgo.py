@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import glob
+import os
+
+from pycompilation.pgo import compile_link_import_py_ext_pgo
+
+_kernel = """
+int collatz(long n) {
+    int steps = 0;
+    while (n != 1) {
+        n = n % 2 ? 3*n + 1 : n/2;
+        ++steps;
+    }
+    return steps;
+}
+"""
+
+_wrapper = """
+cdef extern int collatz(long n)
+def py_collatz(n):
+    return collatz(n)
+"""
+
+
+def test_compile_link_import_py_ext_pgo(tmpdir):
+    srcs = [str(tmpdir.join('collatz.c')), str(tmpdir.join('_collatz.pyx'))]
+    tmpdir.join('collatz.c').write(_kernel)
+    tmpdir.join('_collatz.pyx').write(_wrapper)
+    build_dir = str(tmpdir.join('build'))
+    profile_dir = str(tmpdir.join('profiles'))
+    marker = tmpdir.join('trainings')
+
+    def training(mod):  # runs in a forked child
+        with open(str(marker), 'at') as ofh:
+            ofh.write('{}\n'.format(mod.py_collatz(27)))
+
+    def build(**kwargs):
+        return compile_link_import_py_ext_pgo(
+            srcs, training, build_dir=build_dir, profile_dir=profile_dir,
+            options=['pic', 'fast'], **kwargs)
+
+    def so_mtime():
+        so, = glob.glob(os.path.join(build_dir, '_collatz*.so'))
+        return os.path.getmtime(so)
+
+    mod = build()
+    assert mod.py_collatz(27) == 111
+    assert marker.read() == '111\n'
+    assert glob.glob(os.path.join(build_dir, '*.gcda'))
+    mtime = so_mtime()
+
+    build()  # cache hit: neither trained nor rebuilt
+    assert marker.read() == '111\n'
+    assert so_mtime() == mtime
+
+    build(flags=['-DUNUSED'])  # other options: new profile
+    assert marker.read() == '111\n111\n'
+    mtime = so_mtime()
+
+    build()  # extension built with other options: rebuilt, not retrained
+    assert marker.read() == '111\n111\n'
+    assert so_mtime() > mtime
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+from pycompilation.probe import filter_flags, flag_supported
+
+
+def test_filter_flags(tmpdir, monkeypatch):
+    monkeypatch.setenv('PYCOMPILATION_CACHE_DIR', str(tmpdir))
+    assert flag_supported('gcc', '-fwrapv')
+    assert not flag_supported('gcc', '-fno-such-flag-exists')
+    flags = ['-fwrapv', '-fno-such-flag-exists', '-x', 'c', '-I/usr/include']
+    assert filter_flags('gcc', flags) == ['-fwrapv', '-x', 'c',
+                                          '-I/usr/include']
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+
+from pycompilation import compilation, src2obj
+from pycompilation.remote_cache import (
+    RemoteCache, RemoteCacheServer, set_remote_cache, cython_dependencies,
+    cython_key
+)
+
+
+def test_RemoteCache(tmpdir):
+    server = RemoteCacheServer(str(tmpdir))
+    try:
+        client = RemoteCache(server.start())
+        assert client.get('objects', 'abc') is None
+        assert client.put('objects', 'abc', b'data'*100)
+        assert client.flush(timeout=10)
+        assert client.get('objects', 'abc') == b'data'*100
+        # corrupted storage is detected
+        with open(os.path.join(str(tmpdir), 'objects', 'ab',
+                               'abc.meta'), 'wt') as ofh:
+            ofh.write('{"sha256": "0", "compression": "zlib"}')
+        assert client.get('objects', 'abc') is None
+    finally:
+        server.stop()
+
+
+def test_RemoteCache__unreachable():
+    client = RemoteCache('http://127.0.0.1:1', timeout=1, max_errors=2)
+    assert client.get('objects', 'abc') is None
+    assert client.get('objects', 'abc') is None
+    assert not client.available
+    assert not client.put('objects', 'abc', b'data')
+
+
+def test_src2obj__remote(tmpdir):
+    server = RemoteCacheServer()
+    client = RemoteCache(server.start())
+    set_remote_cache(client)
+    try:
+        objs = []
+        for name in ('a', 'b'):
+            d = tmpdir.mkdir(name)
+            d.join('f.c').write('double f(double x) { return 2*x; }\n')
+            objs.append(src2obj('f.c', cwd=str(d)))
+            client.flush(timeout=10)
+        assert os.listdir(os.path.join(server.directory, 'objects'))
+        assert tmpdir.join('a', objs[0]).read('rb') == \
+            tmpdir.join('b', objs[1]).read('rb')
+    finally:
+        set_remote_cache(None)
+        server.stop()
+
+
+def test_src2obj__no_remote(tmpdir, monkeypatch):
+    def object_key(runner):
+        raise AssertionError("preprocessed without an available remote")
+    monkeypatch.setattr(compilation, 'object_key', object_key)
+    tmpdir.join('f.c').write('double f(double x) { return 2*x; }\n')
+    set_remote_cache(None)
+    assert tmpdir.join(src2obj('f.c', cwd=str(tmpdir))).check()
+    client = RemoteCache('http://127.0.0.1:1', timeout=1, max_errors=1)
+    client.get('objects', 'abc')  # disables the client
+    set_remote_cache(client)
+    try:
+        assert tmpdir.join(src2obj('f.c', cwd=str(tmpdir))).check()
+    finally:
+        set_remote_cache(None)
+
+
+def test_cython_key(tmpdir):
+    tmpdir.join('helpers.pxd').write('cdef double twice(double x)\n')
+    tmpdir.join('consts.pxi').write('DEF N = 3\n')
+    tmpdir.join('mod.pyx').write('from helpers cimport twice\n'
+                                 'include "consts.pxi"\n')
+    assert sorted(map(os.path.basename, cython_dependencies(
+        str(tmpdir.join('mod.pyx'))))) == ['consts.pxi', 'helpers.pxd']
+    key = cython_key('mod.pyx', str(tmpdir), None, {})
+    tmpdir.join('helpers.pxd').write('cdef double twice(double)\n')
+    assert cython_key('mod.pyx', str(tmpdir), None, {}) != key
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import json
+
+from pycompilation.runners import parse_time_trace
+
+
+def test_parse_time_trace(tmpdir):
+    path = str(tmpdir.join('f.json'))
+    with open(path, 'wt') as ofh:
+        json.dump({'traceEvents': [
+            {'name': 'Source', 'ph': 'X', 'dur': 10},
+            {'name': 'Total Frontend', 'ph': 'X', 'dur': 2500000},
+            {'name': 'Total Backend', 'ph': 'X', 'dur': 500000},
+        ]}, ofh)
+    assert parse_time_trace(path) == {'Total Frontend': 2.5,
+                                      'Total Backend': 0.5}
+    assert parse_time_trace(str(tmpdir.join('missing.json'))) is None
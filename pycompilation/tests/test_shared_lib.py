@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import numpy as np
+import pytest
+
+from pycompilation.shared_lib import compile_link_load_strings
+
+_code = """
+void scale(int n, double * x, double f) {
+    for (int i=0; i<n; ++i) x[i] *= f;
+}
+
+double dot(int n, const double * x, const double * y) {
+    double s = 0;
+    for (int i=0; i<n; ++i) s += x[i]*y[i];
+    return s;
+}
+"""
+
+
+def test_compile_link_load_strings(tmpdir):
+    lib = compile_link_load_strings(
+        [('kernels.c', _code)],
+        ['void scale(int n, double * x, double f)',
+         'double dot(int n, const double * x, const double * y)'],
+        build_dir=str(tmpdir), std='c99')
+    x = np.arange(4.0)
+    lib.scale(4, x, 2.0)
+    assert np.allclose(x, [0, 2, 4, 6])
+    assert abs(lib.dot(3, [1, 2, 3], np.ones(3, dtype=np.float32)) - 6) < 1e-15
+    with pytest.raises(ValueError):
+        lib.scale(2, x[::2], 2.0)  # non-contiguous output
+
+
+def test_compile_link_load_strings__cffi(tmpdir):
+    pytest.importorskip('cffi')
+    lib = compile_link_load_strings(
+        [('kernels.c', _code)],
+        ['void scale(int n, double * x, double f)',
+         'double dot(int n, const double * x, const double * y)'],
+        build_dir=str(tmpdir), backend='cffi', std='c99')
+    assert lib.backend == 'cffi'
+    x = np.arange(4.0)
+    lib.scale(4, x, 2.0)
+    assert np.allclose(x, [0, 2, 4, 6])
+    assert abs(lib.dot(3, [1, 2, 3], np.ones(3, dtype=np.float32)) - 6) < 1e-15
+    with pytest.raises(ValueError):
+        lib.scale(2, x[::2], 2.0)  # non-contiguous output
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import pytest
+
+from pycompilation.split import split_code, shard_chunks
+
+_code = """#include <math.h>
+double a(double);
+/* pycompilation:split-begin */
+double a(double x) { return x; }
+/* pycompilation:split */
+double b(double x) { return 2*a(x); }
+// pycompilation:split
+double c(double x) { return 3*x; }
+/* pycompilation:split-end */
+double s(double x) { return a(x) + b(x) + c(x); }
+"""
+
+
+def test_split_code():
+    (header, hcode), (n0, c0), (n1, c1) = split_code('jac.c', _code, 2)
+    assert (header, n0, n1) == ('jac_split.h', 'jac_split0.c',
+                                'jac_split1.c')
+    assert 'double a(double);' in hcode
+    assert c0.startswith('#include "jac_split.h"\n')
+    assert 'double s(' in c0
+    assert sum(code_.count('return') for code_ in (c0, c1)) == 4
+    assert '#line 6 "jac.c"' in c0 + c1
+
+
+def test_split_code__unbalanced():
+    with pytest.raises(ValueError):
+        split_code('f.c', '/* pycompilation:split-begin */\nint x;\n', 2)
+
+
+def test_shard_chunks():
+    chunks = [[(1, 'x'*n)] for n in (5, 1, 4, 2)]
+    shards = shard_chunks(chunks, 2)
+    assert [sum(len(t) for c in s for _, t in c) for s in shards] == [6, 6]
+    assert len(shard_chunks(chunks, 10)) == 4
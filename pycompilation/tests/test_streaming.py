@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+
+import pytest
+
+from pycompilation.streaming import aligned_chunk_rows, stream_kernel
+
+np = pytest.importorskip('numpy')
+
+
+def test_aligned_chunk_rows():
+    assert aligned_chunk_rows(8, 10000, page_size=4096) == 1024
+    assert aligned_chunk_rows(24, 10, page_size=4096) == 512
+    assert aligned_chunk_rows(8192, 100000, page_size=4096) == 12
+
+
+def test_stream_kernel(tmpdir):
+    x = np.random.random((20000, 3))
+    src = os.path.join(str(tmpdir), 'x.npy')
+    np.save(src, x)
+    out = stream_kernel(np.multiply, [src, src], os.path.join(
+        str(tmpdir), 'y.npy'), chunk_bytes=4096, out_kwarg='out')
+    assert np.allclose(np.load(os.path.join(str(tmpdir), 'y.npy')), x*x)
+    assert isinstance(out, np.memmap)
+
+    weights = np.array([1.0, 2.0, 3.0, 2.0, 1.0])
+    stencil = stream_kernel(
+        lambda v: np.convolve(v, weights, 'same'), [x[:, 0].copy()],
+        os.path.join(str(tmpdir), 'z.npy'), overlap=2, chunk_bytes=4096,
+        prefetch=False)
+    assert np.allclose(stencil, np.convolve(x[:, 0], weights, 'same'))
+
+    with pytest.raises(ValueError):
+        stream_kernel(np.add, [x, x[:10]], os.path.join(str(tmpdir), 'e.npy'))
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import subprocess
+import sys
+
+from pycompilation import cache
+from pycompilation.compilation import compile_link_import_py_ext
+from pycompilation.support import build_support_library
+
+_helpers = """
+int triple(int x) { return 3*x; }
+"""
+
+_helpers_h = """
+int triple(int x);
+"""
+
+_wrapper = """
+cdef extern from "helpers.h":
+    int triple(int x)
+def py_triple(x):
+    return triple(x)
+"""
+
+
+def test_build_support_library(tmpdir):
+    root = str(tmpdir.join('cache'))
+    tmpdir.join('helpers.c').write(_helpers)
+    tmpdir.join('include', 'helpers.h').write(_helpers_h, ensure=True)
+    srcs, include_dirs = [str(tmpdir.join('helpers.c'))], [
+        str(tmpdir.join('include'))]
+    static = build_support_library(srcs, 'helpers', cache_dir=root,
+                                   include_dirs=include_dirs)
+    assert static.path.endswith('libhelpers.a')
+    assert build_support_library(srcs, 'helpers', cache_dir=root,
+                                 include_dirs=include_dirs) == static
+
+    shared = build_support_library(srcs, 'helpers', kind='shared',
+                                   cache_dir=root, include_dirs=include_dirs)
+    assert os.path.exists(shared.path)
+    for lib in (static, shared):
+        build_dir = str(tmpdir.join('build_' + lib.kind))
+        os.mkdir(build_dir)
+        tmpdir.join('_triple_{}.pyx'.format(lib.kind)).write(_wrapper)
+        libraries = ['m']
+        mod = compile_link_import_py_ext(
+            [str(tmpdir.join('_triple_{}.pyx'.format(lib.kind)))],
+            build_dir=build_dir, support_libraries=[lib],
+            libraries=libraries)
+        assert mod.py_triple(7) == 21
+        assert libraries == ['m']  # not extended by link_py_so
+
+    # extensions keep working when the cache entries are evicted
+    assert cache.clear(root) == 2
+    assert not os.path.exists(shared.path)
+    code = ('from pycompilation.util import import_module_from_file; '
+            'print(import_module_from_file({!r}).py_triple(5))'.format(
+                os.path.join(str(tmpdir.join('build_shared')),
+                             '_triple_shared')))
+    out = subprocess.check_output([sys.executable, '-c', code], env=dict(
+        os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+    assert out.decode('utf-8').strip() == '15'
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+
+import pytest
+
+from pycompilation.templating import render, render_to, template_renderer
+
+
+def test_render(tmpdir):
+    src = tmpdir.join('f.c.tmpl')
+    src.write('double f(void) { return %(val)s; }\n')
+    assert render(str(src), {'val': 3}) == 'double f(void) { return 3; }\n'
+    src.write('double f(void) { return ${val}; }\n')
+    assert render(str(src), {'val': 4}, 'string') == \
+        'double f(void) { return 4; }\n'
+    with pytest.raises(ValueError):
+        template_renderer('unknown')
+
+
+def test_render_to__unchanged(tmpdir):
+    src, dest = tmpdir.join('f.c.tmpl'), tmpdir.join('out', 'f.c')
+    src.write('int n = %(n)d;\n')
+    assert render_to(str(src), str(dest), {'n': 1})
+    os.utime(str(dest), (0, 0))
+    src.write('int n = %(n)d;\n')  # touched, same output: not written
+    assert not render_to(str(src), str(dest), {'n': 1}, only_update=True,
+                         prev_subsd={'n': 1})
+    assert os.path.getmtime(str(dest)) == 0
+    assert render_to(str(src), str(dest), {'n': 2})
+    assert dest.read() == 'int n = 2;\n'
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+
+from pycompilation import compile_link_import_strings
+from pycompilation.tuning import (
+    apply_config, autotune, get_tuned_config, tuning_key, _tuning_rw
+)
+from pycompilation.util import get_cache_dir
+
+
+def test_apply_config():
+    kwargs = {'flags': ['-g'], 'options': ['pic', 'openmp', 'fast'],
+              'std': 'c99'}
+    config = {'flags': ['-march=native'],
+              'options': ['pic', 'very-fast-imprecise'],
+              'preferred_vendor': 'gnu'}
+    res = apply_config(kwargs, config)
+    assert res == {'flags': ['-g', '-march=native'],
+                   'options': ['pic', 'openmp', 'very-fast-imprecise'],
+                   'std': 'c99', 'preferred_vendor': 'gnu'}
+    assert kwargs['flags'] == ['-g']
+    assert kwargs['options'] == ['pic', 'openmp', 'fast']
+
+
+def test_tuning_key():
+    assert tuning_key([('a.c', 'int a;')]) == tuning_key([('a.c', 'int a;')])
+    assert tuning_key([('a.c', 'int a;')]) != tuning_key([('a.c', 'int b;')])
+    assert tuning_key([('a.c', 'int a;')], {'options': ['pic', 'openmp']}) \
+        == tuning_key([('a.c', 'int a;')], {'options': ['openmp', 'pic'],
+                                            'logger': None})
+    assert tuning_key([('a.c', 'int a;')], {'options': ['pic']}) != \
+        tuning_key([('a.c', 'int a;')], {'options': ['pic', 'openmp']})
+
+
+_omp = """
+#include <omp.h>
+int max_threads(void) { return omp_get_max_threads(); }
+"""
+
+_omp_pyx = """
+cdef extern int max_threads()
+def py_max_threads():
+    return max_threads()
+"""
+
+
+def test_compile_link_import_strings_use_tuned(tmpdir, monkeypatch):
+    monkeypatch.setenv('PYCOMPILATION_CACHE_DIR', str(tmpdir.join('cache')))
+    codes = [('omp.c', _omp), ('omp_wrapper.pyx', _omp_pyx)]
+    kwargs = {'options': ['pic', 'openmp']}
+    tune_dir = get_cache_dir('tuning')
+    _tuning_rw.save_to_metadata_file(tune_dir, tuning_key(codes, kwargs), {
+        'options': ['pic', 'warn', 'fast'], 'flags': ['-DTUNED']})
+    mod = compile_link_import_strings(
+        codes, build_dir=str(tmpdir.join('build')), use_tuned=True, **kwargs)
+    assert mod.py_max_threads() >= 1  # links against libgomp
+    assert [d for d in os.listdir(str(tmpdir.join('build')))
+            if d.startswith('tuned_')]
+
+
+_variants = """
+double compute(void) {
+    volatile double s = 0;
+    long i, n = 1;
+#ifdef SLOW
+    n = 30000000;
+#endif
+#ifdef WRONG
+    return 2.0;
+#endif
+    for (i = 0; i < n; ++i)
+        s += 1;
+    return s > 0;
+}
+"""
+
+_variants_pyx = """
+cdef extern double compute()
+def py_compute():
+    return compute()
+"""
+
+
+def test_autotune(tmpdir):
+    codes = [('variants.c', _variants), ('variants_wrapper.pyx',
+                                         _variants_pyx)]
+    tune_dir = str(tmpdir)
+    kwargs = {'options': ['pic', 'warn']}
+    candidates = [{'flags': ['-DSLOW']}, {'flags': ['-DWRONG']},
+                  {'flags': ['-DFAST']}]
+    res = autotune(codes, lambda mod: mod.py_compute(), candidates,
+                   vendors=['gnu'], repeat=1, tune_dir=tune_dir, **kwargs)
+    assert res.config == {'flags': ['-DFAST'], 'preferred_vendor': 'gnu'}
+    assert [c['flags'] for c, _ in res.timings] == [['-DSLOW'], ['-DFAST']]
+    assert get_tuned_config(codes, kwargs, tune_dir=tune_dir) == res.config
+    assert get_tuned_config(codes, None, tune_dir=tune_dir) is None
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import pytest
+
+from pycompilation import compile_link_import_strings
+from pycompilation.ufuncs import parse_signature
+
+np = pytest.importorskip('numpy')
+
+_kernels = """
+#include <math.h>
+double sigmoid(double x, double lim) {
+    return x*pow(pow(x/lim, 8) + 1, -1./8.);
+}
+float sigmoidf(float x, float lim) {
+    return x*powf(powf(x/lim, 8) + 1, -1.f/8.f);
+}
+void polar(double x, double y, double * r, double * phi) {
+    *r = sqrt(x*x + y*y);
+    *phi = atan2(y, x);
+}
+void matvec(int m, int n, const double * a, const double * x, double * y) {
+    int i, j;
+    for (i = 0; i < m; ++i) {
+        y[i] = 0;
+        for (j = 0; j < n; ++j)
+            y[i] += a[i*n + j]*x[j];
+    }
+}
+"""
+
+
+def test_parse_signature():
+    assert parse_signature('(n),(n)->()') == ([('n',), ('n',)], [()], ['n'])
+    with pytest.raises(ValueError):
+        parse_signature('(n)')
+
+
+def test_compile_link_import_strings_ufuncs(tmpdir):
+    mod = compile_link_import_strings(
+        [('sigmoid.c', _kernels)], build_dir=str(tmpdir),
+        options=['pic', 'warn'], std='c99', ufuncs={
+            'sigmoid': ['double sigmoid(double x, double lim)',
+                        'float sigmoidf(float x, float lim)'],
+            'polar': 'void polar(double, double, double *, double *)',
+            'matvec': dict(signature='(m,n),(n)->(m)', prototypes=[
+                'void matvec(int m, int n, const double * a, '
+                'const double * x, double * y)']),
+        })
+
+    def ref(x, lim):
+        return x/((x/lim)**8 + 1)**(1/8.)
+
+    assert isinstance(mod.sigmoid, np.ufunc)
+    assert mod.sigmoid.types == ['dd->d', 'ff->f']
+    x = np.linspace(0, 500, 21)
+    assert np.allclose(mod.sigmoid(x[::3], 350.0), ref(x[::3], 350.0))
+    lims = np.array([[100.0], [200.0]])
+    out = np.empty((2, 21))
+    assert mod.sigmoid(x, lims, out=out) is out
+    assert np.allclose(out, ref(x, lims))
+    res32 = mod.sigmoid(x.astype(np.float32), np.float32(350))
+    assert res32.dtype == np.float32
+    assert np.allclose(res32, ref(x, 350.0), rtol=1e-5)
+
+    r, phi = mod.polar(np.ones(3), np.arange(3.0))
+    assert np.allclose(r, np.hypot(1, np.arange(3.0)))
+
+    a = np.random.random((3, 4, 5))
+    v = np.random.random(10)
+    assert np.allclose(mod.matvec(a, v[::2]), a @ v[::2])
+    assert np.allclose(mod.matvec(a[0].T.copy().T, v[:5]), a[0] @ v[:5])
+    out = np.empty((4, 3)).T
+    mod.matvec(a, v[:5], out=out)
+    assert np.allclose(out, a @ v[:5])
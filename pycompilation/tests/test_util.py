@@ -2,8 +2,27 @@
 
 from __future__ import print_function, division, absolute_import
 
-from pycompilation.util import uniquify
+import os
+
+from pycompilation.util import uniquify, glob_at_depth, get_directory_index
 
 
 def test_uniquify():
     assert uniquify([1, 1, 2, 2]) == [1, 2]
+
+
+def test_get_directory_index(tmpdir):
+    for path in ('a.c', 'sub/b.c', 'sub/deep/c.c', 'sub/d.h', '.git/e.c',
+                 'build/f.c'):
+        tmpdir.join(path).ensure()
+    index = get_directory_index(str(tmpdir))
+    assert index.glob_at_depth('*.c') == [
+        'a.c', os.path.join('sub', 'b.c'),
+        os.path.join('sub', 'deep', 'c.c')]
+    assert index.glob('sub/*.[ch]') == [os.path.join('sub', 'b.c'),
+                                        os.path.join('sub', 'd.h')]
+    assert index.refresh() == 0  # nothing changed
+    tmpdir.join('sub', 'deep', 'g.c').ensure()
+    assert index.refresh() == 1
+    assert glob_at_depth('g.c', str(tmpdir)) == [
+        str(tmpdir.join('sub', 'deep', 'g.c'))]
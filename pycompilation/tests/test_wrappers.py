@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import pytest
+
+from pycompilation import compile_link_import_strings
+from pycompilation.wrappers import parse_fortran_interfaces
+
+np = pytest.importorskip('numpy')
+
+_mtxmul = """
+module mtxmul
+use iso_c_binding, only: c_double, c_int
+implicit none
+contains
+subroutine do_mtxmul(m, n, o, A, B, Out) bind(c)
+  integer(c_int), intent(in) :: m, n, o
+  real(c_double), intent(in) :: A(m,n), B(n,o)
+  real(c_double), intent(inout) :: Out(m,o)
+  Out = matmul(A,B)
+end subroutine
+function total(n, x) result(r) bind(c, name="vec_total")
+  integer(c_int), value, intent(in) :: n
+  real(c_double), intent(in), dimension(n) :: x  ! comment
+  real(c_double) :: r
+  r = sum(x)
+end function
+end module
+"""
+
+_rowsum = """
+void rowsum(int m, int n, const float * a, float * s, int * count) {
+    int i, j;
+    for (i = 0; i < m; ++i) {
+        s[i] = 0;
+        for (j = 0; j < n; ++j)
+            s[i] += a[i*n + j];
+    }
+    *count = m*n;
+}
+"""
+
+
+def test_parse_fortran_interfaces():
+    mtxmul, total = parse_fortran_interfaces(_mtxmul)
+    assert mtxmul.name == 'do_mtxmul'
+    assert [(a.name, a.pointer, a.const) for a in mtxmul.prototype.args] == [
+        ('m', True, True), ('n', True, True), ('o', True, True),
+        ('A', True, True), ('B', True, True), ('Out', True, False)]
+    assert mtxmul.shapes['Out'] == ('m', 'o')
+    assert mtxmul.inout == ('Out',)
+    assert total.name == 'vec_total'
+    assert total.prototype.restype == 'double'
+    assert total.shapes == {'x': ('n',)}
+
+
+def test_compile_link_import_strings_wrappers_fortran(tmpdir):
+    mod = compile_link_import_strings(
+        [('mtxmul.f90', _mtxmul)], build_dir=str(tmpdir), wrappers=True,
+        options=['pic', 'warn'])
+    A = np.asfortranarray(np.random.random((3, 4)))
+    B = np.asfortranarray(np.random.random((4, 5)))
+    assert np.allclose(mod.do_mtxmul(A, B), A.dot(B))
+    out = np.empty((3, 5), order='F')
+    assert np.allclose(mod.do_mtxmul(A, B, Out=out), A.dot(B))
+    assert np.allclose(out, A.dot(B))
+    with pytest.raises(ValueError):
+        mod.do_mtxmul(np.ascontiguousarray(A), B)  # no silent copies
+    with pytest.raises(ValueError):
+        mod.do_mtxmul(A, A)
+    x = np.arange(5.0)
+    x.flags.writeable = False
+    assert mod.vec_total(x) == 10.0
+
+
+def test_compile_link_import_strings_wrappers_c(tmpdir):
+    mod = compile_link_import_strings(
+        [('rowsum.c', _rowsum)], build_dir=str(tmpdir), wrappers={
+            'rowsum': dict(prototype='void rowsum(int m, int n, '
+                                     'const float * a, float * s, '
+                                     'int * count)',
+                           shapes={'a': ('m', 'n'), 's': ('m',),
+                                   'count': ()})},
+        options=['pic', 'warn'])
+    s, count = mod.rowsum(np.ones((2, 3), dtype=np.float32))
+    assert s.tolist() == [3.0, 3.0] and count == 6
+    with pytest.raises(ValueError):
+        mod.rowsum(np.ones((2, 3), dtype=np.float32),
+                   s=np.empty(3, dtype=np.float32))
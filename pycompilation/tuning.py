@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+"""
+Empirical tuning of compiler choice and optimization flags.
+
+`autotune` builds variants of a set of code strings (see
+`compile_link_import_strings`) across candidate option sets and the
+compilers found on the system, times them using a user provided benchmark
+callable and persists the fastest variant which stays within a numerical
+tolerance. The winner is keyed by a hash of the sources, the keyword
+arguments and the CPU model and is picked up by later calls to
+`compile_link_import_strings` passing ``use_tuned=True``.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import shutil
+import tempfile
+from collections import namedtuple
+from timeit import default_timer
+
+from .cpu import cpu_model
+from .runners import CCompilerRunner
+from .util import (
+    CompilationError, MetaReaderWriter, FileNotFoundError,
+    find_binary_of_command, get_cache_dir, md5_of_string
+)
+
+
+default_candidates = (
+    {'options': ['pic', 'warn', 'fast']},
+    {'options': ['pic', 'warn', 'very-fast-imprecise']},
+    {'options': ['pic', 'warn', 'fast'],
+     'flags': ['-march=native']},
+    {'options': ['pic', 'warn', 'very-fast-imprecise'],
+     'flags': ['-march=native']},
+    {'options': ['pic', 'warn', 'fast'],
+     'flags': ['-funroll-loops', '-ftree-vectorize']},
+)
+
+TuningResult = namedtuple('TuningResult', 'config time timings')
+
+_tuning_rw = MetaReaderWriter('.metadata_tuning')
+
+
+# Options selecting the optimization level, a tuned one replaces these
+optimization_options = ('fast', 'very-fast-imprecise')
+
+# Keyword arguments not affecting the build
+_untuned_kwargs = ('logger', 'only_update')
+
+
+def tuning_key(codes, kwargs=None):
+    """
+    Returns a hex digest identifying code strings, the keyword arguments
+    they are built with and the CPU model.
+
+    Parameters
+    ----------
+    codes: iterable of name/source pair tuples
+    kwargs: dict
+        keyword arguments of `compile_link_import_strings` (entries
+        which are None and those in ``_untuned_kwargs`` are ignored)
+    """
+    md = md5_of_string(cpu_model().encode('utf-8'))
+    for name, code_ in codes:
+        md.update(name.encode('utf-8'))
+        md.update(md5_of_string(code_.encode('utf-8')).digest())
+    relevant = sorted((k, sorted(v) if k == 'options' else v) for k, v in (
+        kwargs or {}).items() if v is not None and k not in _untuned_kwargs)
+    md.update(repr(relevant).encode('utf-8'))
+    return md.hexdigest()
+
+
+def available_vendors(CompilerRunner_=CCompilerRunner):
+    """ Returns the vendors for which a compiler binary can be located. """
+    vendors = []
+    for vendor, binary in CompilerRunner_.compiler_dict.items():
+        try:
+            find_binary_of_command([binary])
+        except RuntimeError:
+            continue
+        vendors.append(vendor)
+    return vendors
+
+
+def apply_config(kwargs, config):
+    """
+    Returns a copy of `kwargs` updated with a tuning configuration:
+    'options' are merged (a tuned optimization level, see
+    `optimization_options`, replaces the caller's), 'flags' are appended
+    and other entries (e.g. 'preferred_vendor') are replaced.
+    """
+    kwargs = dict(kwargs)
+    for k, v in config.items():
+        if k == 'flags':
+            kwargs['flags'] = list(kwargs.get('flags', None) or []) + list(v)
+        elif k == 'options':
+            options = list(kwargs.get('options', None) or [])
+            if any(opt in optimization_options for opt in v):
+                options = [opt for opt in options
+                           if opt not in optimization_options]
+            kwargs['options'] = options + [opt for opt in v
+                                           if opt not in options]
+        else:
+            kwargs[k] = v
+    return kwargs
+
+
+def get_tuned_config(codes, kwargs=None, tune_dir=None):
+    """
+    Returns the persisted configuration for `codes` (built with kwargs)
+    on this CPU model, or None if no tuning has been recorded.
+    """
+    tune_dir = tune_dir or get_cache_dir('tuning')
+    try:
+        return _tuning_rw.get_from_metadata_file(
+            tune_dir, tuning_key(codes, kwargs))
+    except (FileNotFoundError, KeyError):
+        return None
+
+
+def _within_tolerance(result, reference, rtol, atol):
+    import numpy as np
+    return np.allclose(result, reference, rtol=rtol, atol=atol)
+
+
+def autotune(codes, benchmark, candidates=None, vendors=None, rtol=1e-7,
+             atol=0.0, repeat=3, check=None, tune_dir=None, persist=True,
+             logger=None, **kwargs):
+    """
+    Builds and times variants of `codes`, persists and returns the fastest.
+
+    Parameters
+    ----------
+    codes: iterable of name/source pair tuples
+        passed onto `compile_link_import_strings`
+    benchmark: callable
+        called with an imported variant as its only argument, its return
+        value is compared against that of the first (reference) variant.
+    candidates: iterable of dicts
+        option sets (keys: 'options', 'flags', ...) merged into kwargs,
+        the first one is the reference. default: ``default_candidates``
+    vendors: iterable of strings
+        compiler vendors to try (default: those with a C compiler found)
+    rtol: float
+        relative tolerance of results compared to the reference.
+    atol: float
+        absolute tolerance of results compared to the reference.
+    repeat: int
+        number of timings per variant (the best one is used).
+    check: callable
+        signature ``check(result, reference) -> bool``, overrides the
+        default comparison (``numpy.allclose`` using rtol & atol).
+    tune_dir: path string
+        where to persist the winner. default: ``get_cache_dir('tuning')``
+    persist: bool
+        store the winner for later calls to `compile_link_import_strings`.
+    logger: logging.Logger
+        info level used.
+    **kwargs:
+        keyword arguments passed onto `compile_link_import_strings`
+
+    Returns
+    -------
+    TuningResult instance with fields: config (dict), time (float) and
+    timings (list of (config, time) pairs of all successful variants).
+    """
+    from .compilation import compile_link_import_strings
+    codes = list(codes)
+    candidates = list(candidates or default_candidates)
+    if vendors is None:
+        vendors = available_vendors()
+    check = check or (lambda res, ref: _within_tolerance(res, ref, rtol, atol))
+
+    timings = []
+    reference = None
+    build_dirs = []
+    try:
+        for vendor in vendors:
+            for candidate in candidates:
+                config = dict(candidate, preferred_vendor=vendor)
+                build_dir = tempfile.mkdtemp(prefix='pycompilation_tune_')
+                build_dirs.append(build_dir)
+                try:
+                    mod = compile_link_import_strings(
+                        codes, build_dir=build_dir, use_tuned=False,
+                        **apply_config(kwargs, config))
+                except (CompilationError, RuntimeError, ValueError) as exc:
+                    if logger:
+                        logger.info("Skipping {}: {}".format(config, exc))
+                    continue
+                best = None
+                for _ in range(repeat):
+                    t0 = default_timer()
+                    result = benchmark(mod)
+                    elapsed = default_timer() - t0
+                    best = elapsed if best is None else min(best, elapsed)
+                if reference is None:
+                    reference = result
+                elif not check(result, reference):
+                    if logger:
+                        logger.info("Rejecting {} (outside tolerance)".format(
+                            config))
+                    continue
+                if logger:
+                    logger.info("{}: {:.3g} s".format(config, best))
+                timings.append((config, best))
+    finally:
+        for build_dir in build_dirs:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    if not timings:
+        raise CompilationError("No candidate configuration could be built.")
+    config, best = min(timings, key=lambda x: x[1])
+    if persist:
+        tune_dir = tune_dir or get_cache_dir('tuning')
+        _tuning_rw.save_to_metadata_file(
+            tune_dir, tuning_key(codes, kwargs), config)
+    return TuningResult(config, best, timings)
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+
+"""
+Generation of NumPy ufuncs (and gufuncs) from scalar C kernels.
+
+Given the prototypes of C functions, inner loops calling them are
+generated (in C, so that kernels defined in the C code strings can be
+inlined and vectorized) together with a Cython module registering one
+ufunc per name. NumPy then provides broadcasting, strided input,
+``out=``, dtype dispatch (one loop per prototype) and buffering::
+
+    mod = compile_link_import_strings([('sigmoid.c', code)], ufuncs={
+        'sigmoid': ['double sigmoid(double x, double lim)',
+                    'float sigmoidf(float x, float lim)']}, std='c99')
+    mod.sigmoid(np.linspace(0, 1), 350.0)
+
+Elementwise kernels take their inputs as scalars and return their (first)
+output, further outputs are passed as non-const pointers, e.g.
+``void sincos(double x, double * s, double * c)``.
+
+Generalized ufuncs are described by a dict with a core signature, the
+kernel takes the core dimensions (in order of first appearance) followed
+by one pointer per operand (C contiguous, non-contiguous operands are
+copied)::
+
+    ufuncs={'dot': dict(signature='(n),(n)->()', prototypes=[
+        'void dot(int n, const double * x, const double * y, double * out)'
+    ])}
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import re
+from collections import OrderedDict, namedtuple
+
+from .prototypes import (
+    ctype_dtype_char, cython_target, format_prototype, parse_prototype
+)
+
+UfuncSpec = namedtuple('UfuncSpec', 'name prototypes signature doc identity')
+
+# Values of the identity argument mapped to NumPy's constants
+identities = OrderedDict([
+    (None, 'PyUFunc_None'),
+    (0, 'PyUFunc_Zero'),
+    (1, 'PyUFunc_One'),
+    ('reorderable', 'PyUFunc_ReorderableNone'),
+])
+
+_core_re = re.compile(r'\(([^()]*)\)')
+_signature_re = re.compile(
+    r'^\s*(\(\s*\w*(\s*,\s*\w+)*\s*\)\s*,\s*)*\(\s*\w*(\s*,\s*\w+)*\s*\)\s*->'
+    r'\s*(\(\s*\w*(\s*,\s*\w+)*\s*\)\s*,\s*)*\(\s*\w*(\s*,\s*\w+)*\s*\)\s*$')
+
+
+def parse_signature(signature):
+    """
+    Parses a gufunc core signature.
+
+    Returns
+    -------
+    (inputs, outputs, dims): inputs and outputs are lists of tuples of
+    core dimension names (one per operand), dims lists the unique names in
+    order of first appearance.
+
+    Examples
+    --------
+    >>> parse_signature('(m,n),(n)->(m)')
+    ([('m', 'n'), ('n',)], [('m',)], ['m', 'n'])
+    """
+    if not _signature_re.match(signature):
+        raise ValueError("Invalid gufunc signature: {}".format(signature))
+    ins, outs = signature.split('->')
+    operands = [[tuple(d.strip() for d in core.split(',') if d.strip())
+                 for core in _core_re.findall(part)] for part in (ins, outs)]
+    dims = []
+    for core in operands[0] + operands[1]:
+        for d in core:
+            if d not in dims:
+                dims.append(d)
+    return operands[0], operands[1], dims
+
+
+def _spec(name, value):
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, dict):
+        value = dict(prototypes=value)
+    unknown = set(value) - set(UfuncSpec._fields)
+    if unknown:
+        raise ValueError("Unknown ufunc keys for {}: {}".format(
+            name, ', '.join(sorted(unknown))))
+    prototypes = value['prototypes']
+    if isinstance(prototypes, str):
+        prototypes = [prototypes]
+    identity = value.get('identity', None)
+    if identity not in identities:
+        raise ValueError("Unsupported identity for {}: {!r}".format(
+            name, identity))
+    return UfuncSpec(name, [parse_prototype(p) for p in prototypes],
+                     value.get('signature', None), value.get('doc', None),
+                     identity)
+
+
+def _elementwise_operands(spec, proto):
+    """ Returns (inputs, outputs): lists of (ctype, expression-kind) """
+    ins, outs = [], []
+    if proto.restype != 'void':
+        outs.append((proto.restype, 'return'))
+    for a in proto.args:
+        if not a.pointer:
+            ins.append((a.ctype, 'value'))
+        elif a.const:
+            raise ValueError("Elementwise kernel {} of {} takes a const "
+                             "pointer ({}), use a gufunc signature".format(
+                                 proto.name, spec.name, a.name))
+        else:
+            outs.append((a.ctype, 'pointer'))
+    if not ins or not outs:
+        raise ValueError("Kernel {} of {} needs inputs and outputs".format(
+            proto.name, spec.name))
+    return ins, outs
+
+
+def _gufunc_operands(spec, proto):
+    """ Returns (core dimension ctypes, operand ctypes) """
+    inputs, outputs, dims = parse_signature(spec.signature)
+    if proto.restype != 'void':
+        raise ValueError("gufunc kernel {} of {} should return void".format(
+            proto.name, spec.name))
+    ndims, nops = len(dims), len(inputs) + len(outputs)
+    args = proto.args
+    if len(args) != ndims + nops or any(a.pointer for a in args[:ndims]) or \
+       not all(a.pointer for a in args[ndims:]):
+        raise ValueError(
+            "Kernel {} of {} should take {} core dimension(s) followed by {} "
+            "pointer(s) (signature {})".format(
+                proto.name, spec.name, ndims, nops, spec.signature))
+    if any(ctype_dtype_char[a.ctype] in 'fdg' for a in args[:ndims]):
+        raise ValueError("Core dimensions of {} must be integers".format(
+            proto.name))
+    for a in args[ndims + len(inputs):]:
+        if a.const:
+            raise ValueError("Output {} of {} is const".format(
+                a.name, proto.name))
+    return [a.ctype for a in args[:ndims]], [a.ctype for a in args[ndims:]]
+
+
+def _loop_name(spec, idx):
+    return '_pyc_ufunc_{}_{}'.format(spec.name, idx)
+
+
+_loop_head = ('void {}(char **args, const ptrdiff_t *dims, '
+              'const ptrdiff_t *steps, void *data)')
+
+
+def elementwise_loop(spec, idx, proto):
+    """ Returns C source of the inner loop calling proto """
+    ins, outs = _elementwise_operands(spec, proto)
+    types = [t for t, _ in ins] + [t for t, _ in outs]
+    nin = len(ins)
+
+    def call(ptr):
+        args, k_in, k_out = [], 0, nin + (outs[0][1] == 'return')
+        for a in proto.args:
+            if a.pointer:
+                args.append('&' + ptr(k_out, a.ctype))
+                k_out += 1
+            else:
+                args.append(ptr(k_in, a.ctype))
+                k_in += 1
+        expr = '{}({})'.format(proto.name, ', '.join(args))
+        if outs[0][1] == 'return':
+            expr = '{} = {}'.format(ptr(nin, proto.restype), expr)
+        return expr + ';'
+
+    contig = ' && '.join('steps[{}] == sizeof({})'.format(k, t)
+                         for k, t in enumerate(types))
+    lines = [_loop_head.format(_loop_name(spec, idx)), '{',
+             '    const ptrdiff_t n = dims[0];', '    ptrdiff_t i;',
+             '    (void)data;',
+             '    if ({}) {{'.format(contig)]
+    for k, t in enumerate(types):
+        lines.append('        {0}{1} * const p{2} = ({0}{1} *)args[{2}];'
+                     .format('const ' if k < nin else '', t, k))
+    lines += ['        for (i = 0; i < n; ++i)',
+              '            ' + call(lambda k, t: 'p{}[i]'.format(k)),
+              '    } else {',
+              '        for (i = 0; i < n; ++i)',
+              '            ' + call(lambda k, t: (
+                  '*({}{} *)(args[{}] + i*steps[{}])'.format(
+                      'const ' if k < nin else '', t, k, k))),
+              '    }', '}']
+    return '\n'.join(lines)
+
+
+def gufunc_loop(spec, idx, proto):
+    """
+    Returns C source of the generalized inner loop calling proto, core
+    operands which are not C contiguous are copied to buffers.
+    """
+    inputs, outputs, dims = parse_signature(spec.signature)
+    dim_types, types = _gufunc_operands(spec, proto)
+    cores = inputs + outputs
+    nops, nin = len(cores), len(inputs)
+    lines = [_loop_head.format(_loop_name(spec, idx)), '{',
+             '    const ptrdiff_t n = dims[0];',
+             '    const ptrdiff_t *core_steps = steps + {};'.format(nops),
+             '    ptrdiff_t i;']
+    decls, setup, operands, pre, post, cleanup = [], [], [], [], [], []
+    offset = 0
+    for k, (core, t) in enumerate(zip(cores, types)):
+        shape = ['dims[{}]'.format(1 + dims.index(d)) for d in core]
+        if not core:
+            operands.append('        {0} *a{1} = ({0} *)(args[{1}] + '
+                            'i*steps[{1}]);'.format(t, k))
+            continue
+        decls += ['    ptrdiff_t shape{}[{}];'.format(k, len(core)),
+                  '    ptrdiff_t buf_steps{}[{}];'.format(k, len(core)),
+                  '    {} *buf{} = NULL;'.format(t, k),
+                  '    int contig{};'.format(k)]
+        for j, s in enumerate(shape):
+            setup.append('    shape{}[{}] = {};'.format(k, j, s))
+        setup += ['    contig{0} = _pyc_c_contiguous(shape{0}, '
+                  'core_steps + {1}, {2}, sizeof({3}), buf_steps{0});'.format(
+                      k, offset, len(core), t),
+                  '    if (!contig{0}) {{'.format(k),
+                  '        buf{0} = ({1} *)malloc(sizeof({1})*_pyc_size('
+                  'shape{0}, {2}));'.format(k, t, len(core)),
+                  '        if (buf{} == NULL) goto done;'.format(k),
+                  '    }']
+        cleanup.append('    free(buf{});'.format(k))
+        operands.append('        {0} *a{1} = contig{1} ? ({0} *)(args[{1}] + '
+                        'i*steps[{1}]) : buf{1};'.format(t, k))
+        copy = ('_pyc_copy({dst}, {dst_steps}, {src}, {src_steps}, shape{k}, '
+                '{ndim}, sizeof({t}));')
+        if k < nin:
+            pre.append('        if (!contig{0}) '.format(k) + copy.format(
+                dst='(char *)buf{}'.format(k),
+                dst_steps='buf_steps{}'.format(k),
+                src='args[{0}] + i*steps[{0}]'.format(k),
+                src_steps='core_steps + {}'.format(offset), k=k,
+                ndim=len(core), t=t))
+        else:
+            post.append('        if (!contig{0}) '.format(k) + copy.format(
+                dst='args[{0}] + i*steps[{0}]'.format(k),
+                dst_steps='core_steps + {}'.format(offset),
+                src='(const char *)buf{}'.format(k),
+                src_steps='buf_steps{}'.format(k), k=k, ndim=len(core), t=t))
+        offset += len(core)
+    call = '        {}({});'.format(proto.name, ', '.join(
+        ['({})dims[{}]'.format(dt, 1 + j) for j, dt in enumerate(dim_types)] +
+        ['a{}'.format(k) for k in range(nops)]))
+    lines += decls + ['    (void)data;'] + setup
+    lines += ['    for (i = 0; i < n; ++i) {'] + operands + pre + [call] + \
+        post + ['    }']
+    if cleanup:
+        lines += ['done:'] + cleanup
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+_helpers = r"""
+static ptrdiff_t _pyc_size(const ptrdiff_t *shape, int ndim)
+{
+    ptrdiff_t size = 1;
+    int j;
+    for (j = 0; j < ndim; ++j)
+        size *= shape[j];
+    return size;
+}
+
+/* C contiguous strides of shape in buf_steps, returns whether steps match */
+static int _pyc_c_contiguous(const ptrdiff_t *shape, const ptrdiff_t *steps,
+                             int ndim, ptrdiff_t itemsize,
+                             ptrdiff_t *buf_steps)
+{
+    int j, contig = 1;
+    for (j = ndim - 1; j >= 0; --j) {
+        buf_steps[j] = itemsize;
+        if (shape[j] > 1 && steps[j] != itemsize)
+            contig = 0;
+        itemsize *= shape[j];
+    }
+    return contig;
+}
+
+static void _pyc_copy(char *dst, const ptrdiff_t *dst_steps, const char *src,
+                      const ptrdiff_t *src_steps, const ptrdiff_t *shape,
+                      int ndim, size_t itemsize)
+{
+    ptrdiff_t i;
+    for (i = 0; i < shape[0]; ++i) {
+        if (ndim == 1)
+            memcpy(dst + i*dst_steps[0], src + i*src_steps[0], itemsize);
+        else
+            _pyc_copy(dst + i*dst_steps[0], dst_steps + 1,
+                      src + i*src_steps[0], src_steps + 1, shape + 1,
+                      ndim - 1, itemsize);
+    }
+}
+"""
+
+
+def loops_code(specs, includes=()):
+    """
+    Returns C source of the inner loops of specs (UfuncSpec instances),
+    includes are (quoted) headers/sources defining the kernels.
+    """
+    lines = ['/* Generated by pycompilation.ufuncs, do not edit. */',
+             '#include <stddef.h>', '#include <stdlib.h>',
+             '#include <string.h>']
+    lines += ['#include "{}"'.format(inc) for inc in includes]
+    lines.append('')
+    for proto in OrderedDict((p.name, p) for s in specs
+                             for p in s.prototypes).values():
+        lines.append(format_prototype(proto) + ';')
+    if any(s.signature for s in specs):
+        lines.append(_helpers)
+    for spec in specs:
+        for idx, proto in enumerate(spec.prototypes):
+            lines += ['', (gufunc_loop if spec.signature else
+                           elementwise_loop)(spec, idx, proto)]
+    return '\n'.join(lines) + '\n'
+
+
+def _dtype_chars(spec, proto):
+    if spec.signature:
+        types = _gufunc_operands(spec, proto)[1]
+    else:
+        ins, outs = _elementwise_operands(spec, proto)
+        types = [t for t, _ in ins + outs]
+    return ''.join(ctype_dtype_char[t] for t in types)
+
+
+def registration_code(specs, header):
+    """
+    Returns Cython source creating one ufunc per spec (module attributes
+    named after the specs) from the loops declared in header.
+    """
+    lines = ['', '# Generated by pycompilation.ufuncs, do not edit.',
+             'cimport numpy as _pyc_cnp', 'import numpy as _pyc_np', '',
+             '_pyc_cnp.import_array()', '_pyc_cnp.import_ufunc()', '',
+             'cdef extern from "numpy/ufuncobject.h":']
+    lines += ['    int {}'.format(v) for v in identities.values()]
+    lines += ['', 'cdef extern from "{}":'.format(header)]
+    for spec in specs:
+        for idx in range(len(spec.prototypes)):
+            lines.append('    void {}(char **, _pyc_cnp.npy_intp *, '
+                         '_pyc_cnp.npy_intp *, void *)'.format(
+                             _loop_name(spec, idx)))
+    for spec in specs:
+        chars = [_dtype_chars(spec, p) for p in spec.prototypes]
+        if len(set(map(len, chars))) != 1:
+            raise ValueError("Prototypes of {} differ in number of operands"
+                             .format(spec.name))
+        if spec.signature:
+            inputs, outputs, _ = parse_signature(spec.signature)
+            nin, nout = len(inputs), len(outputs)
+        else:
+            nin, nout = (len(x) for x in _elementwise_operands(
+                spec, spec.prototypes[0]))
+        ntypes = len(chars)
+        v = '_pyc_{}_'.format(spec.name)
+        lines += ['', 'cdef _pyc_cnp.PyUFuncGenericFunction {}funcs[{}]'
+                  .format(v, ntypes),
+                  'cdef void *{}data[{}]'.format(v, ntypes),
+                  'cdef char {}types[{}]'.format(v, ntypes*(nin + nout))]
+        for idx in range(ntypes):
+            lines += ['{}funcs[{}] = <_pyc_cnp.PyUFuncGenericFunction>{}'
+                      .format(v, idx, _loop_name(spec, idx)),
+                      '{}data[{}] = NULL'.format(v, idx)]
+        lines += ['for _pyc_i, _pyc_c in enumerate({!r}):'.format(
+            ''.join(chars)),
+                  '    {}types[_pyc_i] = _pyc_np.dtype(_pyc_c).num'.format(v)]
+        doc = spec.doc or '{} ufunc of {}'.format(
+            'Generalized ' + spec.signature if spec.signature else
+            'Elementwise', ', '.join(p.name for p in spec.prototypes))
+        lines.append(
+            '{} = _pyc_cnp.PyUFunc_FromFuncAndDataAndSignature({}funcs, '
+            '{}data, {}types, {}, {}, {}, {}, {!r}, {!r}, 0, {})'.format(
+                spec.name, v, v, v, ntypes, nin, nout,
+                identities[spec.identity], spec.name.encode('utf-8'),
+                doc.encode('utf-8'), 'NULL' if spec.signature is None else
+                repr(spec.signature.encode('utf-8'))))
+    return '\n'.join(lines) + '\n'
+
+
+def ufunc_codes(codes, ufuncs, extname=None):
+    """
+    Adds ufunc inner loops and their registration to code strings (see
+    module docstring).
+
+    C code strings are included by the generated loops (their names get
+    the suffix '.inc' so they are not compiled separately) letting the
+    compiler inline the kernels. The registration is appended to the last
+    code string if it is a Cython source, otherwise a Cython source named
+    after extname is added.
+
+    Parameters
+    ----------
+    codes: iterable of name/source pair tuples
+    ufuncs: dict
+        ufunc names mapped to a prototype string, a list of them (one
+        inner loop per prototype, i.e. per set of dtypes) or a dict with
+        the keys 'prototypes', 'signature' (for gufuncs, e.g.
+        '(n),(n)->()'), 'doc' and 'identity' (None, 0, 1 or
+        'reorderable', used by ``reduce``).
+    extname: string
+        name of the extension module, default: taken from the last code
+        string
+
+    Returns
+    -------
+    (codes, extname)
+    """
+    codes = list(codes)
+    specs = [_spec(name, value) for name, value in sorted(ufuncs.items())]
+    pyx_last, extname = cython_target(codes, extname, '_ufuncs',
+                                      renamed=('.c',))
+
+    result, includes = [], []
+    for name, code_ in codes:
+        if os.path.splitext(name)[1] == '.c':
+            name += '.inc'
+            includes.append(name)
+        result.append((name, code_))
+    base = '_pyc_' + extname + '_loops'
+    if '{}.c'.format(base) in [n for n, _ in result]:
+        raise ValueError("Name clash with generated loops: {}.c".format(base))
+    loops = [(base + '.h', '#include <stddef.h>\n' + ''.join(
+        _loop_head.format(_loop_name(s, i)) + ';\n'
+        for s in specs for i in range(len(s.prototypes)))),
+        (base + '.c', loops_code(specs, includes))]
+    registration = registration_code(specs, base + '.h')
+    if pyx_last:
+        name, code_ = result.pop()
+        result += loops + [(name, code_ + '\n' + registration)]
+    else:
+        result += loops + [(extname + '.pyx', registration)]
+    return result, extname
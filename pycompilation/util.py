@@ -6,6 +6,7 @@ import fnmatch
 import os
 import pickle
 import shutil
+import threading
 
 from collections import namedtuple
 from hashlib import md5
@@ -48,15 +49,146 @@ Glob = namedtuple('Glob', 'pathname')
 ArbitraryDepthGlob = namedtuple('ArbitraryDepthGlob', 'filename')
 
 
+# Directories skipped by DirectoryIndex (fnmatch patterns of names)
+default_ignore = ('.git', '.hg', '.svn', '.bzr', '__pycache__', '.tox',
+                  '.nox', '.eggs', '*.egg-info', '.mypy_cache',
+                  '.pytest_cache', 'node_modules', 'build', 'dist')
+
+
+class DirectoryIndex(object):
+    """
+    Index of the files below a root directory built in a single pass
+    (using os.scandir), answering `Glob` and `ArbitraryDepthGlob` queries.
+
+    `refresh` only re-lists directories whose modification time changed
+    (one stat per directory), see `get_directory_index`.
+
+    Parameters
+    ==========
+    root: path string
+    ignore: iterable of strings
+        fnmatch patterns of directory names not to descend into.
+        default: `default_ignore`
+    """
+
+    def __init__(self, root='.', ignore=default_ignore):
+        self.root = root
+        self.ignore = tuple(ignore)
+        self._listings = {}  # reldir -> (mtime, dirnames, filenames)
+
+    def _ignored(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.ignore)
+
+    def _list(self, path):
+        dirnames, filenames = [], []
+        scandir = getattr(os, 'scandir', None)
+        if scandir is None:
+            for name in os.listdir(path):
+                if os.path.isdir(os.path.join(path, name)) and \
+                   not os.path.islink(os.path.join(path, name)):
+                    dirnames.append(name)
+                else:
+                    filenames.append(name)
+        else:
+            for entry in scandir(path):
+                if entry.is_dir(follow_symlinks=False):
+                    dirnames.append(entry.name)
+                else:
+                    filenames.append(entry.name)
+        return sorted(d for d in dirnames if not self._ignored(d)), \
+            sorted(filenames)
+
+    def refresh(self):
+        """
+        Re-lists (only) changed directories.
+
+        Returns
+        =======
+        Number of directories listed.
+        """
+        old, new, nlisted = self._listings, {}, 0
+        pending = ['']
+        while pending:
+            reldir = pending.pop()
+            path = os.path.join(self.root, reldir)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:  # removed concurrently
+                continue
+            cached = old.get(reldir)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime,) + self._list(path)
+                nlisted += 1
+            new[reldir] = cached
+            pending.extend(os.path.join(reldir, d) for d in cached[1])
+        self._listings = new
+        return nlisted
+
+    def walk(self):
+        """ Yields (reldir, dirnames, filenames) in sorted order """
+        listings = self._listings
+        for reldir in sorted(listings):
+            yield (reldir,) + listings[reldir][1:]
+
+    def glob_at_depth(self, filename_glob):
+        """ Paths (relative to root) of files matching at any depth """
+        return [os.path.join(reldir, fn) for reldir, _, filenames in
+                self.walk() for fn in filenames
+                if fnmatch.fnmatch(fn, filename_glob)]
+
+    def glob(self, pathname):
+        """
+        Paths (relative to root) matching pathname (relative to root,
+        same rules as glob.glob: wildcards do not match '/' and hidden
+        names only match patterns starting with '.').
+        """
+        parts = [p for p in pathname.replace(os.sep, '/').split('/')
+                 if p not in ('', '.')]
+        listings = self._listings
+        matches = ['']
+        for idx, part in enumerate(parts):
+            last = idx == len(parts) - 1
+            new = []
+            for reldir in matches:
+                if reldir not in listings:
+                    continue
+                _, dirnames, filenames = listings[reldir]
+                names = dirnames + filenames if last else dirnames
+                for name in names:
+                    if (name.startswith('.') and not part.startswith('.')) \
+                       or not fnmatch.fnmatchcase(name, part):
+                        continue
+                    new.append(os.path.join(reldir, name))
+            matches = new
+        return sorted(m for m in matches if m)
+
+
+_directory_indices = {}
+_directory_indices_lock = threading.Lock()
+
+
+def get_directory_index(root='.', ignore=default_ignore):
+    """
+    Returns a refreshed (see `DirectoryIndex.refresh`) index of root,
+    indices are kept for the lifetime of the process.
+    """
+    key = (os.path.abspath(root), tuple(ignore))
+    with _directory_indices_lock:
+        if key not in _directory_indices:
+            _directory_indices[key] = DirectoryIndex(key[0], ignore)
+        index = _directory_indices[key]
+        index.refresh()
+    return index
+
+
 def glob_at_depth(filename_glob, cwd=None):
-    if cwd is not None:
-        cwd = '.'
-    globbed = []
-    for root, dirs, filenames in os.walk(cwd):
-        for fn in filenames:
-            if fnmatch.fnmatch(fn, filename_glob):
-                globbed.append(os.path.join(root, fn))
-    return globbed
+    """
+    Returns the paths (prefixed by cwd) of files matching filename_glob
+    at any depth below cwd (default: '.'), see `DirectoryIndex`.
+    """
+    cwd = cwd or '.'
+    return [os.path.join(cwd, path) for path in
+            get_directory_index(cwd).glob_at_depth(filename_glob)]
 
 
 def get_abspath(path, cwd=None):
@@ -71,6 +203,35 @@ def get_abspath(path, cwd=None):
         )
 
 
+def get_cache_dir(*subdirs):
+    """
+    Returns (and creates if missing) a directory for persistent caches.
+
+    The root is taken from the environment variable
+    PYCOMPILATION_CACHE_DIR, falling back to the user cache directory
+    given by ``appdirs`` (if installed) or ``~/.cache/pycompilation``.
+
+    Parameters
+    ==========
+    *subdirs: strings
+        path components appended to the cache root.
+    """
+    root = os.environ.get('PYCOMPILATION_CACHE_DIR', None)
+    if not root:
+        try:
+            from appdirs import user_cache_dir
+        except ImportError:
+            root = os.path.join(os.environ.get(
+                'XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                'pycompilation')
+        else:
+            root = user_cache_dir('pycompilation')
+    path = os.path.join(root, *subdirs)
+    if not os.path.isdir(path):
+        make_dirs(path)
+    return path
+
+
 def make_dirs(path, logger=None):
     if path[-1] == '/':
         parent = os.path.dirname(path[:-1])
@@ -234,6 +395,9 @@ def missing_or_other_newer(path, other_path, cwd=None):
     return False
 
 
+_metadata_lock = threading.RLock()  # guards metadata files (threaded builds)
+
+
 class HasMetaData(object):
     """
     Provides convenice classmethods for a class to pickle some metadata.
@@ -251,13 +415,14 @@ class HasMetaData(object):
         Get value of key in metadata file dict.
         """
         fullpath = os.path.join(dirpath, cls.metadata_filename)
-        if os.path.exists(fullpath):
-            with open(fullpath, 'rb') as ifh:
-                d = pickle.load(ifh)
-            return d[key]
-        else:
-            raise FileNotFoundError(
-                "No such file: {0}".format(fullpath))
+        with _metadata_lock:
+            if os.path.exists(fullpath):
+                with open(fullpath, 'rb') as ifh:
+                    d = pickle.load(ifh)
+                return d[key]
+            else:
+                raise FileNotFoundError(
+                    "No such file: {0}".format(fullpath))
 
     @classmethod
     def save_to_metadata_file(cls, dirpath, key, value):
@@ -265,15 +430,16 @@ class HasMetaData(object):
         Store `key: value` in metadata file dict.
         """
         fullpath = os.path.join(dirpath, cls.metadata_filename)
-        if os.path.exists(fullpath):
-            with open(fullpath, 'rb') as ifh:
-                d = pickle.load(ifh)
-            d.update({key: value})
-            with open(fullpath, 'wb') as ofh:
-                pickle.dump(d, ofh)
-        else:
-            with open(fullpath, 'wb') as ofh:
-                pickle.dump({key: value}, ofh)
+        with _metadata_lock:
+            if os.path.exists(fullpath):
+                with open(fullpath, 'rb') as ifh:
+                    d = pickle.load(ifh)
+                d.update({key: value})
+                with open(fullpath, 'wb') as ofh:
+                    pickle.dump(d, ofh)
+            else:
+                with open(fullpath, 'wb') as ofh:
+                    pickle.dump({key: value}, ofh)
 
 
 def MetaReaderWriter(filename):
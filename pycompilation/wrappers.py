@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+
+"""
+Generation of zero-copy Cython wrappers from C prototypes and Fortran
+``bind(c)`` procedures.
+
+Arrays are taken as typed memoryviews (no copies, C or Fortran
+contiguity and the dtype are checked by Cython), dimensions are derived
+from the shapes of the inputs and validated once, outputs are allocated
+unless passed as keyword arguments named after the kernel arguments and
+kernels are called with the GIL released::
+
+    mod = compile_link_import_strings([('mtxmul.f90', source)],
+                                      wrappers=True)
+    mod.do_mtxmul(A, B)  # A, B Fortran ordered, Out allocated
+    mod.do_mtxmul(A, B, Out=out)
+
+C prototypes need the shapes of their array arguments (names of integer
+arguments or integer literals), arrays without a shape are 1-D of
+unspecified length::
+
+    wrappers={'dot': dict(prototype='double dot(int n, const double * x, '
+                                    'const double * y)',
+                          shapes={'x': ('n',), 'y': ('n',)})}
+
+Const pointers (Fortran: intent(in)) are inputs, other pointers are
+outputs. Pointers to scalars (Fortran arguments without ``value``) are
+given the shape ``()``.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import re
+from collections import OrderedDict, namedtuple
+
+from .prototypes import (
+    Argument, Prototype, add_cython_code, cimport_lines, ctype_dtype_char,
+    parse_prototype, py_name
+)
+
+WrapperSpec = namedtuple('WrapperSpec', 'name prototype shapes order inout')
+
+# Kinds of iso_c_binding mapped to C types
+fortran_kinds = {
+    'c_int': 'int',
+    'c_short': 'short',
+    'c_long': 'long',
+    'c_long_long': 'long long',
+    'c_signed_char': 'signed char',
+    'c_size_t': 'size_t',
+    'c_int8_t': 'int8_t',
+    'c_int16_t': 'int16_t',
+    'c_int32_t': 'int32_t',
+    'c_int64_t': 'int64_t',
+    'c_float': 'float',
+    'c_double': 'double',
+    'c_long_double': 'long double',
+}
+
+_procedure_re = re.compile(
+    r'^\s*(?:(?P<prefix>[\w(), ]*?)\s+)?(?P<kind>subroutine|function)\s+'
+    r'(?P<name>\w+)\s*\((?P<args>[^)]*)\)(?P<suffix>.*)$', re.IGNORECASE)
+_bind_re = re.compile(r'bind\s*\(\s*c\s*(?:,\s*name\s*=\s*["\'](\w+)["\'])?'
+                      r'\s*\)', re.IGNORECASE)
+_result_re = re.compile(r'result\s*\(\s*(\w+)\s*\)', re.IGNORECASE)
+_end_re = re.compile(r'^\s*end\s*(subroutine|function)?\b', re.IGNORECASE)
+_type_re = re.compile(r'^\s*(integer|real|logical|complex)\s*\(\s*(?:kind\s*='
+                      r'\s*)?(\w+)\s*\)', re.IGNORECASE)
+
+
+def _fortran_lines(source):
+    """ Logical lines (continuations joined, comments stripped) """
+    lines, current = [], ''
+    for line in source.splitlines():
+        line = line.split('!', 1)[0].rstrip()
+        if current:
+            line = line.lstrip()
+            if line.startswith('&'):
+                line = line[1:]
+        if line.endswith('&'):
+            current += line[:-1]
+            continue
+        lines.append(current + line)
+        current = ''
+    return lines + ([current] if current else [])
+
+
+def _split_top(text):
+    """ Splits at commas not enclosed in parentheses """
+    parts, depth, current = [], 0, ''
+    for char in text:
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += char
+    return parts + ([current.strip()] if current.strip() else [])
+
+
+def _ctype(type_spec):
+    m = _type_re.match(type_spec)
+    if m is None or m.group(2).lower() not in fortran_kinds:
+        raise ValueError("Unsupported (non-interoperable) type: {}".format(
+            type_spec))
+    return fortran_kinds[m.group(2).lower()]
+
+
+def _fortran_dims(text, args):
+    dims = []
+    for d in _split_top(text):
+        d = d.strip().lower()
+        if re.match(r'^\d+$', d):
+            dims.append(int(d))
+        elif d in args:
+            dims.append(d)
+        elif d == '*':
+            dims.append(None)
+        else:
+            raise ValueError("Unsupported dimension: {}".format(d))
+    if None in dims[:-1] or (None in dims and len(dims) > 1):
+        raise ValueError("Only 1-D assumed size arrays supported")
+    return tuple(dims)
+
+
+def parse_fortran_interfaces(source):
+    """
+    Parses the ``bind(c)`` subroutines and functions in Fortran source.
+
+    Returns
+    -------
+    list of WrapperSpec instances (named after the C binding names) with
+    Fortran ordered shapes.
+    """
+    specs = []
+    lines = _fortran_lines(source)
+    idx = 0
+    while idx < len(lines):
+        m = _procedure_re.match(lines[idx])
+        idx += 1
+        if m is None or m.group('prefix') and re.search(
+                r'\bend\b', m.group('prefix'), re.IGNORECASE):
+            continue
+        bind = _bind_re.search(m.group('suffix'))
+        if bind is None:
+            continue
+        fname = m.group('name').lower()
+        original = OrderedDict((a.strip().lower(), a.strip()) for a in
+                               m.group('args').split(',') if a.strip())
+        names = list(original)
+        result = _result_re.search(m.group('suffix'))
+        result = result.group(1).lower() if result else fname
+        decls = {}  # name -> (ctype, attributes, dims)
+        while idx < len(lines) and not _end_re.match(lines[idx]):
+            line = lines[idx]
+            idx += 1
+            if '::' not in line:
+                continue
+            head, tail = line.split('::', 1)
+            attrs = [a.strip().lower() for a in _split_top(head)]
+            try:
+                ctype = _ctype(attrs[0])
+            except ValueError:
+                if any(e.split('(')[0].strip().lower() in names + [result]
+                       for e in _split_top(tail)):
+                    raise
+                continue
+            dimension = [a for a in attrs if a.startswith('dimension')]
+            for entity in _split_top(tail):
+                ename, _, dims = entity.partition('(')
+                ename = ename.strip().lower()
+                if dims:
+                    dims = dims.rsplit(')', 1)[0]
+                elif dimension:
+                    dims = dimension[0].split('(', 1)[1].rsplit(')', 1)[0]
+                decls[ename] = (ctype, attrs[1:], dims)
+        idx += 1
+        restype = 'void'
+        if m.group('kind').lower() == 'function':
+            if result in decls:
+                restype = decls[result][0]
+            else:
+                restype = _ctype(m.group('prefix') or '')
+        args, shapes, inout = [], OrderedDict(), []
+        for name in names:
+            if name not in decls:
+                raise ValueError("No declaration of {} in {}".format(
+                    name, fname))
+            ctype, attrs, dims = decls[name]
+            intent = [a for a in attrs if a.startswith('intent')]
+            intent = intent[0].split('(')[1].rstrip(')').strip() \
+                if intent else 'inout'
+            value = 'value' in attrs
+            if value and dims:
+                raise ValueError("value array {} in {}".format(name, fname))
+            args.append(Argument(original[name], ctype, not value,
+                                 not value and intent == 'in'))
+            if not value:
+                shape = tuple(original.get(d, d) for d in _fortran_dims(
+                    dims, names)) if dims else ()
+                if shape != (None,):
+                    shapes[original[name]] = shape
+                if intent == 'inout':
+                    inout.append(original[name])
+        cname = bind.group(1) or fname
+        specs.append(WrapperSpec(cname, Prototype(cname, restype, args),
+                                 shapes, 'F', tuple(inout)))
+    return specs
+
+
+def _spec(name, value):
+    if isinstance(value, str):
+        value = dict(prototype=value)
+    unknown = set(value) - set(['prototype', 'shapes', 'order', 'inout'])
+    if unknown:
+        raise ValueError("Unknown wrapper keys for {}: {}".format(
+            name, ', '.join(sorted(unknown))))
+    order = value.get('order', 'C')
+    if order not in ('C', 'F'):
+        raise ValueError("order must be 'C' or 'F'")
+    proto = parse_prototype(value['prototype'])
+    shapes = OrderedDict((k, tuple(v)) for k, v in sorted(
+        value.get('shapes', {}).items()))
+    arg_names = [a.name for a in proto.args]
+    for k, dims in shapes.items():
+        if k not in arg_names or not proto.args[arg_names.index(k)].pointer:
+            raise ValueError("{} is not a pointer argument of {}".format(
+                k, name))
+        for d in dims:
+            if not isinstance(d, int) and d not in arg_names:
+                raise ValueError("Unknown dimension {} of {}".format(d, k))
+    return WrapperSpec(name, proto, shapes, order,
+                       tuple(value.get('inout', ())))
+
+
+def _memoryview(a, ndim, order):
+    axes = [':']*ndim
+    if ndim:
+        axes[0 if order == 'F' else -1] = '::1'
+    return '{}{}[{}]'.format('const ' if a.const else '', a.ctype,
+                             ', '.join(axes or ['::1']))
+
+
+def wrapper_function(spec):
+    """ Returns Cython code of the def function wrapping spec """
+    proto, shapes = spec.prototype, spec.shapes
+
+    def is_array(a):
+        return a.pointer and shapes.get(a.name, (None,)) != ()
+
+    inputs = [a for a in proto.args if is_array(a) and a.const]
+    outputs = [a for a in proto.args if is_array(a) and not a.const]
+    dims = OrderedDict()  # dim name -> (array, axis) it is derived from
+    for a in inputs:
+        for axis, d in enumerate(shapes.get(a.name, ())):
+            if not isinstance(d, int) and d not in dims:
+                dims[d] = (a.name, axis)
+    scalar_outs = [a for a in proto.args if a.pointer and not a.const and
+                   not is_array(a) and a.name not in dims]
+    required, optional = [], []
+    for a in proto.args:
+        if a.name in dims or a in scalar_outs:
+            continue
+        if is_array(a):
+            view = '{} {}'.format(_memoryview(
+                a, len(shapes.get(a.name, (None,))), spec.order),
+                py_name(a.name))
+            if a.const or a.name not in shapes:
+                required.append(view)
+            else:
+                optional.append(view + '=None')
+        else:
+            required.append('{} {}'.format(a.ctype, py_name(a.name)))
+    lines = ['def {}({}):'.format(spec.name, ', '.join(required + optional))]
+    locals_ = [a for a in proto.args if not is_array(a)]
+    for a in locals_:
+        lines.append('    cdef {} _{}'.format(a.ctype, a.name))
+    for a in inputs + outputs:
+        lines.append('    cdef {}{} *_p_{} = NULL'.format(
+            'const ' if a.const else '', a.ctype, a.name))
+    for a in locals_:
+        if a.name in dims:
+            arr, axis = dims[a.name]
+            lines.append('    _{} = {}.shape[{}]'.format(
+                a.name, py_name(arr), axis))
+        elif a not in scalar_outs:
+            lines.append('    _{} = {}'.format(a.name, py_name(a.name)))
+
+    def dim_expr(d):
+        return str(d) if isinstance(d, int) else '_' + d
+
+    for a in outputs:
+        if a.name not in shapes:
+            continue
+        shape = [dim_expr(d) for d in shapes[a.name]]
+        lines += ['    if {} is None:'.format(py_name(a.name)),
+                  "        {} = _pyc_np.{}(({},), dtype={!r}, order={!r})"
+                  .format(py_name(a.name), 'zeros' if a.name in spec.inout
+                          else 'empty', ', '.join(shape),
+                          ctype_dtype_char[a.ctype], spec.order)]
+    for a in inputs + outputs:
+        for axis, d in enumerate(shapes.get(a.name, ())):
+            if dims.get(d) == (a.name, axis):
+                continue
+            lines += ['    if {}.shape[{}] != {}:'.format(
+                py_name(a.name), axis, dim_expr(d)),
+                '        raise ValueError("Shape of {} should be ({})")'
+                .format(a.name, ', '.join(map(str, shapes[a.name])))]
+    for a in inputs + outputs:
+        ndim = len(shapes.get(a.name, (None,)))
+        lines += ['    if {}:'.format(' and '.join(
+            '{}.shape[{}] > 0'.format(py_name(a.name), axis)
+            for axis in range(ndim))),
+            '        _p_{} = &{}[{}]'.format(a.name, py_name(a.name),
+                                             ', '.join(['0']*ndim))]
+    call = '_k_{}({})'.format(proto.name, ', '.join(
+        '_p_' + a.name if is_array(a) else
+        ('&_' if a.pointer else '_') + a.name for a in proto.args))
+    results = []
+    if proto.restype != 'void':
+        lines.append('    cdef {} _result'.format(proto.restype))
+        call = '_result = ' + call
+        results.append('_result')
+    lines += ['    with nogil:', '        ' + call]
+    results += ['_pyc_np.asarray({})'.format(py_name(a.name))
+                if is_array(a) else '_' + a.name for a in proto.args
+                if a in outputs or a in scalar_outs]
+    if len(results) == 1:
+        lines.append('    return ' + results[0])
+    elif results:
+        lines.append('    return ' + ', '.join(results))
+    return '\n'.join(lines)
+
+
+def wrapper_code(specs):
+    """
+    Returns Cython source of wrappers for WrapperSpec instances (see
+    `parse_fortran_interfaces` and `wrapper_codes`).
+    """
+    specs = list(specs)
+    used = set(a.ctype for s in specs for a in s.prototype.args) | set(
+        s.prototype.restype for s in specs)
+    lines = ['', '# Generated by pycompilation.wrappers, do not edit.']
+    lines += cimport_lines(used)
+    lines += ['import numpy as _pyc_np', '']
+    for s in specs:
+        p = s.prototype
+        lines.append('cdef extern {} _k_{} "{}" ({}) nogil'.format(
+            p.restype, p.name, p.name, ', '.join(
+                '{}{}{}'.format('const ' if a.const else '', a.ctype,
+                                ' *' if a.pointer else '') for a in p.args)))
+    for s in specs:
+        lines += ['', '', wrapper_function(s)]
+    return '\n'.join(lines) + '\n'
+
+
+def wrapper_codes(codes, wrappers, extname=None):
+    """
+    Adds zero-copy wrappers to code strings.
+
+    The wrappers are appended to the last code string if it is a Cython
+    source, otherwise a Cython source named after extname is added.
+
+    Parameters
+    ----------
+    codes: iterable of name/source pair tuples
+    wrappers: dict or True
+        wrapper names mapped to a prototype string or a dict with the keys
+        'prototype', 'shapes' (argument names mapped to tuples of
+        dimensions), 'order' ('C' or 'F') and 'inout' (names of outputs
+        allocated zeroed). True wraps all ``bind(c)`` procedures of the
+        Fortran code strings.
+    extname: string
+        name of the extension module, default: taken from the last code
+        string
+
+    Returns
+    -------
+    (codes, extname)
+    """
+    from .compilation import any_fort
+    codes = list(codes)
+    if wrappers is True:
+        specs = [s for name, code_ in codes if any_fort([name])
+                 for s in parse_fortran_interfaces(code_)]
+        if not specs:
+            raise ValueError("No bind(c) procedures found")
+    else:
+        specs = [_spec(name, value) for name, value in
+                 sorted(wrappers.items())]
+    return add_cython_code(codes, wrapper_code(specs), extname, '_wrappers')